@@ -4,10 +4,68 @@ import statsmodels.api as sm
 import statsmodels.formula.api as smf
 import matplotlib.pyplot as plt
 import seaborn as sns
-import glob
 import os
+import sys
 import json
 
+# Shared NHANES helpers: repo root locally, mounted at /nhanes_lib in the vault
+LIB_ROOT = os.environ.get(
+    "NHANES_LIB_ROOT",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")),
+)
+if LIB_ROOT not in sys.path:
+    sys.path.insert(0, LIB_ROOT)
+
+from nhanes_lib.categorical import category_table  # noqa: E402
+from nhanes_lib.codebook import (  # noqa: E402
+    load_codebook,
+    mask_special_codes,
+    report_masked,
+)
+from nhanes_lib.exclusions import (  # noqa: E402
+    complete_cases,
+    criteria_bits,
+    evaluate_criteria,
+    exclusion_sensitivity,
+    select_rows,
+    subset_mask,
+    within_z,
+)
+from nhanes_lib.harmonize import (  # noqa: E402
+    harmonize,
+    load_harmonization,
+    source_variables,
+)
+from nhanes_lib.join import merge_on_seqn  # noqa: E402
+from nhanes_lib.loaders import (  # noqa: E402
+    apply_criteria,
+    find_domain_file,
+    load_domain,
+)
+from nhanes_lib.missingness import (  # noqa: E402
+    missingness_profile,
+    report_missingness,
+)
+from nhanes_lib.parallel import map_captured  # noqa: E402
+from nhanes_lib.partitions import (  # noqa: E402
+    load_partition,
+    partition_key,
+    save_partition,
+)
+from nhanes_lib.periodontal import (  # noqa: E402
+    DEFINITIONS,
+    classify,
+    extent_severity,
+    site_tensor,
+)
+from nhanes_lib.recode import apply_recodes  # noqa: E402
+from nhanes_lib.schema import (  # noqa: E402
+    compact_dtypes,
+    drop_unused_categories,
+    memory_report,
+)
+from nhanes_lib.survey import design_table, survey_design  # noqa: E402
+
 # ==========================================
 # Configuration & Constants
 # ==========================================
@@ -58,88 +116,275 @@ INTERPROXIMAL_SUFFIXES = ["D", "S", "P", "A"]
 # All sites for completeness check or other uses if needed
 ALL_SUFFIXES = ["D", "M", "S", "P", "L", "A"]
 
+# Variables read from each domain (SEQN is always included).
+# Keep in sync with process_data() and apply_exclusions().
+STUDY_VARIABLES = {
+    "DEMO": [
+        "RIDAGEYR",
+        "RIAGENDR",
+        "RIDRETH1",
+        "DMDEDUC2",
+        "INDFMPIR",
+        "WTMEC2YR",
+        "SDMVSTRA",
+        "SDMVPSU",
+    ],
+    "DR1TOT": ["DR1DRSTZ", "DR1TKCAL", "DR1TSUGR", "DR1TFIBE", "DR1TVC", "DR1TCALC"],
+    "OHXPER": ["OHDDESTS"]
+    + [
+        f"OHX{tooth:02d}{measure}{suffix}"
+        for tooth in TEETH
+        for measure in ["LA", "PC"]
+        for suffix in ALL_SUFFIXES
+    ],
+    "BMX": ["BMXBMI"],
+    "SMQ": ["SMQ020", "SMQ040"],
+    "DIQ": ["DIQ010"],
+    "ALQ": ["ALQ101", "ALQ130"],
+    "PAQ": ["PAQ605", "PAQ620"],
+    "OHQ": ["OHQ870"],
+}
+
+# Covariate recodes (nhanes_lib.recode spec), applied in order by
+# process_data(). Refused/don't-know codes are already NaN at this point
+# (masked on load from nhanes_lib/codebook.json).
+COVARIATE_RECODES = [
+    # Race/Ethnicity
+    {
+        "name": "race",
+        "source": "RIDRETH1",
+        "map": [
+            [1, "Mexican American"],
+            [2, "Other Hispanic"],
+            [3, "Non-Hispanic White"],
+            [4, "Non-Hispanic Black"],
+            [5, "Other"],
+        ],
+    },
+    # Education (1-2=<HS, 3=HS/GED, 4-5=>HS)
+    {
+        "name": "education",
+        "source": "DMDEDUC2",
+        "map": [[[1, 2], "<HS"], [3, "HS/GED"], [[4, 5], ">HS"]],
+    },
+    # Smoking
+    # Current: SMQ040 in [1,2]
+    # Former: SMQ020=1 AND SMQ040=3
+    # Never: SMQ020=2
+    {
+        "name": "smoking",
+        "rules": [
+            [{"SMQ020": "missing"}, None],
+            [{"SMQ040": [1, 2]}, "Current"],
+            [{"SMQ020": 1, "SMQ040": 3}, "Former"],
+            [{"SMQ020": 2}, "Never"],
+        ],
+    },
+    # Diabetes
+    # DIQ010 (1=Yes, 2=No, 3=Borderline -> No)
+    {"name": "diabetes", "source": "DIQ010", "map": [[1, "Yes"], [[2, 3], "No"]]},
+    # Alcohol
+    # ALQ130 (avg drinks/day). If ALQ101 (Had >12 drinks/life) is 2 (No),
+    # alcohol consumption is 0; otherwise ALQ130.
+    {
+        "name": "alcohol",
+        "rules": [[{"ALQ101": 2}, 0]],
+        "default": {"column": "ALQ130"},
+    },
+    # Physical Activity
+    # Plan says: "PAQ605=1 OR PAQ620=1 -> Active; else Inactive."
+    {
+        "name": "physical_activity",
+        "rules": [
+            [{"any": [{"PAQ605": 1}, {"PAQ620": 1}]}, "Active"],
+            [{"PAQ605": "missing", "PAQ620": "missing"}, None],
+        ],
+        "default": "Inactive",
+    },
+    # Flossing
+    # OHQ870 (days/week): 0 (Never), 1-3 (Infrequent), 4-6 (Frequent),
+    # 7 (Daily)
+    {
+        "name": "flossing",
+        "rules": [
+            [{"OHQ870": 0}, "Never"],
+            [{"OHQ870": {"ge": 1, "le": 3}}, "Infrequent"],
+            [{"OHQ870": {"ge": 4, "le": 6}}, "Frequent"],
+            [{"OHQ870": 7}, "Daily"],
+        ],
+    },
+]
+
+# Inclusion criteria applied to DEMO before any other domain is read, as
+# (flow-count label, predicate); only eligible SEQNs are loaded and merged
+DEMO_CRITERIA = [
+    ("2_Age_ge_30", lambda demo: demo["RIDAGEYR"] >= 30),
+]
+
+# Partition store namespace: each cycle is stored merged and recoded
+PARTITION_STUDY = "001-diet-periodontitis"
+
 # ==========================================
 # 1. Data Loading & Merging
 # ==========================================
 
 
-def load_dataset(prefix, cycle):
-    """Load a dataset for a specific cycle."""
-    # Handle cases where filename suffix might vary slightly or file extension case
-    # Try constructing the path
-    # Expected format: PREFIX_CYCLE.csv
+def load_dataset(prefix, cycle, seqn=None):
+    """Load the study variables of a dataset for a specific cycle."""
+    # Expected format: PREFIX_CYCLE.csv (extension case may vary). Reads come
+    # from the shared warehouse or the columnar cache; columns are uppercase.
+    # Variables renamed in this cycle are read under the cycle's own names.
     filename = f"{prefix}_{cycle}.csv"
-    path = os.path.join(DATA_DIR, filename)
-
-    if not os.path.exists(path):
-        # Try finding case-insensitive match
-        search_pattern = os.path.join(DATA_DIR, f"{prefix}_{cycle}.*")
-        matches = glob.glob(search_pattern)
-        # Filter for case-insensitive match on extension csv
-        matches = [m for m in matches if m.lower().endswith(".csv")]
-
-        if not matches:
-            print(f"Warning: File {filename} not found.")
-            return None
-        path = matches[0]
+    columns = source_variables(STUDY_VARIABLES[prefix], cycle)
 
     try:
-        df = pd.read_csv(path)
-        # Uppercase columns for consistency
-        df.columns = df.columns.str.upper()
-        return df
+        df = load_domain(prefix, cycle, DATA_DIR, columns=columns, seqn=seqn)
     except Exception as e:
-        print(f"Error reading {path}: {e}")
+        print(f"Error reading {filename}: {e}")
         return None
 
+    if df is None:
+        print(f"Warning: File {filename} not found.")
+    return df
+
+
+def _load_dataset_task(task):
+    """Process-pool entry point: task is a (prefix, cycle, seqn) triple."""
+    return load_dataset(*task)
+
+
+def cycle_partition_key(cycle):
+    """Key of a cycle's stored partition: its source files and definition."""
+    inputs = [find_domain_file(prefix, cycle, DATA_DIR) for prefix in STUDY_VARIABLES]
+    definition = [
+        STUDY_VARIABLES,
+        DEMO_CRITERIA,
+        TEETH,
+        INTERPROXIMAL_SUFFIXES,
+        ALL_SUFFIXES,
+        load_dataset,
+        merge_cycles,
+        load_harmonization(),
+        load_codebook(),
+        DEFINITIONS,
+        COVARIATE_RECODES,
+        process_data,
+    ]
+    return partition_key(inputs, definition)
+
 
 def merge_cycles():
-    """Load and merge all datasets across cycles."""
-    merged_dfs = []
+    """
+    Load, merge and recode all datasets across cycles.
+
+    Each cycle is a stored partition (merged and passed through
+    process_data()); only cycles that are new or whose files changed are
+    loaded. For those, DEMO is read first and the inclusion criteria are
+    applied to it; the other domains are then read for the eligible SEQNs
+    only. Refused/don't-know codes are masked (codebook.json) before any
+    recode. Returns the stacked frame, the DEMO-based flow counts (total
+    population and after each criterion) and the masked-value counts per
+    cycle and variable.
+    """
+    keys = {cycle: cycle_partition_key(cycle) for cycle in CYCLES}
+    stored = {
+        cycle: load_partition(PARTITION_STUDY, cycle, keys[cycle]) for cycle in CYCLES
+    }
+    stale = [cycle for cycle in CYCLES if stored[cycle] is None]
+
+    # DEMO of every stale cycle in parallel (NHANES_LOAD_WORKERS)
+    demo_loaded = map_captured(_load_dataset_task, [("DEMO", c, None) for c in stale])
+
+    cycle_counts, masked = {}, {}
+    loaded = {}
+    for cycle, (demo, output) in zip(stale, demo_loaded):
+        if demo is not None:
+            total = len(demo)
+            demo, counts = apply_criteria(demo, DEMO_CRITERIA)
+            cycle_counts[cycle] = {"1_Total_Population": total, **counts}
+        loaded[("DEMO", cycle)] = (demo, output)
+
+    # Then every other domain file, semi-joined to the eligible SEQNs while
+    # reading; each read's messages are replayed under its cycle below
+    tasks = [
+        (prefix, cycle, loaded[("DEMO", cycle)][0]["SEQN"].to_numpy())
+        for cycle in stale
+        if loaded[("DEMO", cycle)][0] is not None
+        for prefix in STUDY_VARIABLES
+        if prefix != "DEMO"
+    ]
+    for task, result in zip(tasks, map_captured(_load_dataset_task, tasks)):
+        loaded[task[:2]] = result
 
+    study_columns = [v for variables in STUDY_VARIABLES.values() for v in variables]
+    partitions, absent = [], {}
     for cycle in CYCLES:
         print(f"Processing Cycle {cycle}...")
 
-        # Load domains
-        demo = load_dataset("DEMO", cycle)
-        dr1 = load_dataset("DR1TOT", cycle)
-        ohxper = load_dataset("OHXPER", cycle)
-        bmx = load_dataset("BMX", cycle)
-        smq = load_dataset("SMQ", cycle)
-        diq = load_dataset("DIQ", cycle)
-        alq = load_dataset("ALQ", cycle)
-        paq = load_dataset("PAQ", cycle)
-        ohq = load_dataset("OHQ", cycle)
+        if stored[cycle] is not None:
+            print("  Stored partition is current.")
+            cycle_df, extra = stored[cycle]
+            cycle_counts[cycle] = extra["counts"]
+            masked[cycle] = extra["masked"]
+            absent[cycle] = set(extra["absent"])
+            partitions.append(cycle_df)
+            continue
 
+        demo, output = loaded[("DEMO", cycle)]
+        sys.stdout.write(output)
         if demo is None:
             print(f"Critical: DEMO_{cycle} missing. Skipping cycle.")
             continue
 
-        # Start with DEMO
-        cycle_df = demo
-
-        # Merge other domains
-        for name, df in [
-            ("DR1TOT", dr1),
-            ("OHXPER", ohxper),
-            ("BMX", bmx),
-            ("SMQ", smq),
-            ("DIQ", diq),
-            ("ALQ", alq),
-            ("PAQ", paq),
-            ("OHQ", ohq),
-        ]:
-            if df is not None:
-                # Merge on SEQN
-                cycle_df = pd.merge(cycle_df, df, on="SEQN", how="left")
-
-        merged_dfs.append(cycle_df)
-
-    if not merged_dfs:
+        # Load domains
+        datasets = {}
+        for prefix in STUDY_VARIABLES:
+            if prefix == "DEMO":
+                continue
+            df, output = loaded[(prefix, cycle)]
+            sys.stdout.write(output)
+            datasets[prefix] = df
+
+        # Left-join the other domains onto DEMO on SEQN in one pass, then
+        # back to the canonical variable names (harmonize.json)
+        cycle_df = merge_on_seqn(demo, datasets)
+        cycle_df["cycle"] = cycle
+        cycle_df, harmonized = harmonize(cycle_df, cycle)
+        for name, sources in harmonized.items():
+            print(f"  Harmonized: {', '.join(sources)} -> {name}")
+
+        # Variables this cycle lacks are NaN here, as they are in the stacked
+        # frame when another cycle has them
+        absent[cycle] = {v for v in study_columns if v not in cycle_df.columns}
+        cycle_df = cycle_df.reindex(columns=[*cycle_df.columns, *sorted(absent[cycle])])
+
+        # Special codes -> NaN, compact codes (float32/int8 instead of
+        # float64), then recode
+        cycle_df, masked[cycle] = mask_special_codes(cycle_df, cycle)
+        report_masked(masked[cycle])
+        cycle_df = process_data(compact_dtypes(cycle_df))
+        extra = {
+            "counts": cycle_counts[cycle],
+            "absent": sorted(absent[cycle]),
+            "masked": masked[cycle],
+        }
+        save_partition(PARTITION_STUDY, cycle, keys[cycle], cycle_df, extra)
+        partitions.append(cycle_df)
+
+    if not partitions:
         raise ValueError("No data loaded!")
 
-    final_df = pd.concat(merged_dfs, ignore_index=True)
-    return final_df
+    flow_counts = {"1_Total_Population": 0}
+    flow_counts.update({label: 0 for label, _ in DEMO_CRITERIA})
+    for counts in cycle_counts.values():
+        for label, n in counts.items():
+            flow_counts[label] += n
+
+    # Variables no cycle has stay out of the stacked frame
+    never = set.intersection(*absent.values())
+    final_df = pd.concat(partitions, ignore_index=True)
+    final_df = final_df.drop(columns=[c for c in final_df.columns if c in never])
+    return final_df, flow_counts, masked
 
 
 # ==========================================
@@ -147,86 +392,6 @@ def merge_cycles():
 # ==========================================
 
 
-def calculate_periodontitis_status(row):
-    """
-    Determine periodontitis status based on CDC/AAP definitions.
-    Returns: 3 (Severe), 2 (Moderate), 1 (Mild), 0 (None/No Disease), np.nan (Missing)
-    """
-    # Check if perio exam is complete enough?
-    # We rely on exclusion criteria for broad exclusion, but here we calculate based on available data.
-
-    # Store sites for CAL and PD
-    cal_sites_ge_6 = set()  # (tooth, site) tuples
-    cal_sites_ge_4 = set()
-    cal_sites_ge_3 = set()
-
-    pd_sites_ge_5 = set()
-    pd_sites_ge_4 = set()
-
-    for tooth in TEETH:
-        tooth_str = f"{tooth:02d}"
-
-        for suffix in INTERPROXIMAL_SUFFIXES:
-            # Variable names
-            cal_var = f"OHX{tooth_str}LA{suffix}"
-            pd_var = f"OHX{tooth_str}PC{suffix}"
-
-            # Check CAL
-            if cal_var in row and not pd.isna(row[cal_var]):
-                cal_val = row[cal_var]
-                if cal_val >= 6:
-                    cal_sites_ge_6.add((tooth, suffix))
-                if cal_val >= 4:
-                    cal_sites_ge_4.add((tooth, suffix))
-                if cal_val >= 3:
-                    cal_sites_ge_3.add((tooth, suffix))
-
-            # Check PD
-            if pd_var in row and not pd.isna(row[pd_var]):
-                pd_val = row[pd_var]
-                if pd_val >= 5:
-                    pd_sites_ge_5.add((tooth, suffix))
-                if pd_val >= 4:
-                    pd_sites_ge_4.add((tooth, suffix))
-
-    # Helper to check "not on same tooth"
-    def count_unique_teeth(site_set):
-        return len(set(t for t, s in site_set))
-
-    # Severe: >=2 interproximal sites with CAL >=6mm (not same tooth) AND >=1 interproximal site with PD >=5mm
-    is_severe = (count_unique_teeth(cal_sites_ge_6) >= 2) and (len(pd_sites_ge_5) >= 1)
-    if is_severe:
-        return 3  # Severe
-
-    # Moderate: >=2 interproximal sites with CAL >=4mm (not same tooth) OR >=2 interproximal sites with PD >=5mm (not same tooth)
-    is_moderate = (count_unique_teeth(cal_sites_ge_4) >= 2) or (
-        count_unique_teeth(pd_sites_ge_5) >= 2
-    )
-    if is_moderate:
-        return 2  # Moderate
-
-    # Mild: >=2 interproximal sites with CAL >=3mm AND >=2 interproximal sites with PD >=4mm (not same tooth) OR 1 site PD >=5mm
-    # Note: ">=2 interproximal sites with CAL >=3mm" usually implies "not same tooth" in CDC definitions,
-    # but the prompt says: ">=2 interproximal sites with CAL >=3mm AND >=2 interproximal sites with PD >=4mm (not same tooth)"
-    # It might mean the PD condition requires unique teeth, or both.
-    # Standard CDC/AAP Mild: >=2 interproximal sites with AL >=3mm AND (>=2 interproximal sites with PD >=4mm (not on same tooth) OR 1 site with PD >=5mm).
-    # I will assume "not same tooth" applies to the PD part as explicitly stated, but usually AL part also implies it for robustness.
-    # However, strict reading: AL part doesn't say "not same tooth". But let's assume it does to be consistent with Mod/Severe logic usually.
-    # Actually, CDC Page says: "Mild periodontitis: ≥2 interproximal sites with AL ≥3 mm, and ≥2 interproximal sites with PD ≥4 mm (not on same tooth) or one site with PD ≥5 mm."
-    # So AL part doesn't specify unique teeth. But let's check standard implementation. usually it is unique teeth for AL too.
-    # I will stick to the text: ">=2 interproximal sites with CAL >=3mm" (raw count)
-
-    cond_cal_mild = len(cal_sites_ge_3) >= 2
-    cond_pd_mild_1 = count_unique_teeth(pd_sites_ge_4) >= 2
-    cond_pd_mild_2 = len(pd_sites_ge_5) >= 1
-
-    is_mild = cond_cal_mild and (cond_pd_mild_1 or cond_pd_mild_2)
-    if is_mild:
-        return 1  # Mild
-
-    return 0  # None
-
-
 def process_data(df):
     """
     Apply variable transformations and create derived variables.
@@ -234,125 +399,31 @@ def process_data(df):
     print("Creating derived variables...")
 
     # 1. Periodontitis Status
-    # Apply row-wise. This is slow but safe.
-    df["perio_status_raw"] = df.apply(calculate_periodontitis_status, axis=1)
-
-    # Binary Outcome: 1 if Mod/Severe, 0 if Mild/None
-    df["perio_case"] = df["perio_status_raw"].apply(lambda x: 1 if x >= 2 else 0)
-
-    # 2. Demographics & Covariates
-
-    # Race/Ethnicity
-    race_map = {
-        1: "Mexican American",
-        2: "Other Hispanic",
-        3: "Non-Hispanic White",
-        4: "Non-Hispanic Black",
-        5: "Other",
-    }
-    df["race"] = df["RIDRETH1"].map(race_map)
-
-    # Education (1-2=<HS, 3=HS/GED, 4-5=>HS)
-    def recode_edu(x):
-        if pd.isna(x):
-            return np.nan
-        if x <= 2:
-            return "<HS"
-        if x == 3:
-            return "HS/GED"
-        if x >= 4:
-            return ">HS"
-        return np.nan  # 7,9 are missing/refused usually, handled later
-
-    df["education"] = df["DMDEDUC2"].apply(recode_edu)
-
-    # Smoking
-    # Current: SMQ040 in [1,2]
-    # Former: SMQ020=1 AND SMQ040=3
-    # Never: SMQ020=2
-    def recode_smoking(row):
-        smq020 = row.get("SMQ020", np.nan)
-        smq040 = row.get("SMQ040", np.nan)
-
-        if pd.isna(smq020):
-            return np.nan
-
-        if smq040 in [1, 2]:
-            return "Current"
-        if smq020 == 1 and smq040 == 3:
-            return "Former"
-        if smq020 == 2:
-            return "Never"
-        return np.nan
+    # All participants at once over a participant x tooth x site tensor;
+    # every case definition shares its threshold masks
+    tensor = site_tensor(df, TEETH, ALL_SUFFIXES)
+    definitions = classify(tensor, interproximal=INTERPROXIMAL_SUFFIXES)
+    df["perio_status_raw"] = definitions["cdc_aap_2012"]
 
-    df["smoking"] = df.apply(recode_smoking, axis=1)
+    # Sensitivity definitions: mild CAL criterion on >= 2 teeth, and the
+    # approximate 2017 AAP/EFP stage (0 = no case, 1-4 = stage I-IV)
+    df["perio_status_unique_teeth"] = definitions["cdc_aap_2012_unique_teeth"]
+    df["perio_stage_2017"] = definitions["aap_efp_2017_stage"]
 
-    # Diabetes
-    # DIQ010 (1=Yes, 2=No, 3=Borderline -> No)
-    def recode_diabetes(x):
-        if pd.isna(x):
-            return np.nan
-        if x == 1:
-            return "Yes"
-        if x in [2, 3]:
-            return "No"
-        return np.nan
-
-    df["diabetes"] = df["DIQ010"].apply(recode_diabetes)
-
-    # Alcohol
-    # ALQ130 (avg drinks/day). Impute 0 for non-drinkers?
-    # ALQ101=2 (Had at least 12 drinks in lifetime? No -> Non-drinker)
-    # ALQ120Q/U (How often drink?)
-    # The plan says: "Continuous ALQ130. Impute 0 for non-drinkers if needed."
-    # If ALQ130 is missing but ALQ101=2 (Never) or ALQ120=0 (Never in last year), set to 0.
-    # We will assume simple imputation: fillna(0) if ALQ101==2.
-    df["alcohol"] = df["ALQ130"]
-    # If ALQ101 (Had >12 drinks/life) is 2 (No), then alcohol consumption is 0
-    if "ALQ101" in df.columns:
-        df.loc[df["ALQ101"] == 2, "alcohol"] = 0
-    # Also if ALQ120Q (how often) == 0, then 0.
-    # Note: ALQ130 values 777/999 are missing.
-    df.loc[df["alcohol"] >= 777, "alcohol"] = np.nan
-
-    # Physical Activity
-    # PAQ605=1 (Vigorous work) OR PAQ620=1 (Moderate work) -> Active?
-    # Wait, usually PA includes recreational (PAQ650, PAQ665).
-    # Plan says: "PAQ605=1 OR PAQ620=1 -> Active; else Inactive."
-    # We follow the plan strictly.
-    def recode_pa(row):
-        paq605 = row.get("PAQ605", np.nan)
-        paq620 = row.get("PAQ620", np.nan)
-
-        if paq605 == 1 or paq620 == 1:
-            return "Active"
-        if pd.isna(paq605) and pd.isna(paq620):
-            return np.nan
-        return "Inactive"
+    # Binary Outcome: 1 if Mod/Severe, 0 if Mild/None
+    df["perio_case"] = (df["perio_status_raw"] >= 2).astype(np.int64)
 
-    df["physical_activity"] = df.apply(recode_pa, axis=1)
+    # Extent/severity over all six sites per tooth: mean CAL/PD, % sites
+    # with CAL >= 3/4/6 mm, worst site, teeth present
+    metrics = extent_severity(tensor)
+    for name in metrics.columns:
+        df[name] = metrics[name]
 
-    # Flossing
-    # OHQ870 (days/week).
-    # Categorize: 0 (Never), 1-3 (Infrequent), 4-6 (Frequent), 7 (Daily).
-    def recode_flossing(x):
-        if pd.isna(x) or x > 7:
-            return np.nan  # 99=Refused
-        if x == 0:
-            return "Never"
-        if 1 <= x <= 3:
-            return "Infrequent"
-        if 4 <= x <= 6:
-            return "Frequent"
-        if x == 7:
-            return "Daily"
-        return np.nan
-
-    df["flossing"] = df["OHQ870"].apply(recode_flossing)
+    # 2. Demographics & Covariates
 
-    # Weight
-    # WTMEC6YR = WTMEC2YR / 3
-    df["weight"] = df["WTMEC2YR"] / 3
+    # Race/ethnicity, education, smoking, diabetes, alcohol, physical
+    # activity and flossing (see COVARIATE_RECODES)
+    df = apply_recodes(df, COVARIATE_RECODES)
 
     # Exposures
     # DR1TSUGR, DR1TFIBE, DR1TVC, DR1TCALC
@@ -375,7 +446,22 @@ def process_data(df):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
-    return df
+    # Recoded labels -> categoricals, derived flags -> small ints
+    return compact_dtypes(df)
+
+
+def pool_cycles(df):
+    """Steps that depend on the pooled cycles, run after the partitions are stacked."""
+    # Weight
+    # WTMEC6YR = WTMEC2YR / 3 (number of pooled cycles)
+    df["weight"] = df["WTMEC2YR"] / len(CYCLES)
+
+    # Design: masked variance strata and PSUs (unique across cycles)
+    df["stratum"] = df["SDMVSTRA"]
+    df["psu"] = df["SDMVPSU"]
+
+    # Labels whose categories differ between partitions -> categoricals again
+    return compact_dtypes(df)
 
 
 # ==========================================
@@ -383,89 +469,156 @@ def process_data(df):
 # ==========================================
 
 
-def apply_exclusions(df):
-    flow_counts = {}
+# Columns of the analytic sample (descriptives and models), gathered once
+# after the exclusions
+ANALYTIC_COLUMNS = [
+    "SEQN",
+    "perio_case",
+    "perio_status_raw",
+    "perio_status_unique_teeth",
+    "perio_stage_2017",
+    "RIDAGEYR",
+    "RIAGENDR",
+    "race",
+    "education",
+    "smoking",
+    "diabetes",
+    "alcohol",
+    "physical_activity",
+    "flossing",
+    "BMXBMI",
+    "INDFMPIR",
+    "DR1TSUGR",
+    "DR1TFIBE",
+    "DR1TVC",
+    "DR1TCALC",
+    "DR1TKCAL",
+    "weight",
+    "stratum",
+    "psu",
+]
 
-    # 1. Total Population
-    n_total = len(df)
-    flow_counts["1_Total_Population"] = n_total
-    print(f"Total Population: {n_total}")
 
-    # 2. Age Filter: Age >= 30
-    df = df[df["RIDAGEYR"] >= 30].copy()
-    n_age = len(df)
-    flow_counts["2_Age_ge_30"] = n_age
-    print(f"After Age >= 30: {n_age}")
-
-    # 3. Periodontal Exam: OHDDESTS == 1 (Complete)
-    # Check column name, might be OHDEXSTS in some cycles/dictionaries, but plan says OHDDESTS.
-    # In OHXPER_F dictionary, it was OHDEXSTS (Overall) and OHDPDSTS (Perio status).
-    # Plan says "OHDDESTS != 1". I will check available columns.
-    if "OHDDESTS" in df.columns:
-        df = df[df["OHDDESTS"] == 1].copy()
-    elif "OHDEXSTS" in df.columns:
-        df = df[df["OHDEXSTS"] == 1].copy()
-    else:
-        print(
-            "Warning: Neither OHDDESTS nor OHDEXSTS found. Skipping perio status check."
-        )
+# Variables of the complete-case criterion
+COVARIATES = [
+    "perio_case",
+    "race",
+    "education",
+    "smoking",
+    "diabetes",
+    "alcohol",
+    "physical_activity",
+    "flossing",
+    "BMXBMI",
+    "INDFMPIR",
+    "DR1TSUGR",
+    "DR1TFIBE",
+    "DR1TVC",
+    "DR1TCALC",
+    "DR1TKCAL",
+]
 
-    n_perio = len(df)
-    flow_counts["3_Perio_Exam_Complete"] = n_perio
-    print(f"After Perio Complete: {n_perio}")
-
-    # 4. Dietary Recall: DR1DRSTZ == 1 (Reliable)
-    df = df[df["DR1DRSTZ"] == 1].copy()
-    n_diet = len(df)
-    flow_counts["4_Diet_Reliable"] = n_diet
-    print(f"After Diet Reliable: {n_diet}")
-
-    # 5. Missing Covariates
-    covariates = [
-        "perio_case",
-        "race",
-        "education",
-        "smoking",
-        "diabetes",
-        "alcohol",
-        "physical_activity",
-        "flossing",
-        "BMXBMI",
-        "INDFMPIR",
-        "DR1TSUGR",
-        "DR1TFIBE",
-        "DR1TVC",
-        "DR1TCALC",
-        "DR1TKCAL",
-    ]
 
-    df_clean = df.dropna(subset=covariates).copy()
-    n_complete = len(df_clean)
-    flow_counts["5_Complete_Data"] = n_complete
-    print(f"After Complete Data: {n_complete}")
+def perio_exam_complete(df, keep):
+    """OHDDESTS == 1 (Complete); every row passes if no cycle has OHDDESTS."""
+    if "OHDDESTS" not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    return df["OHDDESTS"] == 1
+
 
+def exclusion_criteria():
+    """
+    Exclusion criteria after the DEMO criteria, in flow order, as
+    (flow-count label, predicate) masks over the merged frame.
+    """
     # 6. Dietary Outliers: > 4 SD
-    # Check Total Energy (DR1TKCAL) and key nutrients (Sugar, Fiber, VitC, Calc)
-    # Calculate Z-scores
+    # Total Energy (DR1TKCAL) and key nutrients (Sugar, Fiber, VitC, Calc),
+    # z-scores over the complete cases
     nutrients = ["DR1TSUGR", "DR1TFIBE", "DR1TVC", "DR1TCALC", "DR1TKCAL"]
-    mask_outlier = pd.Series(False, index=df_clean.index)
 
-    for nut in nutrients:
-        mean = df_clean[nut].mean()
-        std = df_clean[nut].std()
-        z_score = (df_clean[nut] - mean) / std
-        mask_outlier |= z_score.abs() > 4
+    return [
+        # 3. Periodontal Exam: OHDDESTS == 1 (Complete); OHDEXSTS in
+        # 2009-2010 is read as OHDDESTS (harmonize.json)
+        ("3_Perio_Exam_Complete", perio_exam_complete),
+        # 4. Dietary Recall: DR1DRSTZ == 1 (Reliable)
+        ("4_Diet_Reliable", lambda df, keep: df["DR1DRSTZ"] == 1),
+        # 5. Missing Covariates
+        ("5_Complete_Data", complete_cases(COVARIATES)),
+        ("6_No_Diet_Outliers", within_z(nutrients, 4)),
+    ]
+
+
+def apply_exclusions(df, demo_counts):
+    # df only holds participants passing DEMO_CRITERIA (applied while
+    # loading); their counts come from merge_cycles()
+    flow_counts = dict(demo_counts)
+
+    # 1. Total Population
+    print(f"Total Population: {flow_counts['1_Total_Population']}")
 
-    df_final = df_clean[~mask_outlier].copy()
-    n_final = len(df_final)
-    flow_counts["6_No_Diet_Outliers"] = n_final
-    print(f"After Outlier Exclusion: {n_final}")
+    # 2. Age Filter: Age >= 30
+    print(f"After Age >= 30: {flow_counts['2_Age_ge_30']}")
 
-    flow_counts["7_Final_Analytical_Sample"] = n_final
+    # Each criterion is a mask over the merged frame; counts come from the
+    # cumulative ANDs and the sample is gathered once at the end
+    if "OHDDESTS" not in df.columns:
+        print(
+            "Warning: Neither OHDDESTS nor OHDEXSTS found. Skipping perio status check."
+        )
+    criteria = exclusion_criteria()
+    keep, counts = evaluate_criteria(df, criteria)
+    flow_counts.update(counts)
+    print(f"After Perio Complete: {counts['3_Perio_Exam_Complete']}")
+    print(f"After Diet Reliable: {counts['4_Diet_Reliable']}")
+    print(f"After Complete Data: {counts['5_Complete_Data']}")
+    print(f"After Outlier Exclusion: {counts['6_No_Diet_Outliers']}")
+
+    flow_counts["7_Final_Analytical_Sample"] = counts["6_No_Diet_Outliers"]
+
+    # Which covariates (and combinations) the complete cases are lost to,
+    # among participants with a complete perio exam and reliable recall
+    reached, _ = evaluate_criteria(df, criteria[:2])
+    reached_df = select_rows(df, reached, [*COVARIATES, "cycle"])
+    profile = missingness_profile(reached_df, COVARIATES, by="cycle")
+    report_missingness(profile)
+    with open(os.path.join(OUTPUT_DIR, "missingness_profile.json"), "w") as f:
+        json.dump(profile, f, indent=2)
+
+    # Excluded rows can leave empty label levels; drop them so the model
+    # formulas do not get all-zero dummy columns
+    df_final = select_rows(df, keep, ANALYTIC_COLUMNS)
+    drop_unused_categories(df_final)
 
     return df_final, flow_counts
 
 
+def run_exclusion_sensitivity(df):
+    """
+    Analytic N under every subset and order of the exclusion criteria
+    (exclusion_sensitivity.json), and the models refitted on each sample
+    that drops one criterion (exclusion_sensitivity_models.csv).
+    """
+    criteria = exclusion_criteria()
+    sensitivity = exclusion_sensitivity(df, criteria)
+    with open(os.path.join(OUTPUT_DIR, "exclusion_sensitivity.json"), "w") as f:
+        json.dump(sensitivity, f, indent=2)
+
+    bits = criteria_bits(df, criteria)
+    everything = (1 << len(criteria)) - 1
+    results = []
+    for i, (label, _) in enumerate(criteria):
+        keep = subset_mask(df, criteria, bits, everything & ~(1 << i))
+        sample = select_rows(df, keep, ANALYTIC_COLUMNS)
+        drop_unused_categories(sample)
+        print(f"  Without {label}: N = {len(sample)}")
+        for row in fit_logistic_models(sample):
+            results.append({"Dropped": label, **row})
+
+    pd.DataFrame(results).to_csv(
+        os.path.join(OUTPUT_DIR, "exclusion_sensitivity_models.csv"), index=False
+    )
+
+
 def create_strobe_diagram(counts):
     """Generate STROBE flow diagram using matplotlib."""
     import matplotlib.patches as patches
@@ -581,6 +734,15 @@ def run_descriptive_table1(df):
     g0 = df[df["perio_case"] == 0]
     g1 = df[df["perio_case"] == 1]
 
+    # Weighted shares of every category in both groups in one pass
+    counts = category_table(
+        df,
+        [var for _, var, dtype in columns if dtype == "categorical"],
+        "weight",
+        by="perio_case",
+        sort=True,
+    ).set_index(["perio_case", "variable", "category"])
+
     for label, var, dtype in columns:
         row = {"Variable": label}
 
@@ -624,16 +786,12 @@ def run_descriptive_table1(df):
             for cat in cats:
                 cat_row = {"Variable": f"  {cat}"}
 
-                def get_pct(sub_df, category):
-                    if len(sub_df) == 0:
-                        return "0.0%"
-                    total_w = sub_df["weight"].sum()
-                    cat_w = sub_df[sub_df[var] == category]["weight"].sum()
-                    pct = (cat_w / total_w) * 100
+                def get_pct(case, category):
+                    pct = counts["percent"].get((case, var, category), 0.0)
                     return f"{pct:.1f}%"
 
-                cat_row["No Periodontitis (Mean (SD))"] = get_pct(g0, cat)
-                cat_row["Periodontitis (Mean (SD))"] = get_pct(g1, cat)
+                cat_row["No Periodontitis (Mean (SD))"] = get_pct(0, cat)
+                cat_row["Periodontitis (Mean (SD))"] = get_pct(1, cat)
                 cat_row["P-value"] = ""
                 results.append(cat_row)
 
@@ -653,9 +811,23 @@ def run_descriptive_table1(df):
         os.path.join(OUTPUT_DIR, "table1_characteristics.csv"), index=False
     )
 
+    # Design-based (Taylor linearization) SEs of every Table 1 cell by group
+    design = survey_design(df)
+    cells = design_table(
+        df,
+        design,
+        [var for _, var, dtype in columns if dtype == "continuous"],
+        [var for _, var, dtype in columns if dtype == "categorical"],
+        q=[0.5],
+        by="perio_case",
+        sort=True,
+    )
+    cells.to_csv(os.path.join(OUTPUT_DIR, "table1_design_se.csv"), index=False)
+    print(f"Table 1 design SEs: {len(cells)} cells, {design['df']} design df")
+
 
-def run_logistic_models(df):
-    """Run Logistic Regression Models."""
+def fit_logistic_models(df):
+    """Fit the logistic models of every exposure; returns one row per model."""
 
     exposures = [
         ("Sugars", "DR1TSUGR"),
@@ -751,8 +923,13 @@ def run_logistic_models(df):
                     }
                 )
 
+    return all_results
+
+
+def run_logistic_models(df):
+    """Run Logistic Regression Models."""
     # Save Table 3 (Detailed)
-    results_df = pd.DataFrame(all_results)
+    results_df = pd.DataFrame(fit_logistic_models(df))
     results_df.to_csv(os.path.join(OUTPUT_DIR, "table3_models.csv"), index=False)
 
     # Save Table 2 (Bivariate - Model 1 only)
@@ -770,16 +947,21 @@ def main():
     os.makedirs(FIGURES_DIR, exist_ok=True)
     os.makedirs(TABLES_DIR, exist_ok=True)
 
-    # 1. Load & Merge
+    # 1. Load & Merge (recoded per cycle, see merge_cycles)
     print("Loading data...")
-    df = merge_cycles()
+    df, demo_counts, masked = merge_cycles()
     print(f"Initial merged shape: {df.shape}")
+    with open(os.path.join(OUTPUT_DIR, "masked_codes.json"), "w") as f:
+        json.dump(masked, f, indent=2)
+    memory_report(df, "merged")
 
-    # 2. Transform
-    df = process_data(df)
+    # 2. Transform (pooled steps)
+    df = pool_cycles(df)
+    memory_report(df, "recoded")
 
     # 3. Exclusions
-    df_final, flow_counts = apply_exclusions(df)
+    df_final, flow_counts = apply_exclusions(df, demo_counts)
+    memory_report(df_final, "analytic sample")
     create_strobe_diagram(flow_counts)
 
     # 4. Analysis
@@ -789,6 +971,10 @@ def main():
     print("Running Models...")
     run_logistic_models(df_final)
 
+    # 5. Exclusion sensitivity (all subsets/orders of the criteria)
+    print("Running Exclusion Sensitivity...")
+    run_exclusion_sensitivity(df)
+
     print("Analysis Complete.")
 
 
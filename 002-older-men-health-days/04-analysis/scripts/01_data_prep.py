@@ -14,6 +14,56 @@ import sys
 import json
 from pathlib import Path
 
+# Shared NHANES helpers: repo root locally, mounted at /nhanes_lib in the vault
+LIB_ROOT = os.environ.get("NHANES_LIB_ROOT", str(Path(__file__).resolve().parents[3]))
+if LIB_ROOT not in sys.path:
+    sys.path.insert(0, LIB_ROOT)
+
+from nhanes_lib.codebook import (  # noqa: E402
+    load_codebook,
+    mask_special_codes,
+    report_masked,
+)
+from nhanes_lib.derive import (  # noqa: E402
+    build_graph,
+    derived,
+    evaluate,
+    recode_nodes,
+)
+from nhanes_lib.exclusions import (  # noqa: E402
+    complete_cases,
+    evaluate_criteria,
+    exclusion_sensitivity,
+    select_rows,
+)
+from nhanes_lib.harmonize import (  # noqa: E402
+    harmonize,
+    load_harmonization,
+    source_variables,
+)
+from nhanes_lib.join import merge_on_seqn  # noqa: E402
+from nhanes_lib.loaders import (  # noqa: E402
+    apply_criteria,
+    find_domain_file,
+    load_domain,
+)
+from nhanes_lib.missingness import (  # noqa: E402
+    missingness_profile,
+    report_missingness,
+)
+from nhanes_lib.outliers import mask_outliers  # noqa: E402
+from nhanes_lib.parallel import map_ordered  # noqa: E402
+from nhanes_lib.partitions import (  # noqa: E402
+    load_partition,
+    partition_key,
+    save_partition,
+)
+from nhanes_lib.schema import (  # noqa: E402
+    compact_dtypes,
+    drop_unused_categories,
+    memory_report,
+)
+
 # Output only aggregated results - no individual data
 np.random.seed(42)
 
@@ -40,6 +90,38 @@ CYCLE_YEARS = {
 # Number of cycles for weight adjustment
 N_CYCLES = len(CYCLES)
 
+# Variables read from each domain; everything else in the files is skipped.
+# Keep in sync with the recode specs below.
+DOMAIN_VARIABLES = {
+    "DEMO": [
+        "SEQN",
+        "RIDAGEYR",
+        "RIAGENDR",
+        "RIDRETH1",
+        "DMDEDUC2",
+        "DMDMARTL",
+        "INDFMPIR",
+        "WTMEC2YR",
+        "SDMVSTRA",
+        "SDMVPSU",
+    ],
+    "HSQ": ["SEQN", "HSQ470", "HSQ480", "HSQ490", "HSD010"],
+    "DIQ": ["SEQN", "DIQ010"],
+    "BPQ": ["SEQN", "BPQ020", "BPQ080"],
+    "CDQ": ["SEQN", "CDQ001", "CDQ009"],
+    "PAQ": ["SEQN", "PAQ605", "PAQ620", "PAQ650", "PAQ665"],
+    "SMQ": ["SEQN", "SMQ020", "SMQ040"],
+    "BMX": ["SEQN", "BMXBMI", "BMXWAIST"],
+    "HIQ": ["SEQN", "HIQ011"],
+}
+
+# Inclusion criteria applied to DEMO before any other domain is read, as
+# (flow-count key, predicate); only eligible SEQNs are loaded and merged
+DEMO_CRITERIA = [
+    ("after_age_filter", lambda demo: demo["RIDAGEYR"] >= 60),
+    ("after_sex_filter", lambda demo: demo["RIAGENDR"] == 1),
+]
+
 print("=" * 70)
 print("NHANES Data Preparation: Older Men and Physical Health Days")
 print("=" * 70)
@@ -59,22 +141,46 @@ flow_counts = {
 }
 
 
+def read_domain(prefix, cycle, seqn=None):
+    """
+    Read the study variables of one domain file (warehouse or cached CSV),
+    under the cycle's own names for variables it renamed (harmonize.json).
+    """
+    columns = source_variables(DOMAIN_VARIABLES[prefix], cycle)
+    df = load_domain(prefix, cycle, DATA_DIR, columns=columns, seqn=seqn)
+    if df is None:
+        raise FileNotFoundError(f"{prefix}_{cycle}.csv not found in {DATA_DIR}")
+    return df
+
+
 def load_and_merge_cycle(cycle):
-    """Load and merge all datasets for a single cycle."""
+    """
+    Load and merge all datasets for a single cycle.
+
+    DEMO_CRITERIA are applied to DEMO first and the other domains are read for
+    the eligible SEQNs only. Returns (merged frame, DEMO flow counts,
+    masked special codes per variable) or None.
+    """
     print(f"\n--- Processing Cycle {cycle} ({CYCLE_YEARS[cycle]}) ---")
 
     datasets = {}
 
     # Load core datasets
     try:
-        datasets["demo"] = pd.read_csv(DATA_DIR / f"DEMO_{cycle}.csv")
-        print(f"  DEMO: {len(datasets['demo'])} records")
+        demo = read_domain("DEMO", cycle)
+        print(f"  DEMO: {len(demo)} records")
     except Exception as e:
         print(f"  ERROR loading DEMO_{cycle}: {e}")
         return None
 
+    counts = {"initial_records": len(demo)}
+    demo, criteria_counts = apply_criteria(demo, DEMO_CRITERIA)
+    counts.update(criteria_counts)
+    print(f"  DEMO eligible: {len(demo)} records")
+    eligible = demo["SEQN"].to_numpy()
+
     try:
-        datasets["hsq"] = pd.read_csv(DATA_DIR / f"HSQ_{cycle}.csv")
+        datasets["hsq"] = read_domain("HSQ", cycle, eligible)
         print(f"  HSQ: {len(datasets['hsq'])} records")
     except Exception as e:
         print(f"  ERROR loading HSQ_{cycle}: {e}")
@@ -83,7 +189,7 @@ def load_and_merge_cycle(cycle):
     # Load condition datasets
     for prefix in ["DIQ", "BPQ", "CDQ"]:
         try:
-            datasets[prefix.lower()] = pd.read_csv(DATA_DIR / f"{prefix}_{cycle}.csv")
+            datasets[prefix.lower()] = read_domain(prefix, cycle, eligible)
             print(f"  {prefix}: {len(datasets[prefix.lower()])} records")
         except Exception as e:
             print(f"  WARNING: {prefix}_{cycle} not found, creating empty")
@@ -92,24 +198,32 @@ def load_and_merge_cycle(cycle):
     # Load covariate datasets
     for prefix in ["PAQ", "SMQ", "BMX", "HIQ"]:
         try:
-            datasets[prefix.lower()] = pd.read_csv(DATA_DIR / f"{prefix}_{cycle}.csv")
+            datasets[prefix.lower()] = read_domain(prefix, cycle, eligible)
             print(f"  {prefix}: {len(datasets[prefix.lower()])} records")
         except Exception as e:
             print(f"  WARNING: {prefix}_{cycle} not found, creating empty")
             datasets[prefix.lower()] = pd.DataFrame(columns=["SEQN"])
 
-    # Merge all datasets on SEQN
-    merged = datasets["demo"].copy()
-    for name, df in datasets.items():
-        if name != "demo":
-            merged = merged.merge(df, on="SEQN", how="left")
+    # Merge all datasets on SEQN (single-pass left join onto DEMO)
+    merged = merge_on_seqn(demo, datasets)
+
+    # Cycle-specific names and codings -> canonical variables (harmonize.json)
+    merged, harmonized = harmonize(merged, cycle)
+    for name, sources in harmonized.items():
+        print(f"  Harmonized: {', '.join(sources)} -> {name}")
+
+    # Refused/don't know codes and out-of-range values -> NaN before any
+    # recode (nhanes_lib/codebook.json)
+    merged, masked = mask_special_codes(merged, cycle)
+    report_masked(masked)
+    merged = compact_dtypes(merged)
 
     # Add cycle identifier
     merged["cycle"] = cycle
     merged["cycle_year"] = CYCLE_YEARS[cycle]
 
     print(f"  Merged: {len(merged)} records")
-    return merged
+    return merged, counts, masked
 
 
 def safe_map(df, col, condition_true, condition_false, condition_missing=None):
@@ -121,249 +235,174 @@ def safe_map(df, col, condition_true, condition_false, condition_missing=None):
     return np.where(condition_true, 1, np.where(condition_false, 0, np.nan))
 
 
-def process_chronic_conditions(df):
-    """Create chronic condition indicators and count."""
+# Chronic condition indicators (nhanes_lib.recode spec): 1=Yes, 0=No
+CHRONIC_RECODES = [
     # Diabetes (DIQ010): 1=Yes, 2=No, 3=Borderline
-    if "DIQ010" in df.columns:
-        df["diabetes"] = np.where(
-            df["DIQ010"].isin([1, 3]), 1, np.where(df["DIQ010"] == 2, 0, np.nan)
-        )
-    else:
-        df["diabetes"] = np.nan
-
+    {"name": "diabetes", "source": "DIQ010", "map": [[[1, 3], 1], [2, 0]]},
     # Hypertension (BPQ020): 1=Yes, 2=No
-    if "BPQ020" in df.columns:
-        df["hypertension"] = np.where(
-            df["BPQ020"] == 1, 1, np.where(df["BPQ020"] == 2, 0, np.nan)
-        )
-    else:
-        df["hypertension"] = np.nan
-
+    {"name": "hypertension", "source": "BPQ020", "map": [[1, 1], [2, 0]]},
     # High Cholesterol (BPQ080): 1=Yes, 2=No
-    if "BPQ080" in df.columns:
-        df["high_cholesterol"] = np.where(
-            df["BPQ080"] == 1, 1, np.where(df["BPQ080"] == 2, 0, np.nan)
-        )
-    else:
-        df["high_cholesterol"] = np.nan
-
+    {"name": "high_cholesterol", "source": "BPQ080", "map": [[1, 1], [2, 0]]},
     # Cardiovascular Disease (from CDQ001, CDQ009)
     # CDQ001: chest pain, CDQ009: severe chest pain >30 min
-    if "CDQ001" in df.columns:
-        df["chest_pain"] = np.where(
-            df["CDQ001"] == 1, 1, np.where(df["CDQ001"] == 2, 0, np.nan)
-        )
-    else:
-        df["chest_pain"] = np.nan
-
-    if "CDQ009" in df.columns:
-        df["severe_chest_pain"] = np.where(
-            df["CDQ009"] == 1, 1, np.where(df["CDQ009"] == 2, 0, np.nan)
-        )
-    else:
-        df["severe_chest_pain"] = np.nan
-
+    {"name": "chest_pain", "source": "CDQ001", "map": [[1, 1], [2, 0]]},
+    {"name": "severe_chest_pain", "source": "CDQ009", "map": [[1, 1], [2, 0]]},
     # CVD = either chest pain indicator
-    df["cvd"] = np.where(
-        (df["chest_pain"] == 1) | (df["severe_chest_pain"] == 1),
-        1,
-        np.where((df["chest_pain"] == 0) & (df["severe_chest_pain"] == 0), 0, np.nan),
-    )
-
-    # Chronic condition count
-    conditions = ["diabetes", "hypertension", "high_cholesterol", "cvd"]
-    df["chronic_count"] = df[conditions].sum(axis=1, min_count=1)
-
-    # Categorize
-    df["chronic_cat"] = np.where(
-        df["chronic_count"] >= 3,
-        "3+",
-        np.where(
-            df["chronic_count"] == 2, "2", np.where(df["chronic_count"] == 1, "1", "0")
-        ),
-    )
-
-    return df
-
-
-def process_outcomes(df):
-    """Process health outcome variables."""
-    # Physical health days (HSQ470): 0-30, 77=refused, 99=don't know
-    df["physical_health_days"] = np.where(
-        df["HSQ470"].isin([77, 99]),
-        np.nan,
-        np.where((df["HSQ470"] >= 0) & (df["HSQ470"] <= 30), df["HSQ470"], np.nan),
-    )
-
-    # Mental health days (HSQ480): 0-30, 77=refused, 99=don't know
-    df["mental_health_days"] = np.where(
-        df["HSQ480"].isin([77, 99]),
-        np.nan,
-        np.where((df["HSQ480"] >= 0) & (df["HSQ480"] <= 30), df["HSQ480"], np.nan),
-    )
-
-    # Activity limitation days (HSQ490): 0-30, 77=refused, 99=don't know
-    df["activity_limitation_days"] = np.where(
-        df["HSQ490"].isin([77, 99]),
-        np.nan,
-        np.where((df["HSQ490"] >= 0) & (df["HSQ490"] <= 30), df["HSQ490"], np.nan),
-    )
-
-    # General health status (HSD010): 1-5, 7=refused, 9=don't know
-    df["general_health"] = np.where(
-        df["HSD010"].isin([7, 9]),
-        np.nan,
-        np.where((df["HSD010"] >= 1) & (df["HSD010"] <= 5), df["HSD010"], np.nan),
-    )
-
-    return df
-
-
-def process_demographics(df):
-    """Process demographic variables."""
+    {
+        "name": "cvd",
+        "rules": [
+            [{"any": [{"chest_pain": 1}, {"severe_chest_pain": 1}]}, 1],
+            [{"chest_pain": 0, "severe_chest_pain": 0}, 0],
+        ],
+    },
+]
+
+# Chronic condition count categories (missing count -> "0")
+CHRONIC_COUNT_RECODES = [
+    {
+        "name": "chronic_cat",
+        "rules": [
+            [{"chronic_count": {"ge": 3}}, "3+"],
+            [{"chronic_count": 2}, "2"],
+            [{"chronic_count": 1}, "1"],
+        ],
+        "default": "0",
+    },
+]
+
+
+# Indicators summed into the chronic condition count
+CHRONIC_CONDITIONS = ["diabetes", "hypertension", "high_cholesterol", "cvd"]
+
+
+def count_chronic_conditions(df):
+    """Chronic condition count (missing only if every indicator is)."""
+    return df[CHRONIC_CONDITIONS].sum(axis=1, min_count=1)
+
+
+# Health day counts 0-30 and general health 1-5; refused/don't know (77/99,
+# 7/9) and out-of-range values are already NaN (codebook.json)
+OUTCOME_RECODES = [
+    # Physical health days (HSQ470)
+    {"name": "physical_health_days", "source": "HSQ470", "copy": True},
+    # Mental health days (HSQ480)
+    {"name": "mental_health_days", "source": "HSQ480", "copy": True},
+    # Activity limitation days (HSQ490)
+    {"name": "activity_limitation_days", "source": "HSQ490", "copy": True},
+    # General health status (HSD010)
+    {"name": "general_health", "source": "HSD010", "copy": True},
+]
+
+
+DEMOGRAPHIC_RECODES = [
     # Age (already in RIDAGEYR)
-    df["age"] = df["RIDAGEYR"]
-
+    {"name": "age", "source": "RIDAGEYR", "copy": True},
     # Sex (1=Male, 2=Female)
-    df["sex"] = df["RIAGENDR"]
-
+    {"name": "sex", "source": "RIAGENDR", "copy": True},
     # Race/Ethnicity
-    race_map = {
-        1: "Mexican American",
-        2: "Other Hispanic",
-        3: "Non-Hispanic White",
-        4: "Non-Hispanic Black",
-        5: "Other/Multi-racial",
-    }
-    df["race_ethnicity"] = df["RIDRETH1"].map(race_map)
-
+    {
+        "name": "race_ethnicity",
+        "source": "RIDRETH1",
+        "map": [
+            [1, "Mexican American"],
+            [2, "Other Hispanic"],
+            [3, "Non-Hispanic White"],
+            [4, "Non-Hispanic Black"],
+            [5, "Other/Multi-racial"],
+        ],
+    },
     # Education
     # 1=<9th, 2=9-11th, 3=HS grad, 4=Some college, 5=College+, 7=Refused, 9=Don't know
-    edu_map = {
-        1: "< High School",
-        2: "< High School",
-        3: "High School Graduate",
-        4: "Some College",
-        5: "College Graduate+",
-    }
-    df["education"] = df["DMDEDUC2"].map(edu_map)
-
+    {
+        "name": "education",
+        "source": "DMDEDUC2",
+        "map": [
+            [[1, 2], "< High School"],
+            [3, "High School Graduate"],
+            [4, "Some College"],
+            [5, "College Graduate+"],
+        ],
+    },
     # Marital status
     # 1=Married, 2=Widowed, 3=Divorced, 4=Separated, 5=Never married, 6=Living with partner
-    marital_map = {
-        1: "Married/Partner",
-        2: "Widowed",
-        3: "Divorced/Separated",
-        4: "Divorced/Separated",
-        5: "Never Married",
-        6: "Married/Partner",
-    }
-    df["marital_status"] = df["DMDMARTL"].map(marital_map)
-
-    return df
-
-
-def process_ses(df):
-    """Process socioeconomic variables."""
-    # Income-to-poverty ratio
-    if "INDFMPIR" in df.columns:
-        df["poverty_ratio"] = df["INDFMPIR"]
-        df["poverty_ratio"] = np.where(df["poverty_ratio"] > 5, 5, df["poverty_ratio"])
-    else:
-        df["poverty_ratio"] = np.nan
-
+    {
+        "name": "marital_status",
+        "source": "DMDMARTL",
+        "map": [
+            [[1, 6], "Married/Partner"],
+            [2, "Widowed"],
+            [[3, 4], "Divorced/Separated"],
+            [5, "Never Married"],
+        ],
+    },
+]
+
+
+SES_RECODES = [
+    # Income-to-poverty ratio (top-coded at 5)
+    {"name": "poverty_ratio", "source": "INDFMPIR", "clip": [None, 5]},
     # Health insurance (HIQ011): 1=Yes, 2=No
-    if "HIQ011" in df.columns:
-        df["has_insurance"] = np.where(
-            df["HIQ011"] == 1, 1, np.where(df["HIQ011"] == 2, 0, np.nan)
-        )
-    else:
-        df["has_insurance"] = np.nan
+    {"name": "has_insurance", "source": "HIQ011", "map": [[1, 1], [2, 0]]},
+]
 
-    return df
 
-
-def process_health_behaviors(df):
-    """Process health behavior variables."""
+BEHAVIOR_RECODES = [
     # Smoking status
     # SMQ020: 1=Yes smoked 100+, 2=No
     # SMQ040: 1=Every day, 2=Some days, 3=Not at all
-    df["smoking_status"] = "Unknown"
-    if "SMQ020" in df.columns:
-        df.loc[df["SMQ020"] == 2, "smoking_status"] = "Never"
-        if "SMQ040" in df.columns:
-            df.loc[(df["SMQ020"] == 1) & (df["SMQ040"] == 3), "smoking_status"] = (
-                "Former"
-            )
-            df.loc[
-                (df["SMQ020"] == 1) & (df["SMQ040"].isin([1, 2])), "smoking_status"
-            ] = "Current"
-
+    {
+        "name": "smoking_status",
+        "rules": [
+            [{"SMQ020": 2}, "Never"],
+            [{"SMQ020": 1, "SMQ040": 3}, "Former"],
+            [{"SMQ020": 1, "SMQ040": [1, 2]}, "Current"],
+        ],
+        "default": "Unknown",
+    },
     # Physical activity (simplified version)
-    # Any vigorous activity
-    vig_work = df.get("PAQ605", pd.Series([np.nan] * len(df)))
-    vig_rec = df.get("PAQ650", pd.Series([np.nan] * len(df)))
-    mod_work = df.get("PAQ620", pd.Series([np.nan] * len(df)))
-    mod_rec = df.get("PAQ665", pd.Series([np.nan] * len(df)))
-
-    df["vigorous_activity"] = np.where(
-        (vig_work == 1) | (vig_rec == 1),
-        1,
-        np.where((vig_work == 2) & (vig_rec == 2), 0, np.nan),
-    )
-
-    # Any moderate activity
-    df["moderate_activity"] = np.where(
-        (mod_work == 1) | (mod_rec == 1),
-        1,
-        np.where((mod_work == 2) & (mod_rec == 2), 0, np.nan),
-    )
-
+    # Any vigorous activity (work PAQ605, recreation PAQ650)
+    {
+        "name": "vigorous_activity",
+        "rules": [
+            [{"any": [{"PAQ605": 1}, {"PAQ650": 1}]}, 1],
+            [{"PAQ605": 2, "PAQ650": 2}, 0],
+        ],
+    },
+    # Any moderate activity (work PAQ620, recreation PAQ665)
+    {
+        "name": "moderate_activity",
+        "rules": [
+            [{"any": [{"PAQ620": 1}, {"PAQ665": 1}]}, 1],
+            [{"PAQ620": 2, "PAQ665": 2}, 0],
+        ],
+    },
     # Activity level categorization
-    df["activity_level"] = "Unknown"
-    df.loc[df["vigorous_activity"] == 1, "activity_level"] = "High"
-    df.loc[
-        (df["vigorous_activity"] == 0) & (df["moderate_activity"] == 1),
-        "activity_level",
-    ] = "Moderate"
-    df.loc[
-        (df["vigorous_activity"] == 0) & (df["moderate_activity"] == 0),
-        "activity_level",
-    ] = "Low"
-
-    return df
-
-
-def process_anthropometrics(df):
-    """Process anthropometric variables."""
+    {
+        "name": "activity_level",
+        "rules": [
+            [{"vigorous_activity": 1}, "High"],
+            [{"vigorous_activity": 0, "moderate_activity": 1}, "Moderate"],
+            [{"vigorous_activity": 0, "moderate_activity": 0}, "Low"],
+        ],
+        "default": "Unknown",
+    },
+]
+
+
+ANTHROPOMETRIC_RECODES = [
     # BMI
-    if "BMXBMI" in df.columns:
-        df["bmi"] = df["BMXBMI"]
-        # BMI categories
-        df["bmi_category"] = np.where(
-            df["bmi"] < 18.5,
-            "Underweight",
-            np.where(
-                df["bmi"] < 25,
-                "Normal",
-                np.where(
-                    df["bmi"] < 30,
-                    "Overweight",
-                    np.where(df["bmi"] >= 30, "Obese", "Unknown"),
-                ),
-            ),
-        )
-    else:
-        df["bmi"] = np.nan
-        df["bmi_category"] = "Unknown"
-
+    {"name": "bmi", "source": "BMXBMI", "copy": True},
+    # BMI categories
+    {
+        "name": "bmi_category",
+        "source": "bmi",
+        "bins": [18.5, 25, 30],
+        "labels": ["Underweight", "Normal", "Overweight", "Obese"],
+        "default": "Unknown",
+    },
     # Waist circumference
-    if "BMXWAIST" in df.columns:
-        df["waist_circumference"] = df["BMXWAIST"]
-    else:
-        df["waist_circumference"] = np.nan
-
-    return df
+    {"name": "waist_circumference", "source": "BMXWAIST", "copy": True},
+]
 
 
 def process_survey_weights(df):
@@ -389,7 +428,10 @@ def process_survey_weights(df):
 
 
 def remove_outliers(df):
-    """Remove extreme outliers (|z| > 4) for continuous variables."""
+    """
+    Remove extreme outliers (|z| > 4) for continuous variables: outlying
+    values become NaN. Returns (df, {variable: values removed}).
+    """
     continuous_vars = [
         "age",
         "physical_health_days",
@@ -398,32 +440,159 @@ def remove_outliers(df):
         "bmi",
         "poverty_ratio",
     ]
-
-    outlier_count = 0
-    for var in continuous_vars:
-        if var in df.columns:
-            valid = df[var].dropna()
-            if len(valid) > 0:
-                mean = valid.mean()
-                std = valid.std()
-                if std > 0:
-                    z_scores = np.abs((df[var] - mean) / std)
-                    outliers = (z_scores > 4) & df[var].notna()
-                    outlier_count += outliers.sum()
-                    df.loc[outliers, var] = np.nan
-
-    return df, outlier_count
+    present = [var for var in continuous_vars if var in df.columns]
+    return mask_outliers(df, present, rule="z", limit=4)
+
+
+# Derived variables by step, each registered with the columns it reads.
+# They are evaluated per cycle on demand (see DERIVED_TARGETS). Survey
+# weights and outlier removal depend on the pooled sample and run after
+# assembly.
+CYCLE_STEPS = [
+    (
+        "Chronic conditions",
+        recode_nodes(CHRONIC_RECODES)
+        + [derived("chronic_count", CHRONIC_CONDITIONS, count_chronic_conditions)]
+        + recode_nodes(CHRONIC_COUNT_RECODES),
+    ),
+    ("Outcome variables", recode_nodes(OUTCOME_RECODES)),
+    ("Demographics", recode_nodes(DEMOGRAPHIC_RECODES)),
+    ("Socioeconomic variables", recode_nodes(SES_RECODES)),
+    ("Health behaviors", recode_nodes(BEHAVIOR_RECODES)),
+    ("Anthropometrics", recode_nodes(ANTHROPOMETRIC_RECODES)),
+]
+DERIVED = build_graph([node for _, nodes in CYCLE_STEPS for node in nodes])
+
+# Columns of the analytic dataset
+ANALYTIC_COLUMNS = [
+    "SEQN",
+    "cycle",
+    "cycle_year",
+    "physical_health_days",
+    "mental_health_days",
+    "activity_limitation_days",
+    "general_health",
+    "diabetes",
+    "hypertension",
+    "high_cholesterol",
+    "cvd",
+    "chronic_count",
+    "chronic_cat",
+    "age",
+    "race_ethnicity",
+    "education",
+    "marital_status",
+    "poverty_ratio",
+    "has_insurance",
+    "smoking_status",
+    "activity_level",
+    "vigorous_activity",
+    "moderate_activity",
+    "bmi",
+    "bmi_category",
+    "waist_circumference",
+    "weight",
+    "stratum",
+    "psu",
+]
+
+# Derived variables the analytic dataset asks for (outcome filter, complete
+# cases and outlier removal only use these too); others are not evaluated
+DERIVED_TARGETS = [name for name in ANALYTIC_COLUMNS if name in DERIVED]
+
+# Key variables of the complete-case analysis
+REQUIRED_VARIABLES = [
+    "chronic_count",
+    "age",
+    "race_ethnicity",
+    "weight",
+    "stratum",
+    "psu",
+]
+
+# Analytic sample criteria after the DEMO criteria, as (flow-count key,
+# predicate) masks over the pooled frame
+SAMPLE_CRITERIA = [
+    # Those with outcome data
+    ("with_outcome_data", lambda df, keep: df["physical_health_days"].notna()),
+    # Final analytic sample (complete cases for key variables)
+    ("final_analytic_sample", complete_cases(REQUIRED_VARIABLES)),
+]
+
+# Partition store namespace for this study
+PARTITION_STUDY = "002-older-men-health-days"
+
+
+def load_cycle_partition(cycle):
+    """
+    Process-pool entry point: one cycle's merged partition (rebuilt only if
+    its source files or loading code changed) with the derived variables
+    added. Derived columns are read back from the derived store unless their
+    definition or inputs changed.
+
+    Returns (frame, DEMO flow counts, masked special codes, derive report,
+    reused) or None.
+    """
+    inputs = [find_domain_file(prefix, cycle, DATA_DIR) for prefix in DOMAIN_VARIABLES]
+    definition = [
+        CYCLE_YEARS[cycle],
+        DOMAIN_VARIABLES,
+        DEMO_CRITERIA,
+        load_harmonization(),
+        load_codebook(),
+        read_domain,
+        load_and_merge_cycle,
+    ]
+    key = partition_key(inputs, definition)
+
+    stored = load_partition(PARTITION_STUDY, cycle, key)
+    if stored is not None:
+        print(f"\n--- Cycle {cycle} ({CYCLE_YEARS[cycle]}): stored partition ---")
+        df, extra = stored
+        counts, masked = extra["counts"], extra["masked"]
+        report_masked(masked)
+    else:
+        loaded = load_and_merge_cycle(cycle)
+        if loaded is None:
+            return None
+        df, counts, masked = loaded
+        extra = {"counts": counts, "masked": masked}
+        save_partition(PARTITION_STUDY, cycle, key, df, extra)
+
+    df, report = evaluate(df, DERIVED, DERIVED_TARGETS)
+    print(
+        f"  Derived variables: {len(report['computed'])} computed, "
+        f"{len(report['reused'])} reused"
+    )
+    return compact_dtypes(df), counts, masked, report, stored is not None
 
 
 def main():
     print("\nLoading and merging data from all cycles...")
 
-    # Load all cycles
-    all_cycles = []
-    for cycle in CYCLES:
-        cycle_data = load_and_merge_cycle(cycle)
-        if cycle_data is not None:
-            all_cycles.append(cycle_data)
+    # Per-cycle partitions (in parallel across NHANES_LOAD_WORKERS processes;
+    # per-cycle logs are replayed and results kept in cycle order). Only
+    # new cycles and cycles whose files changed are loaded and recoded.
+    results = dict(zip(CYCLES, map_ordered(load_cycle_partition, CYCLES)))
+    loaded = [cycle_data for cycle_data in results.values() if cycle_data is not None]
+    all_cycles = [partition for partition, *_ in loaded]
+    n_reused = sum(reused for *_, reused in loaded)
+    n_computed = sum(len(report["computed"]) for _, _, _, report, _ in loaded)
+    n_derived_reused = sum(len(report["reused"]) for _, _, _, report, _ in loaded)
+
+    # Special codes masked per cycle and variable (aggregate counts only)
+    masked = {
+        cycle: cycle_data[2]
+        for cycle, cycle_data in results.items()
+        if cycle_data is not None
+    }
+    with open(OUTPUT_DIR / "masked_codes.json", "w") as f:
+        json.dump(masked, f, indent=2)
+
+    # Pre-filter flow counts come from DEMO alone
+    for _, counts, *_ in loaded:
+        for key, n in counts.items():
+            flow_counts[key] += n
 
     if not all_cycles:
         print("ERROR: No data loaded!")
@@ -431,74 +600,55 @@ def main():
 
     # Combine all cycles
     df = pd.concat(all_cycles, ignore_index=True)
-    flow_counts["initial_records"] = len(df)
     print(f"\n{'=' * 70}")
     print(f"Total records across all cycles: {flow_counts['initial_records']:,}")
     print(f"{'=' * 70}")
+    memory_bytes = {"assembled": memory_report(df, "assembled")}
 
-    # Process demographics first (needed for filtering)
-    print("\n--- Processing Demographics ---")
-    df["age"] = df["RIDAGEYR"]
-    df["sex"] = df["RIAGENDR"]
-
-    # Apply inclusion criteria
+    # Inclusion criteria (age 60+, male only) were applied to DEMO while
+    # loading (DEMO_CRITERIA), so df holds eligible participants only
     print("\n--- Applying Inclusion Criteria ---")
-
-    # Age 60+
-    df = df[df["age"] >= 60].copy()
-    flow_counts["after_age_filter"] = len(df)
     print(f"After age >= 60 filter: {flow_counts['after_age_filter']:,}")
-
-    # Male only
-    df = df[df["sex"] == 1].copy()
-    flow_counts["after_sex_filter"] = len(df)
     print(f"After male filter: {flow_counts['after_sex_filter']:,}")
 
-    # Process all variables
+    # Derived variables were added per cycle
     print("\n--- Processing Variables ---")
-    df = process_chronic_conditions(df)
-    print("  Chronic conditions processed")
-
-    df = process_outcomes(df)
-    print("  Outcome variables processed")
-
-    df = process_demographics(df)
-    print("  Demographics processed")
-
-    df = process_ses(df)
-    print("  Socioeconomic variables processed")
-
-    df = process_health_behaviors(df)
-    print("  Health behaviors processed")
-
-    df = process_anthropometrics(df)
-    print("  Anthropometrics processed")
+    for label, _ in CYCLE_STEPS:
+        print(f"  {label} processed")
+    print(f"  ({len(all_cycles) - n_reused} cycle(s) loaded, {n_reused} reused)")
+    print(f"  ({n_computed} derived column(s) computed, {n_derived_reused} reused)")
 
     df = process_survey_weights(df)
     print("  Survey weights processed")
 
+    # Labels whose categories differ between partitions -> categoricals again
+    df = compact_dtypes(df)
+    memory_bytes["recoded"] = memory_report(df, "recoded")
+
     # Remove outliers
     print("\n--- Removing Outliers (|z| > 4) ---")
-    df, outlier_count = remove_outliers(df)
-    flow_counts["outliers_removed"] = outlier_count
-    print(f"Outliers removed: {outlier_count}")
-
-    # Filter to those with outcome data
-    df_outcome = df[df["physical_health_days"].notna()].copy()
-    flow_counts["with_outcome_data"] = len(df_outcome)
+    df, outlier_counts = remove_outliers(df)
+    flow_counts["outliers_removed"] = sum(outlier_counts.values())
+    print(f"Outliers removed: {flow_counts['outliers_removed']}")
+    for var, n in outlier_counts.items():
+        if n:
+            print(f"  {var}: {n}")
+
+    # Which variables (and combinations) the complete cases are lost to,
+    # overall and per cycle
+    print("\n--- Missingness Patterns ---")
+    profile = missingness_profile(
+        df, ["physical_health_days", *REQUIRED_VARIABLES], by="cycle"
+    )
+    report_missingness(profile)
+    with open(OUTPUT_DIR / "missingness_profile.json", "w") as f:
+        json.dump(profile, f, indent=2)
+
+    # Outcome and complete-case criteria as masks over the pooled frame;
+    # the analytic columns of the surviving rows are gathered once
+    keep, counts = evaluate_criteria(df, SAMPLE_CRITERIA)
+    flow_counts.update(counts)
     print(f"\nWith physical health days data: {flow_counts['with_outcome_data']:,}")
-
-    # Final analytic sample (complete cases for key variables)
-    required_vars = [
-        "chronic_count",
-        "age",
-        "race_ethnicity",
-        "weight",
-        "stratum",
-        "psu",
-    ]
-    df_complete = df_outcome.dropna(subset=required_vars).copy()
-    flow_counts["final_analytic_sample"] = len(df_complete)
     flow_counts["missing_covariates"] = (
         flow_counts["with_outcome_data"] - flow_counts["final_analytic_sample"]
     )
@@ -506,40 +656,13 @@ def main():
         f"Final analytic sample (complete cases): {flow_counts['final_analytic_sample']:,}"
     )
 
-    # Select columns for analytic dataset
-    keep_cols = [
-        "SEQN",
-        "cycle",
-        "cycle_year",
-        "physical_health_days",
-        "mental_health_days",
-        "activity_limitation_days",
-        "general_health",
-        "diabetes",
-        "hypertension",
-        "high_cholesterol",
-        "cvd",
-        "chronic_count",
-        "chronic_cat",
-        "age",
-        "race_ethnicity",
-        "education",
-        "marital_status",
-        "poverty_ratio",
-        "has_insurance",
-        "smoking_status",
-        "activity_level",
-        "vigorous_activity",
-        "moderate_activity",
-        "bmi",
-        "bmi_category",
-        "waist_circumference",
-        "weight",
-        "stratum",
-        "psu",
-    ]
+    df_final = drop_unused_categories(select_rows(df, keep, ANALYTIC_COLUMNS))
+    memory_bytes["analytic_sample"] = memory_report(df_final, "analytic sample")
 
-    df_final = df_complete[keep_cols].copy()
+    # Sample size under every subset/order of the sample criteria
+    sensitivity = exclusion_sensitivity(df, SAMPLE_CRITERIA)
+    with open(OUTPUT_DIR / "exclusion_sensitivity.json", "w") as f:
+        json.dump(sensitivity, f, indent=2)
 
     # Save flow counts (convert numpy types to Python types)
     flow_path = OUTPUT_DIR / "flow_counts.json"
@@ -577,6 +700,7 @@ def main():
         "missing_percentages": {
             col: round(df_final[col].isna().mean() * 100, 2) for col in df_final.columns
         },
+        "memory_bytes": memory_bytes,
     }
 
     meta_path = OUTPUT_DIR / "analytic_metadata.json"
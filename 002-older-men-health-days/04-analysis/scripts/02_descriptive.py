@@ -8,9 +8,25 @@ Generates weighted descriptive statistics for the analytic sample
 
 import pandas as pd
 import numpy as np
+import os
+import sys
 from pathlib import Path
 import json
 
+# Shared NHANES helpers: repo root locally, mounted at /nhanes_lib in the vault
+LIB_ROOT = os.environ.get("NHANES_LIB_ROOT", str(Path(__file__).resolve().parents[3]))
+if LIB_ROOT not in sys.path:
+    sys.path.insert(0, LIB_ROOT)
+
+from nhanes_lib.categorical import category_table  # noqa: E402
+from nhanes_lib.quantiles import weighted_quantiles  # noqa: E402
+from nhanes_lib.replicates import (  # noqa: E402
+    replicate_design,
+    replicate_problem,
+    replicate_table,
+)
+from nhanes_lib.survey import design_table, survey_design  # noqa: E402
+
 # Output only aggregated results
 print("=" * 70)
 print("NHANES Descriptive Statistics: Older Men and Physical Health Days")
@@ -48,65 +64,67 @@ def weighted_mean_std(x, w):
     return w_mean, w_std
 
 
-def weighted_median(x, w):
-    """Calculate weighted median."""
-    mask = pd.notna(x) & pd.notna(w) & (w > 0)
-    x_clean = x[mask]
-    w_clean = w[mask]
-
-    if len(x_clean) == 0:
-        return np.nan
-
-    sorted_idx = np.argsort(x_clean)
-    x_sorted = x_clean.iloc[sorted_idx]
-    w_sorted = w_clean.iloc[sorted_idx]
-
-    cumsum = np.cumsum(w_sorted)
-    cutoff = w_sorted.sum() / 2
-
-    return x_sorted[cumsum >= cutoff].iloc[0]
-
-
-def weighted_percentile(x, w, p):
-    """Calculate weighted percentile."""
-    mask = pd.notna(x) & pd.notna(w) & (w > 0)
-    x_clean = x[mask]
-    w_clean = w[mask]
-
-    if len(x_clean) == 0:
-        return np.nan
-
-    sorted_idx = np.argsort(x_clean)
-    x_sorted = x_clean.iloc[sorted_idx]
-    w_sorted = w_clean.iloc[sorted_idx]
-
-    cumsum = np.cumsum(w_sorted)
-    cutoff = p * w_sorted.sum() / 100
-
-    return x_sorted[cumsum >= cutoff].iloc[0]
-
-
-def categorical_summary(df, var, weight_col="weight"):
-    """Generate weighted categorical summary."""
-    results = []
-    for cat in df[var].dropna().unique():
-        mask = df[var] == cat
-        n = mask.sum()
-        weighted_n = df.loc[mask, weight_col].sum()
-        weighted_pct = 100 * weighted_n / df[weight_col].sum()
-        results.append({"Category": cat, "N": n, "Weighted_Pct": weighted_pct})
-    return pd.DataFrame(results)
+# Quantiles of the continuous summaries: median, Q1, Q3 (inverted CDF, the
+# first value whose cumulative weight share reaches q)
+SUMMARY_QUANTILES = [0.5, 0.25, 0.75]
+
+# Replicate weights of the replicate SEs: Fay's BRR (rho = 0.3), which
+# unlike the jackknife stays consistent for quantiles
+REPLICATE_METHOD = "fay"
+
+# Continuous variables summarized in Table 1 and the outcome summary
+CONTINUOUS_VARIABLES = [
+    "age",
+    "poverty_ratio",
+    "bmi",
+    "physical_health_days",
+    "mental_health_days",
+    "activity_limitation_days",
+]
+
+# Categorical variables summarized in Table 1
+CATEGORICAL_VARIABLES = [
+    "race_ethnicity",
+    "education",
+    "marital_status",
+    "has_insurance",
+    "smoking_status",
+    "activity_level",
+    "bmi_category",
+    "chronic_cat",
+]
+
+
+def categorical_summary(df, var, weight_col="weight", counts=None):
+    """
+    Generate weighted categorical summary. ``counts`` is a category_table()
+    of ``df`` holding ``var`` (computed for ``var`` alone if not given).
+    """
+    if counts is None:
+        counts = category_table(df, [var], weight_col)
+    counts = counts[counts["variable"] == var]
+    return pd.DataFrame(
+        {
+            "Category": counts["category"].to_list(),
+            "N": counts["n"].to_list(),
+            "Weighted_Pct": counts["percent"].to_list(),
+        }
+    )
 
 
-def continuous_summary(df, var, weight_col="weight"):
-    """Generate weighted continuous summary."""
+def continuous_summary(df, var, weight_col="weight", quantiles=None):
+    """
+    Generate weighted continuous summary. ``quantiles`` is a
+    weighted_quantiles() table of SUMMARY_QUANTILES holding ``var``
+    (computed for ``var`` alone if not given).
+    """
     x = df[var]
     w = df[weight_col]
 
     mean, std = weighted_mean_std(x, w)
-    median = weighted_median(x, w)
-    p25 = weighted_percentile(x, w, 25)
-    p75 = weighted_percentile(x, w, 75)
+    if quantiles is None:
+        quantiles = weighted_quantiles(df, [var], weight_col, SUMMARY_QUANTILES)
+    median, p25, p75 = quantiles.loc[var, SUMMARY_QUANTILES]
 
     return {
         "Variable": var,
@@ -125,12 +143,19 @@ def generate_table1(df):
 
     table_data = []
 
+    # Median/Q1/Q3 of every continuous variable in one pass
+    quantiles = weighted_quantiles(
+        df, CONTINUOUS_VARIABLES, "weight", SUMMARY_QUANTILES
+    )
+    # Counts and weighted shares of every category in one pass
+    counts = category_table(df, CATEGORICAL_VARIABLES, "weight")
+
     # Sample size
     total_n = len(df)
     table_data.append(["Sample Size", f"{total_n:,}", "", ""])
 
     # Age
-    age_stats = continuous_summary(df, "age")
+    age_stats = continuous_summary(df, "age", quantiles=quantiles)
     table_data.append(["Age (years)", "", "", ""])
     table_data.append(
         ["  Mean (SD)", f"{age_stats['Mean']} ({age_stats['SD']})", "", ""]
@@ -145,7 +170,7 @@ def generate_table1(df):
     )
 
     # Race/Ethnicity
-    race_summary = categorical_summary(df, "race_ethnicity")
+    race_summary = categorical_summary(df, "race_ethnicity", counts=counts)
     table_data.append(["Race/Ethnicity", "", "", ""])
     for _, row in race_summary.iterrows():
         table_data.append(
@@ -153,7 +178,7 @@ def generate_table1(df):
         )
 
     # Education
-    edu_summary = categorical_summary(df, "education")
+    edu_summary = categorical_summary(df, "education", counts=counts)
     table_data.append(["Education Level", "", "", ""])
     for _, row in edu_summary.iterrows():
         table_data.append(
@@ -161,7 +186,7 @@ def generate_table1(df):
         )
 
     # Marital Status
-    marital_summary = categorical_summary(df, "marital_status")
+    marital_summary = categorical_summary(df, "marital_status", counts=counts)
     table_data.append(["Marital Status", "", "", ""])
     for _, row in marital_summary.iterrows():
         table_data.append(
@@ -169,7 +194,7 @@ def generate_table1(df):
         )
 
     # Income-to-Poverty Ratio
-    pov_stats = continuous_summary(df, "poverty_ratio")
+    pov_stats = continuous_summary(df, "poverty_ratio", quantiles=quantiles)
     table_data.append(["Income-to-Poverty Ratio", "", "", ""])
     table_data.append(
         ["  Mean (SD)", f"{pov_stats['Mean']} ({pov_stats['SD']})", "", ""]
@@ -184,7 +209,7 @@ def generate_table1(df):
     )
 
     # Health Insurance
-    ins_summary = categorical_summary(df, "has_insurance")
+    ins_summary = categorical_summary(df, "has_insurance", counts=counts)
     table_data.append(["Health Insurance", "", "", ""])
     for _, row in ins_summary.iterrows():
         label = "Has Insurance" if row["Category"] == 1 else "No Insurance"
@@ -193,7 +218,7 @@ def generate_table1(df):
         )
 
     # Smoking Status
-    smoking_summary = categorical_summary(df, "smoking_status")
+    smoking_summary = categorical_summary(df, "smoking_status", counts=counts)
     table_data.append(["Smoking Status", "", "", ""])
     for _, row in smoking_summary.iterrows():
         table_data.append(
@@ -201,7 +226,7 @@ def generate_table1(df):
         )
 
     # Physical Activity
-    activity_summary = categorical_summary(df, "activity_level")
+    activity_summary = categorical_summary(df, "activity_level", counts=counts)
     table_data.append(["Physical Activity Level", "", "", ""])
     for _, row in activity_summary.iterrows():
         table_data.append(
@@ -209,7 +234,7 @@ def generate_table1(df):
         )
 
     # BMI
-    bmi_stats = continuous_summary(df, "bmi")
+    bmi_stats = continuous_summary(df, "bmi", quantiles=quantiles)
     table_data.append(["Body Mass Index (kg/m²)", "", "", ""])
     table_data.append(
         ["  Mean (SD)", f"{bmi_stats['Mean']} ({bmi_stats['SD']})", "", ""]
@@ -224,7 +249,7 @@ def generate_table1(df):
     )
 
     # BMI Categories
-    bmi_cat_summary = categorical_summary(df, "bmi_category")
+    bmi_cat_summary = categorical_summary(df, "bmi_category", counts=counts)
     table_data.append(["BMI Category", "", "", ""])
     for _, row in bmi_cat_summary.iterrows():
         table_data.append(
@@ -234,7 +259,7 @@ def generate_table1(df):
     # Outcomes
     table_data.append(["Outcomes", "", "", ""])
 
-    phys_stats = continuous_summary(df, "physical_health_days")
+    phys_stats = continuous_summary(df, "physical_health_days", quantiles=quantiles)
     table_data.append(
         [
             "  Poor Physical Health Days (0-30)",
@@ -244,7 +269,7 @@ def generate_table1(df):
         ]
     )
 
-    mental_stats = continuous_summary(df, "mental_health_days")
+    mental_stats = continuous_summary(df, "mental_health_days", quantiles=quantiles)
     table_data.append(
         [
             "  Poor Mental Health Days (0-30)",
@@ -254,7 +279,9 @@ def generate_table1(df):
         ]
     )
 
-    activity_stats = continuous_summary(df, "activity_limitation_days")
+    activity_stats = continuous_summary(
+        df, "activity_limitation_days", quantiles=quantiles
+    )
     table_data.append(
         [
             "  Activity Limitation Days (0-30)",
@@ -266,7 +293,7 @@ def generate_table1(df):
 
     # Chronic Conditions
     table_data.append(["Chronic Conditions", "", "", ""])
-    chronic_summary = categorical_summary(df, "chronic_cat")
+    chronic_summary = categorical_summary(df, "chronic_cat", counts=counts)
     for _, row in chronic_summary.iterrows():
         table_data.append(
             [
@@ -325,8 +352,25 @@ def generate_table1_by_chronic(df):
         ]
     )
 
+    # Counts of the categorical rows for every stratum in one pass
+    counts = category_table(
+        df,
+        ["race_ethnicity", "education", "smoking_status", "activity_level"],
+        "weight",
+        by="chronic_cat",
+    )
+    counts = counts.set_index(["chronic_cat", "variable", "category"])
+    stratum_n = counts.groupby(level="chronic_cat")["stratum_n"].first()
+
+    def percents(var, category):
+        """Unweighted % of ``category`` of ``var`` per stratum."""
+        return [
+            f"{100 * counts['n'].get((cat, var, category), 0) / stratum_n[cat]:.1f}"
+            for cat in chronic_cats
+        ]
+
     # Sample sizes
-    ns = [len(df[df["chronic_cat"] == cat]) for cat in chronic_cats]
+    ns = [int(stratum_n.get(cat, 0)) for cat in chronic_cats]
     table_data.append(["n", f"{ns[0]:,}", f"{ns[1]:,}", f"{ns[2]:,}", f"{ns[3]:,}", ""])
 
     # Age
@@ -338,19 +382,11 @@ def generate_table1_by_chronic(df):
     table_data.append(["Age, mean (SD)"] + age_means + [""])
 
     # Race/Ethnicity - Non-Hispanic White %
-    race_pcts = []
-    for cat in chronic_cats:
-        subset = df[df["chronic_cat"] == cat]
-        nhw = (subset["race_ethnicity"] == "Non-Hispanic White").sum()
-        race_pcts.append(f"{100 * nhw / len(subset):.1f}")
+    race_pcts = percents("race_ethnicity", "Non-Hispanic White")
     table_data.append(["Non-Hispanic White, %"] + race_pcts + [""])
 
     # Education - College Graduate %
-    edu_pcts = []
-    for cat in chronic_cats:
-        subset = df[df["chronic_cat"] == cat]
-        college = (subset["education"] == "College Graduate+").sum()
-        edu_pcts.append(f"{100 * college / len(subset):.1f}")
+    edu_pcts = percents("education", "College Graduate+")
     table_data.append(["College Graduate+, %"] + edu_pcts + [""])
 
     # Income-to-Poverty Ratio
@@ -370,19 +406,11 @@ def generate_table1_by_chronic(df):
     table_data.append(["BMI, mean (SD)"] + bmi_means + [""])
 
     # Smoking - Current %
-    smoke_pcts = []
-    for cat in chronic_cats:
-        subset = df[df["chronic_cat"] == cat]
-        current = (subset["smoking_status"] == "Current").sum()
-        smoke_pcts.append(f"{100 * current / len(subset):.1f}")
+    smoke_pcts = percents("smoking_status", "Current")
     table_data.append(["Current Smoker, %"] + smoke_pcts + [""])
 
     # Physical Activity - High %
-    activity_pcts = []
-    for cat in chronic_cats:
-        subset = df[df["chronic_cat"] == cat]
-        high = (subset["activity_level"] == "High").sum()
-        activity_pcts.append(f"{100 * high / len(subset):.1f}")
+    activity_pcts = percents("activity_level", "High")
     table_data.append(["High Physical Activity, %"] + activity_pcts + [""])
 
     # Physical Health Days
@@ -420,6 +448,79 @@ def generate_table1_by_chronic(df):
     return table1_strat
 
 
+def generate_design_se(df):
+    """
+    Design-based SEs of every Table 1 cell, overall and by chronic
+    condition count, from the stratum/PSU design: Taylor linearization
+    (se) and replicate weights (se_replicate, left out with a warning when
+    the design cannot carry replicates).
+    """
+    print("\n--- Generating Design-Based Standard Errors ---")
+
+    design = survey_design(df)
+    overall = design_table(
+        df, design, CONTINUOUS_VARIABLES, CATEGORICAL_VARIABLES, SUMMARY_QUANTILES
+    )
+    overall.insert(0, "chronic_cat", "All")
+    stratified = design_table(
+        df,
+        design,
+        CONTINUOUS_VARIABLES,
+        CATEGORICAL_VARIABLES,
+        SUMMARY_QUANTILES,
+        by="chronic_cat",
+    )
+    cells = pd.concat([overall, stratified], ignore_index=True)
+    print(f"{len(cells):,} cells, {design['df']} design degrees of freedom")
+
+    problem = replicate_problem(df)
+    if problem is None:
+        cells = add_replicate_se(df, cells)
+    else:
+        print(f"  WARNING: no replicate SEs ({problem})")
+
+    cells.to_csv(TABLES_DIR / "table1_design_se.csv", index=False)
+    print(f"Design SEs saved to: {TABLES_DIR / 'table1_design_se.csv'}")
+    return cells
+
+
+def add_replicate_se(df, cells):
+    """
+    Add replicate-weight SEs (se_replicate) to the design_table() ``cells``
+    of generate_design_se, matched on the cell keys.
+    """
+    reps = replicate_design(df, REPLICATE_METHOD)
+    replicate = [
+        replicate_table(
+            df,
+            reps,
+            CONTINUOUS_VARIABLES,
+            CATEGORICAL_VARIABLES,
+            SUMMARY_QUANTILES,
+            by=by,
+        )
+        for by in [None, "chronic_cat"]
+    ]
+    replicate[0].insert(0, "chronic_cat", "All")
+    replicate = pd.concat(replicate, ignore_index=True)
+    keys = ["chronic_cat", "variable", "statistic", "level"]
+    cells = cells.merge(
+        replicate.rename(
+            columns={"estimate": "estimate_replicate", "se": "se_replicate"}
+        ),
+        on=keys,
+        how="left",
+        validate="one_to_one",
+    )
+    if not np.allclose(cells["estimate"], cells["estimate_replicate"], equal_nan=True):
+        raise ValueError("linearization and replicate cells do not match")
+    print(
+        f"Replicate weights: {reps['method']}, {reps['replicates'].shape[1]} "
+        f"replicates{' (cached)' if reps['cached'] else ''}"
+    )
+    return cells.drop(columns="estimate_replicate")
+
+
 def generate_outcome_summary(df):
     """Generate summary statistics for outcome variables."""
     print("\n--- Generating Outcome Summary ---")
@@ -430,9 +531,10 @@ def generate_outcome_summary(df):
         "activity_limitation_days",
     ]
     summary = {}
+    quantiles = weighted_quantiles(df, outcomes, "weight", SUMMARY_QUANTILES)
 
     for outcome in outcomes:
-        stats = continuous_summary(df, outcome)
+        stats = continuous_summary(df, outcome, quantiles=quantiles)
         # Calculate proportions with >=14 days
         severe = (df[outcome] >= 14).sum()
         severe_pct = 100 * severe / df[outcome].notna().sum()
@@ -461,6 +563,7 @@ def main():
     # Generate tables
     table1 = generate_table1(df)
     table1_strat = generate_table1_by_chronic(df)
+    design_se = generate_design_se(df)
     outcome_summary = generate_outcome_summary(df)
 
     print("\n" + "=" * 70)
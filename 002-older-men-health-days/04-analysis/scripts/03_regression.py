@@ -8,6 +8,9 @@ Fits primary and secondary regression models with survey weights
 
 import pandas as pd
 import numpy as np
+import functools
+import os
+import sys
 from pathlib import Path
 import json
 import statsmodels.api as sm
@@ -15,6 +18,18 @@ import statsmodels.formula.api as smf
 from scipy import stats
 import warnings
 
+# Shared NHANES helpers: repo root locally, mounted at /nhanes_lib in the vault
+LIB_ROOT = os.environ.get("NHANES_LIB_ROOT", str(Path(__file__).resolve().parents[3]))
+if LIB_ROOT not in sys.path:
+    sys.path.insert(0, LIB_ROOT)
+
+from nhanes_lib.replicates import (  # noqa: E402
+    replicate_apply,
+    replicate_design,
+    replicate_problem,
+    replicate_variance,
+)
+
 warnings.filterwarnings("ignore")
 
 print("=" * 70)
@@ -26,6 +41,9 @@ DATA_DIR = Path("/study/04-analysis/data")
 OUTPUT_DIR = Path("/study/04-analysis/outputs")
 TABLES_DIR = OUTPUT_DIR / "tables"
 
+# Replicate weights of the replicate SEs: Fay's BRR (rho = 0.3)
+REPLICATE_METHOD = "fay"
+
 
 def load_data():
     """Load the analytic dataset."""
@@ -174,6 +192,57 @@ def fit_negative_binomial(df, outcome, predictors, model_name):
         return None, None
 
 
+def model_coefficients(kind, start, data, weights):
+    """
+    Coefficients of the weighted linear or negative binomial ("nb") model
+    of ``data`` (outcome, then the design matrix; rows with missing values
+    are left out) under ``weights``, starting from ``start``. The estimator
+    re-run per replicate.
+    """
+    valid = data.notna().all(axis=1).to_numpy()
+    endog = data.to_numpy()[valid, 0]
+    exog = data.to_numpy()[valid, 1:]
+    if kind == "linear":
+        return sm.WLS(endog, exog, weights=weights[valid]).fit().params
+    model = sm.GLM(
+        endog,
+        exog,
+        family=sm.families.NegativeBinomial(),
+        freq_weights=weights[valid],
+    )
+    return model.fit(start_params=start).params
+
+
+def add_replicate_se(results, model, df, kind):
+    """
+    Add replicate-weight SEs (se_replicate) to the coefficients of a fitted
+    model; the design matrix is built once and refitted per replicate.
+    Skipped, with a warning, when the design cannot carry replicates.
+    """
+    problem = replicate_problem(df)
+    if problem is not None:
+        print(f"    WARNING: no replicate SEs ({problem})")
+        return results
+
+    data = pd.DataFrame(
+        np.column_stack([model.model.endog, model.model.exog]),
+        index=model.model.data.row_labels,
+    ).reindex(df.index)
+    reps = replicate_design(df, REPLICATE_METHOD)
+    estimator = functools.partial(model_coefficients, kind, np.asarray(model.params))
+    estimate, replicates = replicate_apply(estimator, data, reps)
+    se = np.sqrt(replicate_variance(reps, estimate, replicates))
+
+    for var, error in zip(results["coefficients"], se):
+        results["coefficients"][var]["se_replicate"] = round(error, 3)
+    results["replicate_variance"] = {
+        "method": reps["method"],
+        "rho": reps["rho"],
+        "n_replicates": reps["replicates"].shape[1],
+    }
+    return results
+
+
 def run_primary_analysis(df):
     """Run primary regression analysis."""
     print("\n--- Primary Analysis: Physical Health Days ---")
@@ -244,7 +313,7 @@ def run_primary_analysis(df):
         df, "physical_health_days", fully_adjusted, "Model 3: Fully adjusted"
     )
     if res3:
-        results["model3_linear"] = res3
+        results["model3_linear"] = add_replicate_se(res3, mod3, df, "linear")
         print(f"    R² = {res3['r_squared']:.3f}, n = {res3['n_obs']}")
 
     # Model 4: Negative Binomial (primary)
@@ -253,7 +322,7 @@ def run_primary_analysis(df):
         df, "physical_health_days", fully_adjusted, "Model 4: Negative Binomial"
     )
     if res4:
-        results["model4_nb"] = res4
+        results["model4_nb"] = add_replicate_se(res4, mod4, df, "nb")
         print(f"    Deviance = {res4['deviance']:.2f}, n = {res4['n_obs']}")
 
     return results
@@ -8,12 +8,24 @@ Conducts robustness checks and sensitivity analyses
 
 import pandas as pd
 import numpy as np
+import os
+import sys
 from pathlib import Path
 import json
 import statsmodels.api as sm
 import statsmodels.formula.api as smf
 import warnings
 
+# Shared NHANES helpers: repo root locally, mounted at /nhanes_lib in the vault
+LIB_ROOT = os.environ.get("NHANES_LIB_ROOT", str(Path(__file__).resolve().parents[3]))
+if LIB_ROOT not in sys.path:
+    sys.path.insert(0, LIB_ROOT)
+
+from nhanes_lib.missingness import (  # noqa: E402
+    missingness_profile,
+    report_missingness,
+)
+
 warnings.filterwarnings("ignore")
 
 print("=" * 70)
@@ -305,15 +317,24 @@ def complete_case_vs_imputed(df, predictors):
         "bmi",
     ]
 
-    available_n = {}
-    for var in vars_to_check:
-        available_n[var] = df[var].notna().sum()
+    # Available cases per variable and the missingness patterns behind the
+    # cases a complete-case analysis of all of them would lose
+    profile = missingness_profile(df, vars_to_check, by="cycle")
+    available_n = {
+        var: complete_case_n - counts["missing"]
+        for var, counts in profile["variables"].items()
+    }
 
-    results = {"complete_case_n": complete_case_n, "available_cases": available_n}
+    results = {
+        "complete_case_n": complete_case_n,
+        "available_cases": available_n,
+        "missingness": profile,
+    }
 
     print(f"  Complete case sample: n = {complete_case_n}")
     for var, n in available_n.items():
         print(f"  {var} available: n = {n}")
+    report_missingness(profile)
 
     return results
 
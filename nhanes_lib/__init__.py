@@ -0,0 +1,6 @@
+"""
+NHANES Shared Library
+
+Helpers shared by the study scripts under ``NNN-<study>/04-analysis/scripts``.
+Inside the analysis vault this folder is mounted read-only at /nhanes_lib.
+"""
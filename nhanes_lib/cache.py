@@ -0,0 +1,351 @@
+"""
+NHANES Shared Library: Columnar Domain Cache (cache.py)
+
+Persists parsed NHANES domain files as one .npy array per column so that
+repeat runs skip CSV parsing. Entries are keyed on the source path, size and
+modification time. Columns are populated the first time they are requested,
+so projected reads only ever parse the columns a study needs.
+
+One size cap covers these entries and the stored derived columns and
+replicate weights: when a run exits, entries are evicted least-recently-used
+until all of them fit under it.
+"""
+
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Cache location and size cap (the vault mounts a writable volume here)
+CACHE_DIR = Path(os.environ.get("NHANES_CACHE_DIR", Path.home() / ".cache" / "nhanes"))
+CACHE_MAX_BYTES = int(os.environ.get("NHANES_CACHE_MAX_BYTES", 4 * 1024**3))
+CACHE_ENABLED = os.environ.get("NHANES_CACHE", "1") != "0"
+
+FRAME_META = "frame.json"
+SAFE_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+# Directories whose entries count against CACHE_MAX_BYTES (stores kept
+# elsewhere than under CACHE_DIR add themselves with register_store)
+_STORES = [CACHE_DIR]
+
+
+# ==========================================
+# Frame <-> column files
+# ==========================================
+
+
+def _column_file(name, position):
+    """File stem for a column (NHANES names are plain, anything else is hashed)."""
+    name = str(name)
+    if SAFE_NAME.match(name):
+        return name
+    return f"col{position}_{hashlib.sha1(name.encode()).hexdigest()[:12]}"
+
+
+def _save_array(path, values):
+    # Write then rename so concurrent readers never see a partial file
+    scratch = path.with_name(f".{path.name}.{os.getpid()}")
+    with open(scratch, "wb") as f:
+        np.save(f, values, allow_pickle=values.dtype == object)
+    os.replace(scratch, path)
+
+
+def _encode_column(directory, stem, series):
+    """Write one column and return the metadata needed to rebuild its dtype."""
+    dtype = series.dtype
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        _save_array(directory / f"{stem}.npy", np.asarray(series.cat.codes))
+        return {
+            "kind": "category",
+            "categories": series.cat.categories.tolist(),
+            "ordered": bool(dtype.ordered),
+        }
+
+    if isinstance(dtype, np.dtype):
+        _save_array(directory / f"{stem}.npy", series.to_numpy())
+        return {"kind": "numpy"}
+
+    # Masked extension arrays (Int8, Float32, boolean, ...)
+    array = series.array
+    if hasattr(array, "_data") and hasattr(array, "_mask"):
+        _save_array(directory / f"{stem}.npy", np.asarray(array._data))
+        _save_array(directory / f"{stem}.mask.npy", np.asarray(array._mask))
+        return {"kind": "masked", "dtype": str(dtype)}
+
+    # Anything else (string dtypes etc.) round-trips through object arrays
+    _save_array(directory / f"{stem}.npy", series.to_numpy(dtype=object))
+    return {"kind": "object", "dtype": str(dtype)}
+
+
+def _decode_column(directory, stem, meta, mmap=False):
+    """
+    Rebuild a column written by ``_encode_column``. With mmap=True numeric
+    columns map the file copy-on-write: processes share its pages until one
+    of them writes to a column.
+    """
+    mode = "c" if mmap else None
+    kind = meta["kind"]
+
+    if kind == "numpy":
+        path = directory / f"{stem}.npy"
+        try:
+            return np.load(path, mmap_mode=mode, allow_pickle=False)
+        except ValueError:
+            # Object columns cannot be memory-mapped
+            return np.load(path, allow_pickle=True)
+
+    if kind == "category":
+        codes = np.load(directory / f"{stem}.npy")
+        dtype = pd.CategoricalDtype(meta["categories"], ordered=meta["ordered"])
+        return pd.Categorical.from_codes(codes, dtype=dtype)
+
+    if kind == "masked":
+        data = np.load(directory / f"{stem}.npy", mmap_mode=mode)
+        mask = np.load(directory / f"{stem}.mask.npy", mmap_mode=mode)
+        array_type = pd.api.types.pandas_dtype(meta["dtype"]).construct_array_type()
+        return array_type(data, mask)
+
+    values = np.load(directory / f"{stem}.npy", allow_pickle=True)
+    return pd.array(values, dtype=meta["dtype"])
+
+
+def _save_manifest(directory, manifest):
+    scratch = directory / f".{FRAME_META}.{os.getpid()}"
+    with open(scratch, "w") as f:
+        json.dump(manifest, f)
+    os.replace(scratch, directory / FRAME_META)
+
+
+def load_manifest(directory):
+    """Return the frame.json manifest of a stored frame, or None."""
+    try:
+        with open(Path(directory) / FRAME_META) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_frame(directory, df, append=False, extra=None):
+    """
+    Write a DataFrame as one file per column plus a frame.json manifest.
+
+    With append=True the columns are added to an existing stored frame of the
+    same length. ``extra`` is merged into the manifest (e.g. source header).
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    manifest = load_manifest(directory) if append else None
+    if manifest is None:
+        manifest = {"n_rows": len(df), "columns": []}
+    elif manifest["n_rows"] != len(df):
+        raise ValueError(
+            f"cannot append {len(df)} rows to a stored frame of {manifest['n_rows']}"
+        )
+    manifest.update(extra or {})
+
+    stored = {c["name"] for c in manifest["columns"]}
+    for position, name in enumerate(df.columns):
+        if name in stored:
+            continue
+        stem = _column_file(name, len(manifest["columns"]))
+        meta = _encode_column(directory, stem, df.iloc[:, position])
+        meta.update({"name": name, "file": stem})
+        manifest["columns"].append(meta)
+
+    _save_manifest(directory, manifest)
+    return manifest
+
+
+def read_frame(directory, columns=None, mmap=False, rows=None):
+    """
+    Read a frame written by ``write_frame``, optionally only some columns
+    and only the row positions ``rows`` (with mmap=True other rows are never
+    read from disk). Columns are not copied again: with mmap=True and no
+    ``rows`` the frame is backed by the mapped files themselves.
+    """
+    directory = Path(directory)
+    with open(directory / FRAME_META) as f:
+        manifest = json.load(f)
+
+    entries = manifest["columns"]
+    if columns is not None:
+        by_name = {c["name"]: c for c in entries}
+        entries = [by_name[name] for name in columns if name in by_name]
+
+    data = {c["name"]: _decode_column(directory, c["file"], c, mmap) for c in entries}
+    if rows is None:
+        index = pd.RangeIndex(manifest["n_rows"])
+        return pd.DataFrame(data, index=index, copy=False)
+
+    rows = np.asarray(rows, dtype=np.intp)
+    data = {name: values.take(rows) for name, values in data.items()}
+    return pd.DataFrame(data, index=pd.RangeIndex(len(rows)), copy=False)
+
+
+# ==========================================
+# Source-keyed CSV cache
+# ==========================================
+
+
+def source_key(path):
+    """Cache key for a source file: absolute path + size + mtime."""
+    stat = os.stat(path)
+    token = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(token.encode()).hexdigest()[:20]
+
+
+def _entry_size(entry):
+    return sum(p.stat().st_size for p in entry.iterdir() if p.is_file())
+
+
+def register_store(directory):
+    """Count the entries stored in ``directory`` against the size cap."""
+    directory = Path(directory)
+    if directory not in _STORES:
+        _STORES.append(directory)
+
+
+def _store_entries(directory):
+    """
+    Stored frames directly in ``directory`` or in a store one level below it
+    (derived/, replicates/). The warehouse and partitions sit deeper and are
+    never evicted; scratch directories (".tmp-...") are skipped.
+    """
+    for child in directory.iterdir():
+        if not child.is_dir() or child.name.startswith("."):
+            continue
+        if (child / FRAME_META).exists():
+            yield child
+            continue
+        for entry in child.iterdir():
+            if entry.is_dir() and not entry.name.startswith("."):
+                if (entry / FRAME_META).exists():
+                    yield entry
+
+
+def evict(max_bytes=None, cache_dir=None):
+    """
+    Drop least-recently-used entries until the cache (``cache_dir``, default
+    every registered store) fits under max_bytes.
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    stores = _STORES if cache_dir is None else [Path(cache_dir)]
+
+    found = {}
+    for store in stores:
+        if store.exists():
+            found.update((entry.resolve(), entry) for entry in _store_entries(store))
+    entries = [
+        (entry.stat().st_mtime, _entry_size(entry), entry) for entry in found.values()
+    ]
+    total = sum(size for _, size, _ in entries)
+
+    removed = 0
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def clear_cache(cache_dir=None):
+    """Remove every cached entry."""
+    return evict(max_bytes=0, cache_dir=cache_dir)
+
+
+def _evict_at_exit():
+    # Once per run, in the process that started it (pool workers never exit
+    # through atexit)
+    if not CACHE_ENABLED or multiprocessing.parent_process() is not None:
+        return
+    try:
+        evict()
+    except OSError as e:
+        print(f"  WARNING: cache eviction failed: {e}")
+
+
+atexit.register(_evict_at_exit)
+
+
+def project_columns(header, columns):
+    """Names from ``header`` (in file order) matching ``columns`` case-insensitively."""
+    if columns is None:
+        return list(header)
+    wanted = {str(c).upper() for c in columns}
+    return [name for name in header if str(name).upper() in wanted]
+
+
+def read_csv_cached(path, columns=None, cache_dir=None, header=None):
+    """
+    pd.read_csv with a persistent columnar cache and column projection.
+
+    Only the requested ``columns`` (matched case-insensitively, absent ones
+    ignored) are returned; None means every column. Columns are parsed from
+    the CSV the first time they are requested and served from the cache,
+    with their dtypes intact, afterwards. Falls back to a plain parse if the
+    cache cannot be used. ``header`` (the file's column names, e.g. from the
+    catalog) saves reading it from the file.
+    """
+    path = Path(path)
+    if not CACHE_ENABLED:
+        if columns is None:
+            return pd.read_csv(path)
+        wanted = {str(c).upper() for c in columns}
+        return pd.read_csv(path, usecols=lambda name: name.upper() in wanted)
+
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    entry = cache_dir / source_key(path)
+
+    manifest = load_manifest(entry)
+    if manifest is not None:
+        header = manifest["header"]
+    elif header is None:
+        header = pd.read_csv(path, nrows=0).columns.tolist()
+
+    selected = project_columns(header, columns)
+    if not selected:
+        # None of the requested columns is in the file: its rows, no columns
+        n_rows = manifest["n_rows"] if manifest else len(pd.read_csv(path, usecols=[0]))
+        return pd.DataFrame(index=pd.RangeIndex(n_rows))
+
+    stored = {c["name"] for c in manifest["columns"]} if manifest else set()
+    missing = [name for name in selected if name not in stored]
+
+    cached = None
+    if len(missing) < len(selected):
+        try:
+            cached = read_frame(entry, [n for n in selected if n in stored])
+            os.utime(entry)  # mark as recently used
+        except (OSError, ValueError, KeyError) as e:
+            print(
+                f"  WARNING: cache entry for {path.name} unreadable ({e}), re-parsing"
+            )
+            shutil.rmtree(entry, ignore_errors=True)
+            cached, missing = None, selected
+
+    if not missing:
+        return cached
+
+    parsed = pd.read_csv(path, usecols=missing)
+
+    try:
+        write_frame(entry, parsed, append=True, extra={"header": header})
+        register_store(cache_dir)
+    except (OSError, ValueError) as e:
+        print(f"  WARNING: could not cache {path.name}: {e}")
+
+    if cached is None:
+        return parsed[[n for n in selected if n in parsed.columns]]
+    df = pd.concat([cached, parsed], axis=1)
+    return df[selected]
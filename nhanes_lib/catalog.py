@@ -0,0 +1,230 @@
+"""
+NHANES Shared Library: Data Directory Catalog (catalog.py)
+
+One-time index of the data directory. For every PREFIX_CYCLE domain file
+(.csv, or SAS transport .xpt as published by NHANES) it records the domain,
+cycle, column list, row count and dtypes (sniffed from the first rows). The
+catalog is persisted next to the cache and rebuilt only when the directory
+changes, and then only for the files that changed. Finding a file or its
+columns is a dictionary lookup instead of a glob or a header parse.
+
+Print the catalog with:
+
+    python -m nhanes_lib.catalog [--data-dir /data] [--refresh]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+import pandas as pd
+
+from .cache import CACHE_DIR
+from .parallel import map_ordered
+from .xpt import read_xpt_header
+
+DATA_DIR = Path(os.environ.get("NHANES_DATA_DIR", "/data"))
+
+CATALOG_VERSION = 2
+SNIFF_ROWS = 1000
+DOMAIN_FILE = re.compile(
+    r"^(?P<domain>.+)_(?P<cycle>[A-Za-z])\.(?P<format>csv|xpt)$", re.I
+)
+
+# Per-process memo: data directory -> catalog
+_catalogs = {}
+
+
+def _catalog_path(data_dir):
+    token = hashlib.sha1(str(Path(data_dir).resolve()).encode()).hexdigest()[:12]
+    return CACHE_DIR / "catalog" / f"{token}.json"
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _count_rows(path):
+    """Data rows of a CSV file (lines after the header)."""
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def _sniff_file(task):
+    """Process-pool entry point: schema of one domain file."""
+    path, domain, cycle, file_format = task
+    entry = {
+        "file": path.name,
+        "domain": domain,
+        "cycle": cycle,
+        "format": file_format,
+        "stat": _file_stat(path),
+    }
+
+    if file_format == "xpt":
+        header = read_xpt_header(path)
+        variables = header["variables"]
+        entry["columns"] = [v["name"] for v in variables]
+        entry["dtypes"] = ["float64" if v["type"] == 1 else "object" for v in variables]
+        entry["n_rows"] = header["n_rows"]
+        return entry
+
+    sample = pd.read_csv(path, nrows=SNIFF_ROWS)
+    entry["columns"] = sample.columns.tolist()
+    entry["dtypes"] = [str(dtype) for dtype in sample.dtypes]
+    entry["n_rows"] = _count_rows(path)
+    return entry
+
+
+def build_catalog(data_dir=None, previous=None, workers=None):
+    """
+    Scan data_dir and return a fresh catalog. Entries of ``previous`` (a
+    catalog's "files") whose file is unchanged are reused without re-reading.
+    """
+    data_dir = Path(data_dir or DATA_DIR)
+    previous = previous or {}
+    signature = os.stat(data_dir).st_mtime_ns
+
+    # Converted CSVs win over the .xpt of the same file, and lowercase .csv
+    # over its case variants
+    def preference(name):
+        return (not name.endswith(".csv"), not name.lower().endswith(".csv"), name)
+
+    names = sorted(os.listdir(data_dir), key=preference)
+
+    files, tasks, seen = {}, [], set()
+    for name in names:
+        match = DOMAIN_FILE.match(name)
+        if not match:
+            continue
+        domain, cycle = match["domain"].upper(), match["cycle"].upper()
+        key = f"{domain}_{cycle}"
+        if key in seen:
+            continue
+        seen.add(key)
+
+        path = data_dir / name
+        entry = previous.get(key)
+        if entry and entry["file"] == name and entry["stat"] == _file_stat(path):
+            files[key] = entry
+        else:
+            tasks.append((path, domain, cycle, match["format"].lower()))
+
+    for entry in map_ordered(_sniff_file, tasks, workers):
+        files[f"{entry['domain']}_{entry['cycle']}"] = entry
+
+    return {
+        "version": CATALOG_VERSION,
+        "data_dir": str(data_dir),
+        "signature": signature,
+        "sniff_rows": SNIFF_ROWS,
+        "files": dict(sorted(files.items())),
+    }
+
+
+def _save_catalog(catalog, data_dir):
+    path = _catalog_path(data_dir)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        scratch = path.with_name(f".{path.name}.{os.getpid()}")
+        with open(scratch, "w") as f:
+            json.dump(catalog, f)
+        os.replace(scratch, path)
+    except OSError:
+        pass  # read-only cache: the in-process copy still serves lookups
+
+
+def get_catalog(data_dir=None, refresh=False):
+    """
+    Catalog of data_dir: the in-process copy, else the persisted one, rebuilt
+    when the directory has changed since (or when refresh=True).
+    """
+    data_dir = Path(data_dir or DATA_DIR)
+    try:
+        signature = os.stat(data_dir).st_mtime_ns
+    except OSError:
+        return {"version": CATALOG_VERSION, "data_dir": str(data_dir), "files": {}}
+
+    catalog = _catalogs.get(str(data_dir))
+    if catalog is None:
+        try:
+            with open(_catalog_path(data_dir)) as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            catalog = None
+
+    stale = (
+        catalog is None
+        or catalog.get("version") != CATALOG_VERSION
+        or catalog.get("signature") != signature
+    )
+    if refresh or stale:
+        previous = None if catalog is None else catalog.get("files")
+        # Serial: this runs inside load workers (header sniffs are cheap)
+        catalog = build_catalog(data_dir, previous, workers=1)
+        _save_catalog(catalog, data_dir)
+
+    _catalogs[str(data_dir)] = catalog
+    return catalog
+
+
+def lookup(prefix, cycle, data_dir=None):
+    """Catalog entry of PREFIX_CYCLE (case-insensitive), or None if absent."""
+    data_dir = Path(data_dir or DATA_DIR)
+    key = f"{prefix}_{cycle}".upper()
+    entry = get_catalog(data_dir)["files"].get(key)
+    if entry is None:
+        return None
+
+    # Rewritten in place (the directory itself unchanged): re-sniff
+    try:
+        current = _file_stat(data_dir / entry["file"])
+    except OSError:
+        current = None
+    if current != entry["stat"]:
+        entry = get_catalog(data_dir, refresh=True)["files"].get(key)
+    return entry
+
+
+def domain_columns(prefix, cycle, data_dir=None):
+    """Column names of PREFIX_CYCLE as in the file, or None if absent."""
+    entry = lookup(prefix, cycle, data_dir)
+    return None if entry is None else entry["columns"]
+
+
+def has_variable(prefix, cycle, variable, data_dir=None):
+    """True if PREFIX_CYCLE exists and has ``variable`` (case-insensitive)."""
+    columns = domain_columns(prefix, cycle, data_dir) or []
+    return variable.upper() in {c.upper() for c in columns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the NHANES data catalog")
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--refresh", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir or DATA_DIR)
+    if args.refresh:
+        catalog = build_catalog(data_dir, workers=args.workers)
+        _save_catalog(catalog, data_dir)
+        _catalogs[str(data_dir)] = catalog
+    else:
+        catalog = get_catalog(data_dir)
+    for key, entry in catalog["files"].items():
+        print(f"{key:<16} {entry['n_rows']:>8,} rows  {len(entry['columns']):>4} cols")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+NHANES Shared Library: Categorical Summaries (categorical.py)
+
+Unweighted N, weighted totals and weighted percentages of every category
+of several variables, overall or per stratum, from one pass over the
+data: each variable is factorized once, its codes are combined with the
+stratum codes and offset per variable, and two np.bincount calls (counts
+and weights) over the concatenated codes give every cell of the table.
+This replaces a boolean mask and a weighted sum per category, per
+variable and per stratum.
+
+    table = category_table(df, ["race", "education"], "weight", by="perio_case")
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def category_codes(series, sort):
+    """
+    (codes, categories) of a column; missing values get code -1. ``sort``
+    orders the categories as sorted() would, else by first appearance.
+    """
+    codes, uniques = pd.factorize(series)
+    uniques = list(uniques)
+    if sort and uniques:
+        order = sorted(range(len(uniques)), key=uniques.__getitem__)
+        rank = np.empty(len(order), dtype=np.intp)
+        rank[order] = np.arange(len(order))
+        codes = np.where(codes >= 0, rank[np.maximum(codes, 0)], -1)
+        uniques = [uniques[i] for i in order]
+    return codes, uniques
+
+
+def category_table(df, columns, weights=None, by=None, sort=False):
+    """
+    Category counts of ``columns``, overall or per value of ``by``.
+
+    weights: name of the weight column (missing weights count as 0).
+    sort: categories in sorted order instead of order of appearance.
+
+    Returns a long DataFrame with one row per (stratum,) variable and
+    category, in that order, and the columns n, weighted, percent
+    (weighted share of the stratum's total weight, rows missing the
+    variable included, x 100), stratum_n and stratum_weight.
+    """
+    n_rows = len(df)
+    if weights is None:
+        w = np.ones(n_rows)
+    else:
+        w = df[weights].to_numpy(dtype=np.float64, na_value=np.nan)
+        w = np.where(np.isnan(w), 0.0, w)
+
+    if by is None:
+        strata, stratum_labels = np.zeros(n_rows, dtype=np.intp), [None]
+    else:
+        strata, stratum_labels = category_codes(df[by], sort=True)
+    n_strata = len(stratum_labels)
+
+    # Codes of every variable, offset so that all share one bincount
+    combined, weight_parts, cells, offset = [], [], [], 0
+    for name in columns:
+        codes, categories = category_codes(df[name], sort)
+        valid = (codes >= 0) & (strata >= 0)
+        combined.append(offset + strata[valid] * len(categories) + codes[valid])
+        weight_parts.append(w[valid])
+        cells.append((name, categories, offset))
+        offset += n_strata * len(categories)
+
+    codes = np.concatenate(combined) if combined else np.zeros(0, dtype=np.intp)
+    n = np.bincount(codes, minlength=offset)
+    weighted = np.bincount(
+        codes,
+        weights=np.concatenate(weight_parts) if weight_parts else None,
+        minlength=offset,
+    )
+    grouped = strata >= 0
+    stratum_n = np.bincount(strata[grouped], minlength=n_strata)
+    stratum_weight = np.bincount(
+        strata[grouped], weights=w[grouped], minlength=n_strata
+    )
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shares = (
+            100
+            * weighted
+            / np.concatenate(
+                [
+                    np.repeat(stratum_weight, len(categories))
+                    for _, categories, _ in cells
+                ]
+                or [np.zeros(0)]
+            )
+        )
+
+    rows = []
+    for s, stratum in enumerate(stratum_labels):
+        for name, categories, start in cells:
+            for k, category in enumerate(categories):
+                cell = start + s * len(categories) + k
+                rows.append(
+                    {
+                        **({} if by is None else {by: stratum}),
+                        "variable": name,
+                        "category": category,
+                        "n": int(n[cell]),
+                        "weighted": weighted[cell],
+                        "percent": shares[cell],
+                        "stratum_n": int(stratum_n[s]),
+                        "stratum_weight": stratum_weight[s],
+                    }
+                )
+    columns = ["variable", "category", "n", "weighted", "percent"]
+    columns += ["stratum_n", "stratum_weight"]
+    return pd.DataFrame(rows, columns=([] if by is None else [by]) + columns)
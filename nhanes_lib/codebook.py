@@ -0,0 +1,95 @@
+"""
+NHANES Shared Library: Codebook Masking (codebook.py)
+
+NHANES questionnaire items carry refused/don't-know codes (7/9, 77/99,
+777/999) next to their real values. codebook.json lists, per variable, the
+valid value range and the special codes, with per-cycle overrides where a
+variable's coding changed. mask_special_codes() applies it right after a
+cycle is loaded, in one vectorized pass per variable, so recodes only ever
+see real values or NaN.
+
+Codebook entry:
+
+    "HSQ470": {"label": "...", "valid": [0, 30],
+               "special": {"77": "Refused", "99": "Don't know"},
+               "cycles": {"B": {"valid": [0, 31]}}}
+
+Values that are special codes or outside "valid" become NaN. Either key may
+be omitted. A cycle override replaces the keys it gives for that cycle.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+CODEBOOK_PATH = Path(__file__).with_name("codebook.json")
+
+# Per-process memo: path -> codebook
+_codebooks = {}
+
+
+def load_codebook(path=None):
+    """Codebook as {VARIABLE: entry} (the packaged codebook.json by default)."""
+    path = Path(path or CODEBOOK_PATH)
+    if str(path) not in _codebooks:
+        with open(path) as f:
+            _codebooks[str(path)] = json.load(f)
+    return _codebooks[str(path)]
+
+
+def variable_rules(entry, cycle=None):
+    """An entry with the override of ``cycle`` (if any) applied."""
+    rules = {key: value for key, value in entry.items() if key != "cycles"}
+    if cycle is not None:
+        rules.update(entry.get("cycles", {}).get(str(cycle).upper(), {}))
+    return rules
+
+
+def special_mask(values, rules):
+    """Boolean mask of special codes and out-of-range values (NaN never)."""
+    mask = np.zeros(len(values), dtype=bool)
+    special = [float(code) for code in rules.get("special", {})]
+    if special:
+        mask |= np.isin(values, special)
+    if "valid" in rules:
+        lo, hi = rules["valid"]
+        with np.errstate(invalid="ignore"):
+            mask |= (values < lo) | (values > hi)
+    return mask
+
+
+def mask_special_codes(df, cycle=None, codebook=None):
+    """
+    Set special codes and out-of-range values of every codebook variable in
+    ``df`` to NaN (in place; int columns with masked values become float64).
+
+    Returns (df, {variable: number of values masked}) for variables with at
+    least one masked value.
+    """
+    codebook = load_codebook() if codebook is None else codebook
+    counts = {}
+    for name in df.columns:
+        entry = codebook.get(str(name).upper())
+        if entry is None or df[name].dtype.kind not in "iuf":
+            continue
+        values = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        mask = special_mask(values, variable_rules(entry, cycle))
+        n_masked = int(mask.sum())
+        if n_masked:
+            values = np.where(mask, np.nan, values)
+            if df[name].dtype.kind == "f":
+                values = values.astype(df[name].dtype)
+            df[name] = values
+            counts[name] = n_masked
+    return df, counts
+
+
+def report_masked(counts, indent="  "):
+    """Print the per-variable masked counts of one cycle."""
+    if not counts:
+        print(f"{indent}Codebook: no special codes")
+        return
+    total = sum(counts.values())
+    detail = ", ".join(f"{name} {n}" for name, n in sorted(counts.items()))
+    print(f"{indent}Codebook: {total} special/out-of-range values masked ({detail})")
@@ -0,0 +1,184 @@
+"""
+NHANES Shared Library: Derived-variable Graph (derive.py)
+
+Derived variables are registered as nodes with the columns they read, so a
+study asks for the variables it needs and only those (and what they depend
+on) are evaluated. Each derived column is stored under a key hashed from its
+definition and the content of its inputs. An unchanged variable is read back
+instead of recomputed. After a definition or an input file changes, only the
+invalidated part of the graph is recomputed.
+
+    graph = build_graph(recode_nodes(SPEC) + [derived("n", ["a", "b"], fn)])
+    df, report = evaluate(df, graph, ["n"])
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from .cache import (
+    CACHE_DIR,
+    CACHE_ENABLED,
+    load_manifest,
+    read_frame,
+    register_store,
+    write_frame,
+)
+from .recode import compile_entry, entry_inputs
+
+DERIVED_DIR = Path(os.environ.get("NHANES_DERIVED_DIR", CACHE_DIR / "derived"))
+register_store(DERIVED_DIR)
+
+# Code that computes derived values; editing it invalidates stored columns
+ENGINE_FILES = ("derive.py", "recode.py")
+
+
+def _engine_digest():
+    digest = hashlib.sha1()
+    for name in ENGINE_FILES:
+        digest.update((Path(__file__).parent / name).read_bytes())
+    return digest.hexdigest()
+
+
+_ENGINE = _engine_digest()
+
+
+def derived(name, inputs, compute, definition=None):
+    """
+    Node for a variable computed by ``compute(df)`` from the columns
+    ``inputs``. ``definition`` (JSON-compatible) identifies the computation;
+    by default the source code of ``compute``.
+    """
+    if definition is None:
+        try:
+            definition = inspect.getsource(compute)
+        except (OSError, TypeError):
+            definition = repr(compute)
+    return {
+        "name": name,
+        "inputs": list(inputs),
+        "compute": compute,
+        "definition": definition,
+    }
+
+
+def recode_nodes(spec):
+    """One node per entry of a nhanes_lib.recode spec."""
+    return [
+        derived(entry["name"], entry_inputs(entry), compile_entry(entry), entry)
+        for entry in spec
+    ]
+
+
+def build_graph(nodes):
+    """Index nodes by name; every derived variable may be defined once."""
+    graph = {}
+    for node in nodes:
+        if node["name"] in graph:
+            raise ValueError(f"derived variable {node['name']!r} defined twice")
+        graph[node["name"]] = node
+    return graph
+
+
+def requirements(graph, targets):
+    """Derived variables needed for ``targets``, dependencies first."""
+    order, state = [], {}
+
+    def visit(name, path):
+        if name not in graph or state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            cycle = " -> ".join(path + [name])
+            raise ValueError(f"derived variables form a cycle: {cycle}")
+        state[name] = "visiting"
+        for dependency in graph[name]["inputs"]:
+            visit(dependency, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for target in targets:
+        visit(target, [])
+    return order
+
+
+def column_key(series):
+    """Content hash of a column (values and dtype)."""
+    digest = hashlib.sha1(str(series.dtype).encode())
+    hashed = pd.util.hash_pandas_object(series, index=False)
+    digest.update(hashed.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _load_column(directory):
+    if load_manifest(directory) is None:
+        return None
+    try:
+        values = read_frame(directory)["values"]
+        os.utime(directory)  # mark as recently used
+    except (OSError, ValueError, KeyError):
+        return None
+    return values
+
+
+def _store_column(directory, values):
+    try:
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        scratch = Path(tempfile.mkdtemp(dir=directory.parent, prefix=".tmp-"))
+        write_frame(scratch, pd.DataFrame({"values": values}))
+        try:
+            os.rename(scratch, directory)
+        except OSError:
+            shutil.rmtree(scratch, ignore_errors=True)  # stored concurrently
+        register_store(directory.parent)
+    except (OSError, ValueError) as e:
+        print(f"  WARNING: could not store derived column {directory.name}: {e}")
+
+
+def evaluate(df, graph, targets, store=None):
+    """
+    Add ``targets`` and the derived variables they depend on to ``df``.
+
+    Returns (df, {"computed": [...], "reused": [...]}). Columns are read from
+    and written to ``store`` (default DERIVED_DIR; skipped when the cache is
+    disabled). Inputs that are neither derived nor in ``df`` read as absent.
+    """
+    store = Path(store or DERIVED_DIR)
+    keys, report = {}, {"computed": [], "reused": []}
+
+    def key_of(name):
+        if name not in keys:
+            if name in df.columns:
+                keys[name] = column_key(df[name])
+            else:
+                keys[name] = "absent"
+        return keys[name]
+
+    for name in requirements(graph, targets):
+        node = graph[name]
+        token = json.dumps(
+            [node["definition"], _ENGINE, len(df)]
+            + [[column, key_of(column)] for column in node["inputs"]],
+            sort_keys=True,
+            default=repr,
+        )
+        directory = store / hashlib.sha1(token.encode()).hexdigest()
+
+        stored = _load_column(directory) if CACHE_ENABLED else None
+        if stored is not None:
+            df[name] = stored.array
+            report["reused"].append(name)
+        else:
+            values = node["compute"](df)
+            df[name] = values
+            if CACHE_ENABLED:
+                _store_column(directory, df[name].reset_index(drop=True))
+            report["computed"].append(name)
+        keys[name] = column_key(df[name])
+
+    return df, report
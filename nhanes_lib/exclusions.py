@@ -0,0 +1,192 @@
+"""
+NHANES Shared Library: Exclusion Flow (exclusions.py)
+
+Exclusion criteria are evaluated as boolean masks over the full frame and
+combined with cumulative ANDs, so the flow counts come without
+materializing a filtered copy per step. The analytic sample is then taken
+in one gather of the surviving rows and the columns the analysis needs.
+
+A criterion is (flow-count label, predicate) with predicate(df, keep)
+returning a boolean mask over all rows of df. ``keep`` is the sample
+before that criterion; row-wise criteria ignore it, criteria whose
+statistics depend on the sample so far (e.g. z-scores) use it:
+
+    criteria = [
+        ("perio_exam_complete", lambda df, keep: df["OHDDESTS"] == 1),
+        ("complete_data", complete_cases(["BMXBMI", "INDFMPIR"])),
+        ("no_outliers", within_z(["DR1TKCAL"], 4)),
+    ]
+    keep, counts = evaluate_criteria(df, criteria)
+    analytic = select_rows(df, keep, columns)
+
+For sensitivity analyses every criterion is also a bit of a packed integer
+per participant (criteria_bits). The size of every subset of criteria is
+then read from one histogram of those integers, and the flow counts of
+every order follow from the subset sizes (exclusion_sensitivity). Criteria
+that depend on the sample (within_z) are re-evaluated per subset, after
+the row-wise criteria of that subset.
+"""
+
+import itertools
+
+import numpy as np
+
+from .outliers import outlier_rows
+
+
+def evaluate_criteria(df, criteria, keep=None):
+    """
+    Apply criteria in order as cumulative masks.
+
+    Returns (mask of the rows passing every criterion, {label: rows
+    remaining after that criterion}). ``keep`` restricts the starting
+    sample (default: every row).
+    """
+    keep = np.ones(len(df), dtype=bool) if keep is None else np.array(keep, dtype=bool)
+    counts = {}
+    for label, predicate in criteria:
+        keep &= np.asarray(predicate(df, keep), dtype=bool)
+        counts[label] = int(keep.sum())
+    return keep, counts
+
+
+def complete_cases(columns):
+    """Criterion: no missing value in any of ``columns``."""
+
+    def predicate(df, keep):
+        complete = np.ones(len(df), dtype=bool)
+        for name in columns:
+            complete &= df[name].notna().to_numpy()
+        return complete
+
+    return predicate
+
+
+def within_z(columns, limit, **options):
+    """
+    Criterion: no outlying value in any column, by default |z| <= ``limit``
+    with z-scores from the mean and SD of the current sample (rows where
+    ``keep`` holds). ``options`` (rule, log, weights, by) as for
+    outliers.outlier_cells().
+    """
+
+    def predicate(df, keep):
+        outlier, _ = outlier_rows(df, columns, limit=limit, keep=keep, **options)
+        return ~outlier
+
+    predicate.uses_sample = True
+    return predicate
+
+
+def _uses_sample(predicate):
+    return getattr(predicate, "uses_sample", False)
+
+
+def select_rows(df, keep, columns=None):
+    """The rows of ``df`` where ``keep`` holds, projected to ``columns``."""
+    if columns is None:
+        return df.loc[keep]
+    return df.loc[keep, list(columns)]
+
+
+# ---------------------------------------------------------------------------
+# Sensitivity: subsets and orders of criteria
+# ---------------------------------------------------------------------------
+
+
+def criteria_bits(df, criteria):
+    """
+    Packed criteria per row: bit i is set if the row passes criterion i on
+    its own. Bits of sample-dependent criteria are left unset. The dtype is
+    the smallest unsigned int holding len(criteria) bits.
+    """
+    dtype = np.min_scalar_type((1 << len(criteria)) - 1)
+    bits = np.zeros(len(df), dtype=dtype)
+    everyone = np.ones(len(df), dtype=bool)
+    for i, (_, predicate) in enumerate(criteria):
+        if not _uses_sample(predicate):
+            passed = np.asarray(predicate(df, everyone), dtype=bool)
+            bits |= passed.astype(dtype) << dtype.type(i)
+    return bits
+
+
+def subset_mask(df, criteria, bits, subset):
+    """
+    Sample of a subset of criteria (an int with bit i for criterion i): the
+    row-wise criteria from ``bits``, then the sample-dependent ones in order.
+    """
+    row_wise = sum(
+        1 << i
+        for i, (_, predicate) in enumerate(criteria)
+        if subset >> i & 1 and not _uses_sample(predicate)
+    )
+    keep = (bits & row_wise) == row_wise
+    for i, (_, predicate) in enumerate(criteria):
+        if subset >> i & 1 and _uses_sample(predicate):
+            keep &= np.asarray(predicate(df, keep), dtype=bool)
+    return keep
+
+
+def _superset_counts(bits, n_bits):
+    """Rows whose bits include each pattern, for all 2**n_bits patterns."""
+    table = np.bincount(bits, minlength=1 << n_bits).reshape((2,) * n_bits)
+    for axis in range(n_bits):
+        table = np.flip(np.flip(table, axis).cumsum(axis), axis)
+    # Axis 0 of the table is the highest bit
+    return table.reshape(-1)
+
+
+def exclusion_sensitivity(df, criteria):
+    """
+    Sample size under every subset of criteria, and the flow counts of
+    every order of the row-wise criteria (sample-dependent criteria always
+    follow them, in their given order).
+
+    Returns a JSON-ready dict:
+    {"criteria": labels, "sample_dependent": labels,
+     "subsets": [{"subset", "criteria", "dropped", "n"}],
+     "orders": [{"order": labels, "counts": [n after each]}]}
+    """
+    labels = [label for label, _ in criteria]
+    dependent = [_uses_sample(predicate) for _, predicate in criteria]
+    bits = criteria_bits(df, criteria)
+    supersets = _superset_counts(bits, len(criteria)) if criteria else [len(df)]
+
+    sizes = {}
+    for subset in range(1 << len(criteria)):
+        if any(subset >> i & 1 and dependent[i] for i in range(len(criteria))):
+            sizes[subset] = int(subset_mask(df, criteria, bits, subset).sum())
+        else:
+            sizes[subset] = int(supersets[subset])
+
+    def names(subset, included=True):
+        return [
+            label for i, label in enumerate(labels) if bool(subset >> i & 1) == included
+        ]
+
+    row_wise = [i for i in range(len(criteria)) if not dependent[i]]
+    tail = [i for i in range(len(criteria)) if dependent[i]]
+    orders = []
+    for order in itertools.permutations(row_wise):
+        subset, counts = 0, []
+        for i in list(order) + tail:
+            subset |= 1 << i
+            counts.append(sizes[subset])
+        orders.append(
+            {"order": [labels[i] for i in list(order) + tail], "counts": counts}
+        )
+
+    return {
+        "criteria": labels,
+        "sample_dependent": [labels[i] for i in tail],
+        "subsets": [
+            {
+                "subset": subset,
+                "criteria": names(subset),
+                "dropped": names(subset, included=False),
+                "n": n,
+            }
+            for subset, n in sizes.items()
+        ],
+        "orders": orders,
+    }
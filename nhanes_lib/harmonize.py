@@ -0,0 +1,102 @@
+"""
+NHANES Shared Library: Cross-cycle Harmonization (harmonize.py)
+
+Some variables change name or coding between cycles (OHDEXSTS in 2009-2010
+is OHDDESTS later; ALQ111 replaces ALQ101 in 2017-2018). harmonize.json
+maps each canonical variable to what a cycle holds instead, so studies ask
+for one set of names across B-J and never probe for alternatives:
+
+    "OHDDESTS": {"label": "...", "cycles": {"F": {"rename": "OHDEXSTS"}}}
+
+A cycle operation is either {"rename": source} or a recode entry without
+its name (see recode.py), e.g. {"source": "ALQ111", "map": [[2, 2]]}, which
+derives the canonical variable from the cycle's own. Operations are
+compiled once per cycle: source_variables() turns the variables a study
+reads into the ones the cycle's files hold, and harmonize() turns the
+loaded frame back into canonical names.
+"""
+
+import json
+from pathlib import Path
+
+from .recode import compile_entry, entry_inputs
+
+HARMONIZATION_PATH = Path(__file__).with_name("harmonize.json")
+
+# Per-process memos: path -> map, (path, cycle) -> compiled operations
+_maps = {}
+_compiled = {}
+
+
+def load_harmonization(path=None):
+    """Harmonization map as {VARIABLE: entry} (harmonize.json by default)."""
+    path = Path(path or HARMONIZATION_PATH)
+    if str(path) not in _maps:
+        with open(path) as f:
+            _maps[str(path)] = json.load(f)
+    return _maps[str(path)]
+
+
+def cycle_operations(cycle, path=None):
+    """
+    Compiled operations of one cycle: {"renames": {source: canonical},
+    "derives": [(canonical, inputs, recode)], "sources": {canonical: inputs}}.
+    """
+    memo_key = (str(Path(path or HARMONIZATION_PATH)), str(cycle).upper())
+    if memo_key in _compiled:
+        return _compiled[memo_key]
+
+    renames, derives, sources = {}, [], {}
+    for name, entry in load_harmonization(path).items():
+        operation = entry.get("cycles", {}).get(memo_key[1])
+        if operation is None:
+            continue
+        if "rename" in operation:
+            renames[operation["rename"]] = name
+            sources[name] = [operation["rename"]]
+        else:
+            recode = {k: v for k, v in operation.items() if k != "note"}
+            recode["name"] = name
+            inputs = entry_inputs(recode)
+            derives.append((name, inputs, compile_entry(recode)))
+            sources[name] = inputs
+
+    _compiled[memo_key] = {"renames": renames, "derives": derives, "sources": sources}
+    return _compiled[memo_key]
+
+
+def source_variables(variables, cycle, path=None):
+    """
+    The variables to read from a cycle's files for the canonical
+    ``variables``: each harmonized one is replaced by its sources.
+    """
+    sources = cycle_operations(cycle, path)["sources"]
+    names = []
+    for name in variables:
+        names.extend(sources.get(name, [name]))
+    return list(dict.fromkeys(names))
+
+
+def harmonize(df, cycle, path=None):
+    """
+    Rename and derive a loaded cycle's variables to their canonical names;
+    the sources of derived variables are dropped.
+
+    Returns (frame, {canonical: sources}) for the operations that applied.
+    """
+    operations = cycle_operations(cycle, path)
+    applied = {}
+
+    renames = {s: c for s, c in operations["renames"].items() if s in df.columns}
+    if renames:
+        df = df.rename(columns=renames)
+        applied.update({canonical: [source] for source, canonical in renames.items()})
+
+    for name, inputs, recode in operations["derives"]:
+        present = [source for source in inputs if source in df.columns]
+        if not present:
+            continue
+        df[name] = recode(df)
+        df = df.drop(columns=[source for source in present if source != name])
+        applied[name] = present
+    return df, applied
@@ -0,0 +1,115 @@
+"""
+NHANES Shared Library: Multi-table SEQN Join (join.py)
+
+Left-joins any number of domain tables onto a base table (normally DEMO) in
+one pass. The base keys are hashed once, every domain table is looked up
+against that index, and all columns are gathered straight into the base row
+order, instead of re-hashing and copying an ever-wider frame per pd.merge.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _values(series):
+    """Underlying ndarray (numpy dtypes) or extension array of a column."""
+    if isinstance(series.dtype, np.dtype):
+        return series.to_numpy()
+    return series.array
+
+
+def _gather(values, take, complete):
+    """values[take] with -1 meaning missing, promoting dtypes as pd.merge does."""
+    if complete:
+        return values.take(take)
+
+    if not isinstance(values, np.ndarray):
+        # Extension arrays (nullable ints, categoricals, strings) know their NA
+        return values.take(take, allow_fill=True)
+
+    kind = values.dtype.kind
+    if kind in "iu":
+        out = values.astype(np.float64).take(take)
+        fill = np.nan
+    elif kind == "b":
+        out = values.astype(object).take(take)
+        fill = np.nan
+    elif kind in "mM":
+        out = values.take(take)
+        fill = np.datetime64("NaT") if kind == "M" else np.timedelta64("NaT")
+    else:
+        out = values.take(take)
+        fill = np.nan
+    out[take < 0] = fill
+    return out
+
+
+def gather_into(columns, table, take, key="SEQN"):
+    """
+    Add the non-key columns of ``table``, gathered by row positions ``take``
+    (-1 = no match), to the ordered ``columns`` mapping of a result frame.
+
+    Name clashes follow pd.merge: the existing column becomes <name>_x in
+    place and the new one <name>_y. Returns the updated mapping.
+    """
+    complete = bool((take >= 0).all())
+
+    for name in table.columns:
+        if name == key:
+            continue
+        values = _gather(_values(table[name]), take, complete)
+        if name in columns:
+            # Same suffixing as pd.merge, keeping the left column in place
+            columns = {(f"{k}_x" if k == name else k): v for k, v in columns.items()}
+            name = f"{name}_y"
+        columns[name] = values
+
+    return columns
+
+
+def merge_on_seqn(base, tables, key="SEQN"):
+    """
+    Left-join ``tables`` onto ``base`` on ``key`` in a single pass.
+
+    ``tables`` maps a name (used in error messages) to a DataFrame, or is a
+    plain list; None entries are skipped. Each table must have unique keys.
+    The result matches chained ``pd.merge(..., on=key, how="left")`` calls:
+    base row order, int columns with unmatched rows become float, and
+    clashing column names get the _x/_y suffixes.
+    """
+    if not isinstance(tables, dict):
+        tables = {f"table {i}": df for i, df in enumerate(tables)}
+
+    base_keys = pd.Index(base[key])
+    base_unique = base_keys.is_unique
+    n = len(base)
+
+    columns = {name: _values(base[name]) for name in base.columns}
+
+    for table_name, table in tables.items():
+        if table is None:
+            continue
+
+        value_columns = [c for c in table.columns if c != key]
+        if not value_columns:
+            continue
+
+        table_keys = pd.Index(table[key])
+        if not table_keys.is_unique:
+            dupes = table_keys[table_keys.duplicated()].unique()[:5].tolist()
+            raise ValueError(
+                f"{table_name}: duplicate {key} values (e.g. {dupes}); "
+                "a left join would duplicate participants"
+            )
+
+        # Row of `table` feeding each base row (-1 = no match)
+        if base_unique:
+            positions = base_keys.get_indexer(table_keys)
+            found = positions >= 0
+            take = np.full(n, -1, dtype=np.intp)
+            take[positions[found]] = np.flatnonzero(found)
+        else:
+            take = table_keys.get_indexer(base_keys)
+        columns = gather_into(columns, table, take, key)
+
+    return pd.DataFrame(columns, index=pd.RangeIndex(n))
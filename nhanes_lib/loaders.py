@@ -0,0 +1,85 @@
+"""
+NHANES Shared Library: Domain File Loaders (loaders.py)
+
+Locates NHANES domain files (PREFIX_CYCLE.csv, or the published .xpt)
+through the data catalog and reads them from the warehouse when it is built,
+or through the columnar cache otherwise, optionally projected to the
+variables a study needs and restricted to the participants that pass the
+study's inclusion criteria.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from .cache import read_csv_cached
+from .catalog import DATA_DIR, lookup
+from .exclusions import evaluate_criteria
+from .warehouse import has_table, lookup_rows, read_table
+from .xpt import read_xpt
+
+
+def find_domain_file(prefix, cycle, data_dir=DATA_DIR):
+    """Return the path of PREFIX_CYCLE.csv/.xpt (case-insensitive), or None."""
+    entry = lookup(prefix, cycle, data_dir)
+    return None if entry is None else Path(data_dir) / entry["file"]
+
+
+def apply_criteria(df, criteria):
+    """
+    Apply inclusion criteria to a DEMO frame in order.
+
+    ``criteria`` is a list of (label, predicate) pairs where predicate(df)
+    returns a boolean mask (row-wise: every predicate sees the whole frame
+    and the masks are ANDed). Returns the rows passing every criterion, in
+    one gather, and {label: rows remaining after that criterion}, for flow
+    counts.
+    """
+    keep, counts = evaluate_criteria(
+        df,
+        [(label, lambda df, keep, p=predicate: p(df)) for label, predicate in criteria],
+    )
+    return df[keep].reset_index(drop=True), counts
+
+
+def semi_join(df, seqn, key="SEQN"):
+    """Rows of ``df`` whose key is in ``seqn``, in their original order."""
+    return df[df[key].isin(seqn).to_numpy()].reset_index(drop=True)
+
+
+def load_domain(prefix, cycle, data_dir=DATA_DIR, columns=None, seqn=None):
+    """
+    Load one domain file for one cycle with uppercase column names.
+
+    ``columns`` restricts the read to those variables (SEQN is always kept);
+    variables the file does not have are skipped. ``seqn`` restricts it to
+    those participants (e.g. the SEQNs of the eligible DEMO rows).
+    """
+    entry = lookup(prefix, cycle, data_dir)
+    if entry is None:
+        return None
+    path = Path(data_dir) / entry["file"]
+
+    if columns is not None:
+        columns = ["SEQN"] + [c for c in columns if c.upper() != "SEQN"]
+
+    # Prefer the shared warehouse when it holds the current version of the file
+    if has_table(prefix, cycle, path):
+        rows = None
+        if seqn is not None:
+            try:
+                take = lookup_rows(prefix, cycle, np.asarray(seqn))
+                rows = np.unique(take[take >= 0])
+            except ValueError:
+                # Several rows per participant (e.g. per food item)
+                keys = read_table(prefix, cycle, ["SEQN"])["SEQN"]
+                rows = np.flatnonzero(keys.isin(seqn).to_numpy())
+        return read_table(prefix, cycle, columns, rows=rows)
+
+    if entry.get("format") == "xpt":
+        # Binary and column-addressable already: no cache needed
+        df = read_xpt(path, columns=columns)
+    else:
+        df = read_csv_cached(path, columns=columns, header=entry["columns"])
+        df.columns = df.columns.str.upper()
+    return df if seqn is None else semi_join(df, seqn)
@@ -0,0 +1,155 @@
+"""
+NHANES Shared Library: Outliers (outliers.py)
+
+Flags outlying values of several continuous variables at once. The
+variables are stacked into one column-major float64 matrix and their
+centre and scale come from a single vectorized pass over it, optionally
+survey-weighted and/or per group (e.g. per cycle), instead of a
+dropna/mean/std loop per variable.
+
+Rules (|x - centre| / scale > limit):
+
+- "z": mean and SD (SD with n - 1 unweighted; weighted SD around the
+  weighted mean otherwise)
+- "mad": median and 1.4826 * median absolute deviation (weighted medians
+  by the inverted-CDF rule of quantiles.py)
+
+``log=True`` applies either rule to log(1 + x) (values below 0 are never
+flagged on that scale). Missing values are never outliers, and a variable
+with no spread (scale 0) has none.
+
+The same flags give both outlier semantics used by the studies:
+mask_outliers() sets outlying cells to NaN and outlier_rows() gives the
+rows with any outlying value, to drop.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .quantiles import weighted_quantile_array
+
+RULES = ("z", "mad")
+
+# MAD -> SD of a normal distribution
+MAD_SCALE = 1.4826
+
+
+def _matrix(df, columns):
+    """Columns as a column-major float64 matrix (NaN for missing)."""
+    matrix = np.empty((len(df), len(columns)), dtype=np.float64, order="F")
+    for j, name in enumerate(columns):
+        matrix[:, j] = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+    return matrix
+
+
+def _weighted_median(values, weights):
+    """Per-column weighted median of a matrix, NaN cells ignored."""
+    return np.array(
+        [
+            weighted_quantile_array(values[:, j], weights, [0.5])[0, 0]
+            for j in range(values.shape[1])
+        ]
+    )
+
+
+def column_moments(values, rule="z", weights=None):
+    """
+    Centre and scale of every column of ``values`` (n x k, NaN = missing)
+    under ``rule``; returns two length-k arrays (NaN where undefined).
+    """
+    if rule not in RULES:
+        raise ValueError(f"unknown outlier rule {rule!r}; expected one of {RULES}")
+    valid = ~np.isnan(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if rule == "z" and weights is None:
+            count = valid.sum(axis=0)
+            centre = np.where(valid, values, 0.0).sum(axis=0) / count
+            squares = np.where(valid, (values - centre) ** 2, 0.0).sum(axis=0)
+            scale = np.sqrt(squares / (count - 1))
+        elif rule == "z":
+            w = np.where(valid, weights[:, None], 0.0)
+            total = w.sum(axis=0)
+            centre = (w * np.where(valid, values, 0.0)).sum(axis=0) / total
+            squares = (w * np.where(valid, values - centre, 0.0) ** 2).sum(axis=0)
+            scale = np.sqrt(squares / total)
+        elif weights is None:
+            centre = np.nanmedian(values, axis=0)
+            scale = MAD_SCALE * np.nanmedian(np.abs(values - centre), axis=0)
+        else:
+            centre = _weighted_median(values, weights)
+            scale = MAD_SCALE * _weighted_median(np.abs(values - centre), weights)
+    return centre, scale
+
+
+def outlier_cells(
+    df, columns, rule="z", limit=4, log=False, weights=None, by=None, keep=None
+):
+    """
+    Per-cell outlier flags of ``columns``.
+
+    weights: name of a weight column (rows with a missing weight do not
+        count towards the moments).
+    by: name of a grouping column (e.g. "cycle"); moments per group.
+    keep: rows the moments come from and that can be flagged (default all).
+
+    Returns (n x k bool matrix, {column: number of outlying cells}).
+    """
+    columns = list(columns)
+    values = _matrix(df, columns)
+    if log:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.log1p(np.where(values >= 0, values, np.nan))
+
+    n = len(df)
+    rows = np.ones(n, dtype=bool) if keep is None else np.asarray(keep, dtype=bool)
+    w = None
+    if weights is not None:
+        w = df[weights].to_numpy(dtype=np.float64, na_value=np.nan)
+        rows = rows & ~np.isnan(w)
+    if by is None:
+        groups, n_groups = np.zeros(n, dtype=np.intp), 1
+    else:
+        groups, uniques = pd.factorize(df[by])
+        n_groups = len(uniques)
+
+    cells = np.zeros(values.shape, dtype=bool)
+    for group in range(n_groups):
+        members = np.flatnonzero(rows & (groups == group))
+        if len(members) == 0:
+            continue
+        centre, scale = column_moments(
+            values[members], rule, None if w is None else w[members]
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            deviation = np.abs(values[members] - centre) / scale
+        cells[members] = (deviation > limit) & (scale > 0)
+
+    counts = {name: int(n) for name, n in zip(columns, cells.sum(axis=0))}
+    return cells, counts
+
+
+def outlier_rows(df, columns, **options):
+    """
+    Rows with an outlying value in any of ``columns`` (drop semantics);
+    options as for outlier_cells(). Returns (row mask, {column: count}).
+    """
+    cells, counts = outlier_cells(df, columns, **options)
+    return cells.any(axis=1), counts
+
+
+def mask_outliers(df, columns, **options):
+    """
+    Set outlying cells of ``columns`` to NaN in place; options as for
+    outlier_cells(). Int columns become float64 so that the dtype does not
+    depend on whether the data had outliers.
+
+    Returns (df, {column: number of cells set to NaN}).
+    """
+    columns = list(columns)
+    cells, counts = outlier_cells(df, columns, **options)
+    for j, name in enumerate(columns):
+        if df[name].dtype.kind in "iu":
+            df[name] = df[name].astype(np.float64)
+        if counts[name]:
+            df.loc[cells[:, j], name] = np.nan
+    return df, counts
@@ -0,0 +1,75 @@
+"""
+NHANES Shared Library: Parallel Loading (parallel.py)
+
+Runs independent load tasks (one per cycle or per cycle/domain file) on a
+process pool. Whatever a task prints is captured and replayed in task order,
+so logs, warnings and results come back exactly as a serial loop would give
+them.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Default worker count for load steps (1 = serial)
+LOAD_WORKERS = int(os.environ.get("NHANES_LOAD_WORKERS", os.cpu_count() or 1))
+
+
+def _run_captured(fn, item):
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        result = fn(item)
+    return result, buffer.getvalue()
+
+
+def _pool(workers, executor):
+    if executor == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    # Fork keeps the study script's module-level functions picklable without
+    # re-running the script's top level in every worker
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def iter_captured(fn, items, workers=None, executor="process"):
+    """
+    Apply fn to each item in parallel, yielding (result, printed_output) in
+    item order as soon as each leading task finishes.
+
+    executor is "process" (default) or "thread". Threads share sys.stdout, so
+    in thread mode output is printed directly and the captured text is empty.
+    """
+    items = list(items)
+    workers = min(LOAD_WORKERS if workers is None else workers, len(items))
+
+    if workers <= 1:
+        for item in items:
+            yield _run_captured(fn, item)
+        return
+
+    with _pool(workers, executor) as pool:
+        if executor == "thread":
+            for result in pool.map(fn, items):
+                yield result, ""
+            return
+        futures = [pool.submit(_run_captured, fn, item) for item in items]
+        for future in futures:
+            yield future.result()
+
+
+def map_captured(fn, items, workers=None, executor="process"):
+    """List form of iter_captured: [(result, printed_output), ...]."""
+    return list(iter_captured(fn, items, workers, executor))
+
+
+def map_ordered(fn, items, workers=None, executor="process"):
+    """Apply fn to each item in parallel, replaying output; results in item order."""
+    results = []
+    for result, output in iter_captured(fn, items, workers, executor):
+        sys.stdout.write(output)
+        results.append(result)
+    return results
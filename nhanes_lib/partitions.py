@@ -0,0 +1,92 @@
+"""
+NHANES Shared Library: Per-cycle Partitions (partitions.py)
+
+Persists each cycle's merged and recoded frame as a partition (the same
+per-column .npy layout as the cache). A partition is keyed on its inputs (the
+source files it was built from) and its definition (the code and settings
+that built it, plus this library). When a cycle is added or one file
+changes, only the affected partitions are rebuilt. The pooled sample is then
+assembled from the stored partitions.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from .cache import (
+    CACHE_DIR,
+    CACHE_ENABLED,
+    load_manifest,
+    read_frame,
+    source_key,
+    write_frame,
+)
+
+PARTITION_DIR = Path(os.environ.get("NHANES_PARTITION_DIR", CACHE_DIR / "partitions"))
+
+
+def _describe(obj):
+    """JSON fallback: source for functions, repr otherwise."""
+    if callable(obj):
+        try:
+            return inspect.getsource(obj)
+        except (OSError, TypeError):
+            pass
+    return repr(obj)
+
+
+def _library_source():
+    digest = hashlib.sha1()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def partition_key(inputs, definition):
+    """
+    Key of a partition.
+
+    inputs: source file paths it is built from (None = file absent).
+    definition: functions, constants and settings that shape it; functions
+        are hashed by source code.
+    """
+    digest = hashlib.sha1()
+    for path in inputs:
+        digest.update((source_key(path) if path else "absent").encode())
+    digest.update(json.dumps(definition, default=_describe).encode())
+    digest.update(_library_source().encode())
+    return digest.hexdigest()[:20]
+
+
+def load_partition(study, name, key, root=None):
+    """Return (frame, extra manifest fields) of a current partition, else None."""
+    if not CACHE_ENABLED:
+        return None
+    directory = Path(root or PARTITION_DIR) / study / name
+    manifest = load_manifest(directory)
+    if manifest is None or manifest.get("key") != key:
+        return None
+    try:
+        df = read_frame(directory)
+    except (OSError, ValueError, KeyError):
+        return None
+    return df, manifest.get("extra", {})
+
+
+def save_partition(study, name, key, df, extra=None, root=None):
+    """Store a partition (replacing any older one); failures only warn."""
+    if not CACHE_ENABLED:
+        return
+    target = Path(root or PARTITION_DIR) / study / name
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        scratch = Path(tempfile.mkdtemp(dir=target.parent, prefix=".tmp-"))
+        write_frame(scratch, df, extra={"key": key, "extra": extra or {}})
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(scratch, target)
+    except (OSError, ValueError) as e:
+        print(f"  WARNING: could not store partition {study}/{name}: {e}")
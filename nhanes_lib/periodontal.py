@@ -0,0 +1,351 @@
+"""
+NHANES Shared Library: Periodontal Measurements (periodontal.py)
+
+Vectorized access to the full-mouth periodontal exam (OHXPER). The
+per-site columns OHX{tooth}{LA|PC}{site} (LA = clinical attachment loss,
+PC = pocket depth, in mm) are gathered once into participant x tooth x site
+arrays. Case definitions are then evaluated with threshold masks and
+per-tooth reductions instead of row-wise lookups.
+
+site_tensor() packs all six sites of every tooth as int8 with a validity
+mask (an eighth of the float64 columns). extent_severity() reduces it to
+cohort-wide continuous metrics, and long_view() exposes it one row per
+site for site-level models.
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+# Teeth examined (third molars excluded), NHANES universal numbering
+TEETH = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+TEETH += [18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31]
+
+# Site suffixes: D = distal-facial, M = mid-facial, S = mesial-facial,
+# P = distal-lingual, L = mid-lingual, A = mesial-lingual
+ALL_SITES = ["D", "M", "S", "P", "L", "A"]
+INTERPROXIMAL_SITES = ["D", "S", "P", "A"]
+
+CAL = "LA"  # clinical attachment loss
+PD = "PC"  # probing (pocket) depth
+
+
+def site_column(tooth, measure, site):
+    """Column name of one site measurement, e.g. OHX02LAD."""
+    return f"OHX{tooth:02d}{measure}{site}"
+
+
+# ---------------------------------------------------------------------------
+# Site tensor: every measurement of the exam as int8
+# ---------------------------------------------------------------------------
+
+SITE_DTYPE = np.int8
+
+
+def _int8_sites(df, measure, teeth, sites):
+    values = np.zeros((len(df), len(teeth), len(sites)), dtype=SITE_DTYPE)
+    valid = np.zeros(values.shape, dtype=bool)
+    info = np.iinfo(SITE_DTYPE)
+    for t, tooth in enumerate(teeth):
+        for s, site in enumerate(sites):
+            name = site_column(tooth, measure, site)
+            if name not in df.columns:
+                continue
+            column = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+            present = ~np.isnan(column)
+            observed = column[present]
+            if len(observed) and (
+                not np.array_equal(observed, np.round(observed))
+                or observed.min() < info.min
+                or observed.max() > info.max
+            ):
+                raise ValueError(f"{name}: values are not whole millimetres in int8")
+            values[present, t, s] = observed
+            valid[:, t, s] = present
+    return values, valid
+
+
+def site_tensor(df, teeth=TEETH, sites=ALL_SITES):
+    """
+    Pack the periodontal exam of ``df`` into int8 arrays.
+
+    Returns {"cal", "pd": int8 (participant, tooth, site) in mm (0 where
+    missing), "cal_valid", "pd_valid": bool masks of the same shape,
+    "teeth", "sites", "index": df.index}. Absent columns are all invalid.
+    Raises ValueError if a measurement is not a whole number in int8 range.
+    """
+    cal, cal_valid = _int8_sites(df, CAL, teeth, sites)
+    pd_, pd_valid = _int8_sites(df, PD, teeth, sites)
+    return {
+        "cal": cal,
+        "pd": pd_,
+        "cal_valid": cal_valid,
+        "pd_valid": pd_valid,
+        "teeth": list(teeth),
+        "sites": list(sites),
+        "index": df.index,
+    }
+
+
+def long_view(tensor):
+    """
+    Site-level (participant, tooth, site) layout of a tensor, one entry per
+    site. The measurement and mask arrays are views of the tensor (no copy);
+    participant/tooth/site are the positions into tensor["index"],
+    tensor["teeth"] and tensor["sites"].
+    """
+    n, n_teeth, n_sites = tensor["cal"].shape
+    participant, tooth, site = np.unravel_index(
+        np.arange(n * n_teeth * n_sites), (n, n_teeth, n_sites)
+    )
+    return {
+        "participant": participant,
+        "tooth": tooth.astype(np.int8),
+        "site": site.astype(np.int8),
+        "cal": tensor["cal"].reshape(-1),
+        "pd": tensor["pd"].reshape(-1),
+        "cal_valid": tensor["cal_valid"].reshape(-1),
+        "pd_valid": tensor["pd_valid"].reshape(-1),
+    }
+
+
+def worst_site(tensor, measure="cal"):
+    """Deepest site per tooth: float64 (participant, tooth), NaN if none measured."""
+    values, valid = tensor[measure], tensor[f"{measure}_valid"]
+    worst = np.max(values, axis=2, where=valid, initial=np.iinfo(SITE_DTYPE).min)
+    return np.where(valid.any(axis=2), worst, np.nan)
+
+
+def extent_severity(tensor, thresholds=(3, 4, 6), batch_size=8192):
+    """
+    Per-participant extent and severity metrics, as a DataFrame on
+    tensor["index"]:
+
+    - mean_cal, mean_pd: mean over measured sites
+    - pct_sites_cal_ge_{k}: % of measured CAL sites with CAL >= k
+    - max_cal, max_pd: worst site in the mouth
+    - n_teeth_present: teeth with at least one measured site
+
+    Participants are reduced in batches on the int8 arrays; rows with no
+    measured site get NaN (0 teeth present).
+    """
+    n = tensor["cal"].shape[0]
+    columns = ["mean_cal", "mean_pd"]
+    columns += [f"pct_sites_cal_ge_{k}" for k in thresholds]
+    columns += ["max_cal", "max_pd", "n_teeth_present"]
+    out = {name: np.full(n, np.nan) for name in columns}
+    low = np.iinfo(SITE_DTYPE).min
+
+    for start in range(0, n, batch_size):
+        rows = slice(start, start + batch_size)
+        cal, cal_valid = tensor["cal"][rows], tensor["cal_valid"][rows]
+        pd_, pd_valid = tensor["pd"][rows], tensor["pd_valid"][rows]
+        n_cal = cal_valid.sum(axis=(1, 2))
+        n_pd = pd_valid.sum(axis=(1, 2))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            total = cal.sum(axis=(1, 2), where=cal_valid, dtype=np.int32)
+            out["mean_cal"][rows] = np.where(n_cal > 0, total / n_cal, np.nan)
+            total = pd_.sum(axis=(1, 2), where=pd_valid, dtype=np.int32)
+            out["mean_pd"][rows] = np.where(n_pd > 0, total / n_pd, np.nan)
+            for k in thresholds:
+                hits = ((cal >= k) & cal_valid).sum(axis=(1, 2))
+                pct = np.where(n_cal > 0, 100 * hits / n_cal, np.nan)
+                out[f"pct_sites_cal_ge_{k}"][rows] = pct
+
+        worst = np.max(cal, axis=(1, 2), where=cal_valid, initial=low)
+        out["max_cal"][rows] = np.where(n_cal > 0, worst, np.nan)
+        worst = np.max(pd_, axis=(1, 2), where=pd_valid, initial=low)
+        out["max_pd"][rows] = np.where(n_pd > 0, worst, np.nan)
+
+        measured = (cal_valid | pd_valid).any(axis=2)
+        out["n_teeth_present"][rows] = measured.sum(axis=1)
+
+    return pd.DataFrame(out, index=tensor["index"])
+
+
+# ---------------------------------------------------------------------------
+# Case definitions over shared masks
+# ---------------------------------------------------------------------------
+
+
+def _adjacent_pairs(teeth):
+    """Position pairs (i, i + 1) of neighbouring teeth in the same arch."""
+    upper = [tooth <= 16 for tooth in teeth]
+    return np.array(
+        [
+            teeth[i + 1] == teeth[i] + 1 and upper[i] == upper[i + 1]
+            for i in range(len(teeth) - 1)
+        ],
+        dtype=bool,
+    )
+
+
+def site_masks(tensor, interproximal=INTERPROXIMAL_SITES):
+    """
+    Memoized threshold masks and counts over a site tensor, shared by the
+    case definitions. Each mask or count is computed once however many
+    definitions ask for it.
+
+    Site groups: "interproximal", "buccal_oral" (the other sites of the
+    tensor) and "all".
+
+    - mask(measure, k, group): bool (participant, tooth, site), value >= k
+    - teeth_with(measure, k, group) / sites_with(...): counts per participant
+    - nonadjacent_teeth_with(measure, k, group): True where >= 2 affected
+      teeth are not neighbours in the same arch
+    - worst(measure, group): highest value, NaN if nothing measured
+    - teeth_present(): teeth with any measured site
+    """
+    sites = tensor["sites"]
+    groups = {
+        "all": slice(None),
+        "interproximal": [i for i, s in enumerate(sites) if s in interproximal],
+        "buccal_oral": [i for i, s in enumerate(sites) if s not in interproximal],
+    }
+    memo = {}
+
+    def cached(key, compute):
+        if key not in memo:
+            memo[key] = compute()
+        return memo[key]
+
+    def mask(measure, k, group="interproximal"):
+        def compute():
+            columns = groups[group]
+            values = tensor[measure][:, :, columns]
+            with np.errstate(invalid="ignore"):
+                return (values >= k) & tensor[f"{measure}_valid"][:, :, columns]
+
+        return cached(("mask", measure, k, group), compute)
+
+    def affected_teeth(measure, k, group="interproximal"):
+        return cached(
+            ("teeth", measure, k, group),
+            lambda: mask(measure, k, group).any(axis=2),
+        )
+
+    def teeth_with(measure, k, group="interproximal"):
+        return cached(
+            ("n_teeth", measure, k, group),
+            lambda: affected_teeth(measure, k, group).sum(axis=1),
+        )
+
+    def sites_with(measure, k, group="interproximal"):
+        return cached(
+            ("n_sites", measure, k, group),
+            lambda: mask(measure, k, group).sum(axis=(1, 2)),
+        )
+
+    def nonadjacent_teeth_with(measure, k, group="interproximal"):
+        def compute():
+            affected = affected_teeth(measure, k, group)
+            n_affected = teeth_with(measure, k, group)
+            # Any three teeth include a non-adjacent pair; two are
+            # non-adjacent unless they are neighbours
+            neighbours = affected[:, :-1] & affected[:, 1:] & adjacent
+            return (n_affected >= 3) | ((n_affected == 2) & ~neighbours.any(axis=1))
+
+        return cached(("nonadjacent", measure, k, group), compute)
+
+    def worst(measure, group="interproximal"):
+        def compute():
+            columns = groups[group]
+            values = tensor[measure][:, :, columns].astype(np.float64)
+            valid = tensor[f"{measure}_valid"][:, :, columns]
+            high = np.max(values, axis=(1, 2), where=valid, initial=-np.inf)
+            return np.where(valid.any(axis=(1, 2)), high, np.nan)
+
+        return cached(("worst", measure, group), compute)
+
+    def teeth_present():
+        def compute():
+            measured = tensor["cal_valid"] | tensor["pd_valid"]
+            return measured.any(axis=2).sum(axis=1)
+
+        return cached(("teeth_present",), compute)
+
+    adjacent = _adjacent_pairs(tensor["teeth"])
+    return SimpleNamespace(
+        mask=mask,
+        teeth_with=teeth_with,
+        sites_with=sites_with,
+        nonadjacent_teeth_with=nonadjacent_teeth_with,
+        worst=worst,
+        teeth_present=teeth_present,
+    )
+
+
+def cdc_aap_2012(m):
+    """
+    2012 CDC/AAP (Eke et al.): 3 = severe, 2 = moderate, 1 = mild, 0 = none.
+
+    - severe: CAL >= 6 on >= 2 teeth and PD >= 5 at >= 1 site
+    - moderate: CAL >= 4 on >= 2 teeth, or PD >= 5 on >= 2 teeth
+    - mild: CAL >= 3 at >= 2 sites (any teeth) and either PD >= 4 on
+      >= 2 teeth or PD >= 5 at >= 1 site
+
+    All sites interproximal.
+    """
+    severe = (m.teeth_with("cal", 6) >= 2) & (m.sites_with("pd", 5) >= 1)
+    moderate = (m.teeth_with("cal", 4) >= 2) | (m.teeth_with("pd", 5) >= 2)
+    mild = (m.sites_with("cal", 3) >= 2) & (
+        (m.teeth_with("pd", 4) >= 2) | (m.sites_with("pd", 5) >= 1)
+    )
+    return np.select([severe, moderate, mild], [3, 2, 1], 0).astype(np.int64)
+
+
+def cdc_aap_2012_unique_teeth(m):
+    """cdc_aap_2012 with the mild CAL >= 3 criterion on >= 2 teeth, not sites."""
+    status = cdc_aap_2012(m)
+    return np.where((status == 1) & (m.teeth_with("cal", 3) < 2), 0, status)
+
+
+def aap_efp_2017_stage(m):
+    """
+    Approximate 2017 AAP/EFP stage: 0 = not a case, 1-4 = stage I-IV.
+
+    - case: interproximal CAL >= 1 on >= 2 non-adjacent teeth, or
+      buccal/oral CAL >= 3 with PD >= 4 at the same site on >= 2 teeth
+    - severity: worst interproximal CAL 1-2 mm = I, 3-4 = II, >= 5 = III
+    - complexity raises the stage to II for worst PD 5 mm and III for
+      PD >= 6
+    - stage IV: stage III with fewer than 20 teeth present (tooth loss is
+      taken as periodontal; third molars are not examined)
+
+    Tooth mobility, furcation and bone loss are not in the exam.
+    """
+    buccal = m.mask("cal", 3, "buccal_oral") & m.mask("pd", 4, "buccal_oral")
+    case = m.nonadjacent_teeth_with("cal", 1) | (buccal.any(axis=2).sum(axis=1) >= 2)
+
+    with np.errstate(invalid="ignore"):
+        cal, pd_ = m.worst("cal"), m.worst("pd", "all")
+        severity = np.select([cal >= 5, cal >= 3, cal >= 1], [3, 2, 1], 0)
+        complexity = np.select([pd_ >= 6, pd_ >= 5], [3, 2], 0)
+
+    stage = np.where(case, np.maximum(np.maximum(severity, complexity), 1), 0)
+    stage = np.where((stage == 3) & (m.teeth_present() < 20), 4, stage)
+    return stage.astype(np.int64)
+
+
+# Name -> function(site_masks) returning int64 codes
+DEFINITIONS = {
+    "cdc_aap_2012": cdc_aap_2012,
+    "cdc_aap_2012_unique_teeth": cdc_aap_2012_unique_teeth,
+    "aap_efp_2017_stage": aap_efp_2017_stage,
+}
+
+
+def classify(tensor, definitions=None, interproximal=INTERPROXIMAL_SITES):
+    """
+    Evaluate case definitions over one site tensor, sharing masks and
+    counts between them. Returns a DataFrame on tensor["index"] with one
+    int64 column per definition (default: DEFINITIONS).
+    """
+    masks = site_masks(tensor, interproximal)
+    definitions = DEFINITIONS if definitions is None else definitions
+    return pd.DataFrame(
+        {name: rule(masks) for name, rule in definitions.items()},
+        index=tensor["index"],
+    )
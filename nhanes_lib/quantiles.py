@@ -0,0 +1,113 @@
+"""
+NHANES Shared Library: Weighted Quantiles (quantiles.py)
+
+Survey-weighted quantiles of many variables and groups in one call. Each
+variable is sorted once by (group, value); every requested quantile of
+every group is then found with one searchsorted on the cumulative weights
+of that group's run, instead of re-masking, re-sorting and re-summing the
+column per quantile.
+
+Quantile definitions (F = cumulative weight share of the sorted values):
+
+- "inverted_cdf": the first value with F >= q (the rule the descriptive
+  tables have always used; q = 0.5 is the weighted median)
+- "averaged_inverted_cdf": as inverted_cdf, but the mean of the two
+  values where F == q exactly
+- "midpoint": linear interpolation between the values placed at the
+  midpoints of their weight, (cumulative weight - w / 2) / total
+
+Values or weights that are missing, and weights <= 0, are left out.
+"""
+
+import numpy as np
+import pandas as pd
+
+METHODS = ("inverted_cdf", "averaged_inverted_cdf", "midpoint")
+
+
+def _run_quantiles(values, weights, q, method):
+    """Quantiles ``q`` of one sorted run of values with positive weights."""
+    cumulative = np.cumsum(weights)
+    total = weights.sum()
+    if method == "midpoint":
+        positions = (cumulative - weights / 2) / total
+        return np.interp(q, positions, values)
+    targets = q * total
+    first = np.minimum(
+        np.searchsorted(cumulative, targets, side="left"), len(values) - 1
+    )
+    result = values[first]
+    if method == "averaged_inverted_cdf":
+        exact = (cumulative[first] == targets) & (first + 1 < len(values))
+        following = values[np.minimum(first + 1, len(values) - 1)]
+        result = np.where(exact, (result + following) / 2, result)
+    return result
+
+
+def weighted_quantile_array(
+    values, weights, q, groups=None, n_groups=None, method="inverted_cdf"
+):
+    """
+    Weighted quantiles of one array, per group.
+
+    groups: int codes 0..n_groups - 1 per value (negative = no group);
+        None = one group.
+    Returns an (n_groups, len(q)) float64 array (NaN for empty groups).
+    """
+    if method not in METHODS:
+        raise ValueError(
+            f"unknown quantile method {method!r}; expected one of {METHODS}"
+        )
+    q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if groups is None:
+        groups, n_groups = np.zeros(len(values), dtype=np.intp), 1
+
+    with np.errstate(invalid="ignore"):
+        valid = ~np.isnan(values) & ~np.isnan(weights) & (weights > 0) & (groups >= 0)
+    values, weights, groups = values[valid], weights[valid], groups[valid]
+
+    # One sort by (group, value); each group is then a contiguous run
+    order = np.lexsort((values, groups))
+    values, weights, groups = values[order], weights[order], groups[order]
+    bounds = np.searchsorted(groups, np.arange(n_groups + 1), side="left")
+
+    result = np.full((n_groups, len(q)), np.nan)
+    for group in range(n_groups):
+        start, stop = bounds[group], bounds[group + 1]
+        if stop > start:
+            result[group] = _run_quantiles(
+                values[start:stop], weights[start:stop], q, method
+            )
+    return result
+
+
+def weighted_quantiles(df, columns, weights, q, by=None, method="inverted_cdf"):
+    """
+    Weighted quantiles ``q`` (fractions) of ``columns`` of ``df``, weighted
+    by the ``weights`` column, overall or per value of the ``by`` column.
+
+    Returns a DataFrame with one column per quantile, indexed by variable,
+    or by (group, variable) with ``by``.
+    """
+    q = list(np.atleast_1d(q))
+    w = df[weights].to_numpy(dtype=np.float64, na_value=np.nan)
+    if by is None:
+        groups, labels = None, [None]
+    else:
+        groups, labels = pd.factorize(df[by], sort=True)
+
+    rows, index = [], []
+    for name in columns:
+        values = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        table = weighted_quantile_array(values, w, q, groups, len(labels), method)
+        for label, row in zip(labels, table):
+            rows.append(row)
+            index.append(name if by is None else (label, name))
+
+    if by is None:
+        index = pd.Index(index, name="variable")
+    else:
+        index = pd.MultiIndex.from_tuples(index, names=[by, "variable"])
+    return pd.DataFrame(rows, index=index, columns=q)
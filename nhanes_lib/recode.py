@@ -0,0 +1,319 @@
+"""
+NHANES Shared Library: Declarative Recodes (recode.py)
+
+Derived variables are described as data (JSON-compatible dicts) and compiled
+into a few vectorized NumPy operations each, instead of row-wise apply
+functions or nested np.where chains. A spec is a list of entries, applied in
+order, so later entries can use earlier outputs:
+
+    {"name": "diabetes", "source": "DIQ010", "map": [[[1, 3], 1], [2, 0]]}
+
+Every entry has a "name" and exactly one of these kinds:
+
+- "copy": true -- the source column unchanged (dtype kept)
+- "map": [[codes, value], ...] -- codes is one code or a list of codes
+- "range": [lo, hi] -- source values within lo..hi (inclusive), else NaN
+- "clip": [lo, hi] -- source values limited to lo..hi (null = no limit)
+- "bins": [edges], "labels": [...] -- right-open intervals
+  (-inf, e0), [e0, e1), ..., [ek, inf); len(labels) == len(edges) + 1
+- "rules": [[condition, value], ...] -- the first matching rule wins
+
+Optional keys: "source" (the input column of all kinds except rules),
+"missing": [codes] treated as NaN before the recode (e.g. 7/9, 77/99,
+777/999), and "default": the value where nothing matches (null = NaN).
+
+A value is a number, a label string, null (NaN), or {"column": name} to pass
+that column's value through (rules only). A condition is a dict of
+column -> test, all of which must hold, where a test is a code, a list of
+codes, {"lt"/"le"/"gt"/"ge": x, ...}, "missing" or "present".
+{"any": [conditions]} and {"all": [conditions]} combine conditions.
+
+Columns absent from the frame read as all-NaN. Outputs are float64 when
+every value is numeric, else object arrays with NaN for missing labels.
+"""
+
+import numbers
+
+import numpy as np
+
+KINDS = ("copy", "map", "range", "clip", "bins", "rules")
+COMPARISONS = {
+    "lt": np.less,
+    "le": np.less_equal,
+    "gt": np.greater,
+    "ge": np.greater_equal,
+}
+
+# Integer code maps up to this span use a lookup table, others isin scans
+MAX_TABLE_SPAN = 4096
+
+
+def _column(df, name, missing=()):
+    """float64 values of a column (all NaN if absent), special codes masked."""
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    values = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+    if len(missing):
+        values = np.where(np.isin(values, missing), np.nan, values)
+    return values
+
+
+def _is_numeric(value):
+    return value is None or (
+        isinstance(value, numbers.Number) and not isinstance(value, bool)
+    )
+
+
+def _output(n, values, default):
+    """Empty output array filled with ``default``, float64 or object."""
+    if all(_is_numeric(v) for v in values) and _is_numeric(default):
+        return np.full(n, np.nan if default is None else default, dtype=np.float64)
+    out = np.empty(n, dtype=object)
+    out[:] = np.nan if default is None else default
+    return out
+
+
+def _scalar(value):
+    return np.nan if value is None else value
+
+
+def _codes(codes):
+    return list(codes) if isinstance(codes, (list, tuple)) else [codes]
+
+
+# ---------------------------------------------------------------------------
+# Conditions
+# ---------------------------------------------------------------------------
+
+
+def _compile_test(name, test):
+    if test == "missing":
+        return lambda df: np.isnan(_column(df, name))
+    if test == "present":
+        return lambda df: ~np.isnan(_column(df, name))
+    if isinstance(test, dict):
+        unknown = set(test) - set(COMPARISONS)
+        if unknown:
+            raise ValueError(f"{name}: unknown comparison(s) {sorted(unknown)}")
+
+        def compare(df):
+            values = _column(df, name)
+            result = np.ones(len(df), dtype=bool)
+            with np.errstate(invalid="ignore"):
+                for op, bound in test.items():
+                    result &= COMPARISONS[op](values, bound)
+            return result
+
+        return compare
+    codes = _codes(test)
+    return lambda df: np.isin(_column(df, name), codes)
+
+
+def compile_condition(condition):
+    """Compile a condition (see module docstring) to a function df -> bool array."""
+    if not isinstance(condition, dict) or not condition:
+        raise ValueError(f"condition must be a non-empty dict, got {condition!r}")
+
+    parts = []
+    for key, test in condition.items():
+        if key in ("any", "all"):
+            nested = [compile_condition(c) for c in test]
+            combine = np.logical_or if key == "any" else np.logical_and
+            parts.append(
+                lambda df, nested=nested, combine=combine: combine.reduce(
+                    [f(df) for f in nested]
+                )
+            )
+        else:
+            parts.append(_compile_test(key, test))
+
+    def evaluate(df):
+        result = parts[0](df)
+        for part in parts[1:]:
+            result = result & part(df)
+        return result
+
+    return evaluate
+
+
+# ---------------------------------------------------------------------------
+# Recode kinds
+# ---------------------------------------------------------------------------
+
+
+def _compile_map(entry):
+    pairs = [(_codes(codes), value) for codes, value in entry["map"]]
+    default = entry.get("default")
+    keys = [code for codes, _ in pairs for code in codes]
+    integral = all(float(k).is_integer() for k in keys)
+    lo, hi = (int(min(keys)), int(max(keys))) if keys else (0, 0)
+
+    def recode(df):
+        values = _column(df, entry.get("source"), entry.get("missing", ()))
+        out = _output(len(values), [v for _, v in pairs], default)
+        if not pairs:
+            return out
+
+        if integral and hi - lo <= MAX_TABLE_SPAN:
+            # Lookup table indexed by code - lo
+            table = _output(hi - lo + 1, [v for _, v in pairs], default)
+            for codes, value in reversed(pairs):
+                table[np.asarray(codes, dtype=np.int64) - lo] = _scalar(value)
+            with np.errstate(invalid="ignore"):
+                hit = (values >= lo) & (values <= hi) & (values == np.round(values))
+            out[hit] = table[values[hit].astype(np.int64) - lo]
+        else:
+            # First matching pair wins, as in a dict lookup
+            for codes, value in reversed(pairs):
+                out[np.isin(values, codes)] = _scalar(value)
+        return out
+
+    return recode
+
+
+def _compile_range(entry):
+    lo, hi = entry["range"]
+
+    def recode(df):
+        values = _column(df, entry.get("source"), entry.get("missing", ()))
+        with np.errstate(invalid="ignore"):
+            inside = (values >= lo) & (values <= hi)
+        return np.where(inside, values, _scalar(entry.get("default")))
+
+    return recode
+
+
+def _compile_clip(entry):
+    lo, hi = entry["clip"]
+
+    def recode(df):
+        values = _column(df, entry.get("source"), entry.get("missing", ()))
+        with np.errstate(invalid="ignore"):
+            if lo is not None:
+                values = np.where(values < lo, lo, values)
+            if hi is not None:
+                values = np.where(values > hi, hi, values)
+        return values
+
+    return recode
+
+
+def _compile_bins(entry):
+    edges = np.asarray(entry["bins"], dtype=np.float64)
+    labels = entry["labels"]
+    if len(labels) != len(edges) + 1:
+        raise ValueError(f"{entry['name']}: bins need len(edges) + 1 labels")
+    if np.any(np.diff(edges) <= 0):
+        raise ValueError(f"{entry['name']}: bin edges must increase")
+
+    def recode(df):
+        values = _column(df, entry.get("source"), entry.get("missing", ()))
+        out = _output(len(values), labels, entry.get("default"))
+        table = _output(len(labels), labels, None)
+        table[:] = [_scalar(label) for label in labels]
+        measured = ~np.isnan(values)
+        out[measured] = table[np.searchsorted(edges, values[measured], side="right")]
+        return out
+
+    return recode
+
+
+def _compile_rules(entry):
+    rules = [(compile_condition(cond), value) for cond, value in entry["rules"]]
+    default = entry.get("default")
+    outputs = [v for _, v in rules] + [default]
+    numeric = [v for v in outputs if not isinstance(v, dict)]
+    passthrough = [v["column"] for v in outputs if isinstance(v, dict)]
+
+    def fill(out, where, value, df):
+        if isinstance(value, dict):
+            out[where] = _column(df, value["column"])[where]
+        else:
+            out[where] = _scalar(value)
+
+    def recode(df):
+        n = len(df)
+        out = _output(n, numeric, None if isinstance(default, dict) else default)
+        if passthrough and out.dtype == object:
+            raise ValueError(f"{entry['name']}: column values need numeric outputs")
+        if isinstance(default, dict):
+            fill(out, slice(None), default, df)
+        # Later rules first so the first matching rule has the last word
+        for condition, value in reversed(rules):
+            fill(out, condition(df), value, df)
+        return out
+
+    return recode
+
+
+def _compile_copy(entry):
+    def recode(df):
+        source = entry["source"]
+        if source not in df.columns:
+            return np.full(len(df), np.nan)
+        if entry.get("missing"):
+            return _column(df, source, entry["missing"])
+        return df[source]
+
+    return recode
+
+
+COMPILERS = {
+    "copy": _compile_copy,
+    "map": _compile_map,
+    "range": _compile_range,
+    "clip": _compile_clip,
+    "bins": _compile_bins,
+    "rules": _compile_rules,
+}
+
+
+def compile_entry(entry):
+    """Compile one spec entry to a function df -> output array or Series."""
+    kinds = [kind for kind in KINDS if kind in entry]
+    if "name" not in entry or len(kinds) != 1:
+        raise ValueError(f"recode needs a name and one of {KINDS}: {entry!r}")
+    if kinds[0] != "rules" and "source" not in entry:
+        raise ValueError(f"{entry['name']}: {kinds[0]} recode needs a source")
+    return COMPILERS[kinds[0]](entry)
+
+
+def compile_recodes(spec):
+    """
+    Compile a recode spec (list of entries) once; returns a function that adds
+    the derived columns to a frame, in spec order, and returns it.
+    """
+    steps = [(entry["name"], compile_entry(entry)) for entry in spec]
+
+    def apply(df):
+        for name, recode in steps:
+            df[name] = recode(df)
+        return df
+
+    return apply
+
+
+def apply_recodes(df, spec):
+    """Compile ``spec`` and apply it to ``df`` (adds columns in place)."""
+    return compile_recodes(spec)(df)
+
+
+def _condition_columns(condition):
+    for key, test in condition.items():
+        if key in ("any", "all"):
+            for nested in test:
+                yield from _condition_columns(nested)
+        else:
+            yield key
+
+
+def entry_inputs(entry):
+    """Columns one spec entry reads, in first-use order."""
+    names = [entry.get("source")]
+    for condition, value in entry.get("rules", []):
+        names.extend(_condition_columns(condition))
+        if isinstance(value, dict):
+            names.append(value["column"])
+    if isinstance(entry.get("default"), dict):
+        names.append(entry["default"]["column"])
+    return list(dict.fromkeys(name for name in names if name))
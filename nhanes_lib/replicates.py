@@ -0,0 +1,420 @@
+"""
+NHANES Shared Library: Replicate-Weight Variance (replicates.py)
+
+Replicate weights from the masked variance design (two PSUs per stratum)
+for estimators where linearization is awkward: quantiles, ratios and
+model-derived quantities. The n x R replicate weight matrix is built once
+per analytic sample (design columns, weights and method) and stored in
+the cache, keyed by their content.
+
+Methods (R replicates, theta_r the estimate under replicate r):
+
+- "jk2": paired jackknife, one replicate per stratum with one PSU dropped
+  and the other doubled; var = sum (theta_r - theta) ** 2
+- "brr": balanced repeated replication, half-samples from a Sylvester
+  Hadamard matrix (R = smallest power of 2 above the number of strata);
+  var = sum (theta_r - theta) ** 2 / R
+- "fay": BRR with factors 2 - rho / rho instead of 2 / 0;
+  var = sum (theta_r - theta) ** 2 / (R (1 - rho) ** 2)
+
+Linear statistics (totals, and the means and percents built from them)
+come for the full weights and every replicate from one matrix product
+with the n x (R + 1) weight matrix. Any other estimator is re-run per
+replicate, replicates split over the load worker processes:
+
+    reps = replicate_design(df, "jk2")
+    means = replicate_means(df, reps, ["age", "bmi"], by="group")
+    estimate, replicates = replicate_apply(fit_coefficients, df, reps)
+    se = np.sqrt(replicate_variance(reps, estimate, replicates))
+"""
+
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .cache import (
+    CACHE_DIR,
+    CACHE_ENABLED,
+    load_manifest,
+    read_frame,
+    register_store,
+    write_frame,
+)
+from .categorical import category_codes
+from .parallel import LOAD_WORKERS, map_ordered
+from .quantiles import weighted_quantile_array
+
+METHODS = ("jk2", "brr", "fay")
+
+REPLICATE_DIR = Path(os.environ.get("NHANES_REPLICATE_DIR", CACHE_DIR / "replicates"))
+register_store(REPLICATE_DIR)
+
+# Replicate designs built in this process, by key
+_DESIGNS = {}
+
+
+def _hadamard(order):
+    """Sylvester Hadamard matrix of the smallest power of 2 >= order."""
+    matrix = np.ones((1, 1))
+    while len(matrix) < order:
+        matrix = np.block([[matrix, matrix], [matrix, -matrix]])
+    return matrix
+
+
+def variance_scale(method, rho, n_strata):
+    """Factor of the sum of squared replicate deviations."""
+    if method == "jk2":
+        return 1.0
+    rho = 0.0 if method == "brr" else rho
+    return 1 / (len(_hadamard(n_strata + 1)) * (1 - rho) ** 2)
+
+
+def replicate_factors(stratum, second, n_strata, method="jk2", rho=0.3):
+    """
+    Weight factors (n x R) of a two-PSU-per-stratum design. ``stratum``:
+    stratum code 0..n_strata - 1 per row; ``second``: whether the row is in
+    the stratum's second PSU.
+    """
+    if method == "jk2":
+        factors = np.ones((len(stratum), n_strata))
+        factors[np.arange(len(stratum)), stratum] = np.where(second, 2.0, 0.0)
+        return factors
+    rho = 0.0 if method == "brr" else rho
+    # Column 0 of a Hadamard matrix is all ones; one further column per stratum
+    signs = _hadamard(n_strata + 1)[:, 1 : n_strata + 1]
+    half = signs[:, stratum].T * np.where(second, -1.0, 1.0)[:, None]
+    return 1 + (1 - rho) * half
+
+
+def _design_key(method, rho, columns):
+    digest = hashlib.sha1(f"{method}|{rho}".encode())
+    for values in columns:
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()[:20]
+
+
+def _load_matrix(directory):
+    if not CACHE_ENABLED or load_manifest(directory) is None:
+        return None
+    try:
+        matrix = read_frame(directory).to_numpy(dtype=np.float64)
+        os.utime(directory)  # mark as recently used
+    except (OSError, ValueError, KeyError):
+        return None
+    return matrix
+
+
+def _store_matrix(directory, matrix):
+    if not CACHE_ENABLED:
+        return
+    try:
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        scratch = Path(tempfile.mkdtemp(dir=directory.parent, prefix=".tmp-"))
+        columns = {f"r{r:04d}": matrix[:, r] for r in range(matrix.shape[1])}
+        write_frame(scratch, pd.DataFrame(columns))
+        try:
+            os.rename(scratch, directory)
+        except OSError:
+            shutil.rmtree(scratch, ignore_errors=True)  # stored concurrently
+        register_store(directory.parent)
+    except (OSError, ValueError) as e:
+        print(f"  WARNING: could not store replicate weights {directory.name}: {e}")
+
+
+def _design_codes(df, strata, psu):
+    """
+    ((stratum codes, PSU values, PSUs per stratum), None) of a design that
+    can carry replicate weights, else (None, the reason it cannot).
+    """
+    stratum, _ = pd.factorize(df[strata], sort=True)
+    psu_values = df[psu].to_numpy(dtype=np.float64, na_value=np.nan)
+    if (stratum < 0).any() or np.isnan(psu_values).any():
+        return None, f"missing {strata} or {psu} values in the design"
+    n_psu = df.groupby(stratum)[psu].nunique()
+    if not (n_psu == 2).all():
+        return None, (
+            f"replicate weights need two PSUs per stratum; {int((n_psu != 2).sum())} "
+            "strata have another number"
+        )
+    return (stratum, psu_values, n_psu), None
+
+
+def replicate_problem(df, strata="stratum", psu="psu"):
+    """
+    Why replicate weights cannot be built for ``df`` (e.g. a stratum left
+    with one PSU), or None if they can.
+    """
+    return _design_codes(df, strata, psu)[1]
+
+
+def replicate_design(
+    df,
+    method="jk2",
+    rho=0.3,
+    strata="stratum",
+    psu="psu",
+    weights="weight",
+    store=None,
+):
+    """
+    Replicate weights of ``df`` as a dict: "method", "rho", "key",
+    "scale" (variance factor), "matrix" (n x (R + 1): the full weights,
+    then every replicate), "weights" and "replicates" (views of it) and
+    "cached" (read back rather than built). Missing weights count as 0.
+    Every stratum must have exactly two PSUs.
+    """
+    if method not in METHODS:
+        raise ValueError(
+            f"unknown replicate method {method!r}; expected one of {METHODS}"
+        )
+    rho = {"jk2": None, "brr": 0.0}.get(method, rho)
+
+    w = df[weights].to_numpy(dtype=np.float64, na_value=np.nan)
+    w = np.where(np.isnan(w), 0.0, w)
+    codes, problem = _design_codes(df, strata, psu)
+    if problem is not None:
+        raise ValueError(problem)
+    stratum, psu_values, n_psu = codes
+
+    key = _design_key(method, rho, [w, stratum, psu_values])
+    if key in _DESIGNS:
+        return _DESIGNS[key]
+
+    directory = Path(store or REPLICATE_DIR) / key
+    matrix = _load_matrix(directory)
+    cached = matrix is not None and len(matrix) == len(w)
+    if not cached:
+        first = pd.Series(psu_values).groupby(stratum).transform("min").to_numpy()
+        factors = replicate_factors(
+            stratum, psu_values != first, len(n_psu), method, rho
+        )
+        matrix = np.column_stack([w, w[:, None] * factors])
+        _store_matrix(directory, matrix)
+
+    design = {
+        "method": method,
+        "rho": rho,
+        "key": key,
+        "scale": variance_scale(method, rho, len(n_psu)),
+        "matrix": matrix,
+        "weights": matrix[:, 0],
+        "replicates": matrix[:, 1:],
+        "cached": cached,
+    }
+    _DESIGNS[key] = design
+    return design
+
+
+def replicate_variance(design, estimate, replicates):
+    """
+    Variance of each statistic from its full-sample ``estimate`` (k,) and
+    its replicate estimates (R x k).
+    """
+    deviations = np.asarray(replicates, dtype=np.float64) - np.asarray(estimate)
+    return design["scale"] * (deviations**2).sum(axis=0)
+
+
+def replicate_totals(design, values):
+    """
+    Weighted totals of the columns of ``values`` (n x k, NaN counts as 0)
+    under the full weights and every replicate, from one matrix product.
+    Returns (k,) full-sample totals and R x k replicate totals.
+    """
+    values = np.nan_to_num(
+        np.asarray(values, dtype=np.float64).reshape(len(design["matrix"]), -1)
+    )
+    totals = design["matrix"].T @ values
+    return totals[0], totals[1:]
+
+
+def _groups(df, by):
+    if by is None:
+        return np.zeros(len(df), dtype=np.intp), [None]
+    codes, labels = pd.factorize(df[by], sort=True)
+    return codes, list(labels)
+
+
+def _ratio_cells(design, numerators, denominators):
+    """Ratios of totals with their replicate SEs, numerators and
+    denominators (n x k each) in one matrix product."""
+    k = numerators.shape[1]
+    full, replicates = replicate_totals(design, np.hstack([numerators, denominators]))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        estimate = full[:k] / full[k:]
+        ratios = replicates[:, :k] / replicates[:, k:]
+    return estimate, np.sqrt(replicate_variance(design, estimate, ratios))
+
+
+def _mean_columns(df, columns, groups, labels):
+    keys, numerators, denominators = [], [], []
+    values = [df[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in columns]
+    for g, label in enumerate(labels):
+        for name, y in zip(columns, values):
+            valid = (groups == g) & ~np.isnan(y)
+            keys.append((label, name))
+            numerators.append(np.where(valid, y, 0.0))
+            denominators.append(valid.astype(np.float64))
+    return keys, numerators, denominators
+
+
+def _percent_columns(df, columns, groups, labels, sort):
+    keys, numerators, denominators = [], [], []
+    coded = [(name, *category_codes(df[name], sort)) for name in columns]
+    for g, label in enumerate(labels):
+        domain = (groups == g).astype(np.float64)
+        for name, codes, categories in coded:
+            for k, category in enumerate(categories):
+                keys.append((label, name, category))
+                numerators.append(domain * (codes == k))
+                denominators.append(domain)
+    return keys, numerators, denominators
+
+
+def _frame(keys, estimate, se, by, levels, scale=1):
+    if by is None:
+        keys, names = [key[1:] for key in keys], levels
+    else:
+        names = [by] + levels
+    if len(names) == 1:
+        index = pd.Index([key[0] for key in keys], name=names[0])
+    else:
+        index = pd.MultiIndex.from_tuples(keys, names=names)
+    return pd.DataFrame({"estimate": scale * estimate, "se": scale * se}, index=index)
+
+
+def _matrix(columns, n):
+    return np.column_stack(columns) if columns else np.zeros((n, 0))
+
+
+def replicate_means(df, design, columns, by=None):
+    """
+    Weighted means of ``columns`` with replicate SEs, overall or per value
+    of ``by``; DataFrame (estimate, se) indexed by (group,) variable.
+    """
+    groups, labels = _groups(df, by)
+    keys, numerators, denominators = _mean_columns(df, list(columns), groups, labels)
+    estimate, se = _ratio_cells(
+        design, _matrix(numerators, len(df)), _matrix(denominators, len(df))
+    )
+    return _frame(keys, estimate, se, by, ["variable"])
+
+
+def replicate_proportions(df, design, columns, by=None, sort=False):
+    """
+    Weighted percents of every category of ``columns`` (of the group's
+    total weight, as categorical.category_table) with replicate SEs;
+    DataFrame (estimate, se) indexed by (group,) variable, category.
+    """
+    groups, labels = _groups(df, by)
+    keys, numerators, denominators = _percent_columns(
+        df, list(columns), groups, labels, sort
+    )
+    estimate, se = _ratio_cells(
+        design, _matrix(numerators, len(df)), _matrix(denominators, len(df))
+    )
+    return _frame(keys, estimate, se, by, ["variable", "category"], 100)
+
+
+def _apply_chunk(task):
+    estimator, df, weights = task
+    return np.array(
+        [
+            np.asarray(estimator(df, weights[:, r]), dtype=np.float64)
+            for r in range(weights.shape[1])
+        ]
+    )
+
+
+def replicate_apply(estimator, df, design, workers=None):
+    """
+    Run ``estimator(df, weights)`` (returning a 1-D array of statistics)
+    with the full weights and with every replicate's weights. Replicates
+    are split into one chunk per worker process (NHANES_LOAD_WORKERS by
+    default); the estimator must be a module-level function.
+
+    Returns (full-sample estimate (k,), replicate estimates R x k).
+    """
+    estimate = np.asarray(estimator(df, design["weights"]), dtype=np.float64)
+    replicates = design["replicates"]
+    workers = LOAD_WORKERS if workers is None else workers
+    chunks = np.array_split(
+        np.arange(replicates.shape[1]), max(1, min(workers, replicates.shape[1]))
+    )
+    tasks = [(estimator, df, replicates[:, chunk]) for chunk in chunks if len(chunk)]
+    results = map_ordered(_apply_chunk, tasks, workers=len(tasks))
+    return estimate, np.vstack(results).reshape(replicates.shape[1], -1)
+
+
+def _quantile_statistics(columns, q, groups, n_groups, df, weights):
+    """Quantiles of every group and column (group-major) under ``weights``."""
+    tables = [
+        weighted_quantile_array(
+            df[name].to_numpy(dtype=np.float64, na_value=np.nan),
+            weights,
+            q,
+            groups,
+            n_groups,
+        )
+        for name in columns
+    ]
+    return np.stack(tables, axis=1).reshape(-1)
+
+
+def replicate_quantiles(df, design, columns, q, by=None, workers=None):
+    """
+    Weighted quantiles ``q`` of ``columns`` (quantiles.py rule) with
+    replicate SEs, re-estimated per replicate in parallel; DataFrame
+    (estimate, se) indexed by (group,) variable, quantile.
+    """
+    columns, q = list(columns), list(np.atleast_1d(q))
+    groups, labels = _groups(df, by)
+    keys = [(label, name, p) for label in labels for name in columns for p in q]
+    if not columns:
+        return _frame(keys, np.zeros(0), np.zeros(0), by, ["variable", "quantile"])
+
+    estimator = functools.partial(_quantile_statistics, columns, q, groups, len(labels))
+    estimate, replicates = replicate_apply(estimator, df[columns], design, workers)
+    se = np.sqrt(replicate_variance(design, estimate, replicates))
+    return _frame(keys, estimate, se, by, ["variable", "quantile"])
+
+
+def replicate_table(
+    df, design, continuous, categorical, q=(0.5,), by=None, sort=False, workers=None
+):
+    """
+    Replicate SEs of the cells of survey.design_table(): means and
+    quantiles ``q`` of ``continuous``, percents of the categories of
+    ``categorical``, overall or per value of ``by``. Same long layout and
+    row order: (by,) variable, statistic, level, estimate, se.
+    """
+    means = replicate_means(df, design, continuous, by)
+    quantiles = replicate_quantiles(df, design, continuous, q, by, workers)
+    percents = replicate_proportions(df, design, categorical, by, sort)
+
+    rows = []
+    for cells, statistic in [
+        (means, "mean"),
+        (quantiles, "quantile"),
+        (percents, "percent"),
+    ]:
+        for key, estimate, se in zip(cells.index, cells["estimate"], cells["se"]):
+            key = key if isinstance(key, tuple) else (key,)
+            if by is None:
+                key = (None,) + key
+            level = key[2] if len(key) > 2 else None
+            rows.append((key[0], key[1], statistic, level, estimate, se))
+
+    _, labels = _groups(df, by)
+    rank = {label: g for g, label in enumerate(labels)}
+    rows.sort(key=lambda row: rank[row[0]])
+    table = pd.DataFrame(
+        rows,
+        columns=[by or "group", "variable", "statistic", "level", "estimate", "se"],
+    )
+    return table.drop(columns="group") if by is None else table
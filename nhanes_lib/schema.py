@@ -0,0 +1,108 @@
+"""
+NHANES Shared Library: Compact Dtype Schema (schema.py)
+
+After pd.read_csv every NHANES code lands as float64 and recoded labels as
+Python object strings. compact_dtypes() shrinks a frame without changing any
+value:
+
+- int columns -> smallest numpy int (int8/16/32)
+- low-cardinality integral float codes (with or without missing values) ->
+  float32, which is exact for codes and keeps NaN and float formatting; or
+  pandas nullable IntX with nullable=True
+- string labels -> pandas categoricals
+
+Continuous measurements (non-integral or high-cardinality) stay float64 so
+means and models are not computed at reduced precision.
+"""
+
+import numpy as np
+import pandas as pd
+
+INT_TYPES = [np.int8, np.int16, np.int32]
+NULLABLE_INT_TYPES = {np.int8: "Int8", np.int16: "Int16", np.int32: "Int32"}
+
+# Largest integer float32 represents exactly
+FLOAT32_EXACT = 2**24
+
+
+def _smallest_int(lo, hi):
+    for int_type in INT_TYPES:
+        info = np.iinfo(int_type)
+        if info.min <= lo and hi <= info.max:
+            return int_type
+    return None
+
+
+def _compact_numeric(series, nullable, max_code_values):
+    values = series.to_numpy()
+
+    if values.dtype.kind in "iu":
+        if len(values) == 0:
+            return series
+        int_type = _smallest_int(values.min(), values.max())
+        return series if int_type is None else series.astype(int_type)
+
+    observed = values[~np.isnan(values)]
+    if len(observed) == 0 or not np.isfinite(observed).all():
+        return series
+    if not np.array_equal(observed, np.round(observed)):
+        return series
+
+    int_type = _smallest_int(observed.min(), observed.max())
+    if int_type is None or np.abs(observed).max() >= FLOAT32_EXACT:
+        return series
+    if len(np.unique(observed)) > max_code_values:
+        return series
+
+    if nullable:
+        return series.astype(NULLABLE_INT_TYPES[int_type])
+    return series.astype(np.float32)
+
+
+def compact_dtypes(df, nullable=False, max_code_values=128, exclude=("SEQN",)):
+    """
+    Return ``df`` with compact dtypes (see module docstring); values are
+    unchanged. Columns in ``exclude`` are left alone.
+    """
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        dtype = series.dtype
+
+        if name in exclude or isinstance(dtype, pd.CategoricalDtype):
+            columns[name] = series
+        elif isinstance(dtype, np.dtype) and dtype.kind in "iuf":
+            columns[name] = _compact_numeric(series, nullable, max_code_values)
+        elif pd.api.types.is_string_dtype(dtype) or dtype == object:
+            labels = series.dropna()
+            # Only label-like columns: repeated values, all strings
+            if (
+                len(labels) > 0
+                and labels.nunique() <= len(labels) // 2
+                and labels.map(type).eq(str).all()
+            ):
+                columns[name] = series.astype("category")
+            else:
+                columns[name] = series
+        else:
+            columns[name] = series
+
+    return pd.DataFrame(columns, index=df.index)
+
+
+def drop_unused_categories(df):
+    """Remove categories no longer present (e.g. after exclusions) in place."""
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.CategoricalDtype):
+            df[name] = df[name].cat.remove_unused_categories()
+    return df
+
+
+def memory_report(df, stage):
+    """Print and return the deep memory footprint of ``df`` at a pipeline stage."""
+    n_bytes = int(df.memory_usage(deep=True).sum())
+    print(
+        f"  Memory [{stage}]: {n_bytes / 1024**2:,.1f} MB "
+        f"({len(df):,} rows x {df.shape[1]} columns)"
+    )
+    return n_bytes
@@ -0,0 +1,297 @@
+"""
+NHANES Shared Library: Design-Based Standard Errors (survey.py)
+
+Taylor-linearization SEs for the cells of descriptive tables under the
+NHANES design (strata, PSUs within strata, sample weights). Each cell is
+an estimator with a linearized score per participant (weight x influence
+value); the scores of all cells form one n x k matrix, its PSU totals come
+from one grouped sum over the rows sorted by (stratum, PSU), and the
+with-replacement variance between the PSUs of each stratum,
+
+    var = sum_h n_h / (n_h - 1) * sum_j (z_hj - mean_j z_hj) ** 2,
+
+gives every SE at once:
+
+    design = survey_design(df)
+    table = design_table(df, design, ["age", "bmi"], ["education"], by="group")
+
+Cells:
+
+- means: influence (y - mean) / W_d over the domain's rows with y
+- percents of categories: the mean of a category indicator; the
+  denominator is the domain's total weight, rows missing the variable
+  included (as categorical.category_table)
+- quantiles: Woodruff's method; the SE of the weighted CDF at the
+  estimate, q +- z * SE mapped back through the quantile function
+  (quantiles.py rule) and halved over 2 z
+
+Domains (``by``) are estimated over the full design, so their SEs carry
+the randomness of the domain size. Strata with one PSU add no variance.
+"""
+
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from .categorical import category_codes
+from .quantiles import weighted_quantile_array
+
+
+def survey_design(df, strata="stratum", psu="psu", weights="weight"):
+    """
+    Design of ``df`` as a dict: the weights (missing = 0), the row order
+    by (stratum, PSU), the first sorted row of every PSU, the first PSU of
+    every stratum, PSUs per stratum and the design degrees of freedom
+    (PSUs - strata).
+    """
+    w = df[weights].to_numpy(dtype=np.float64, na_value=np.nan)
+    w = np.where(np.isnan(w), 0.0, w)
+    stratum_codes, _ = pd.factorize(df[strata], sort=True)
+    psu_codes, psu_labels = pd.factorize(df[psu], sort=True)
+    if (stratum_codes < 0).any() or (psu_codes < 0).any():
+        raise ValueError(f"missing {strata} or {psu} values in the design")
+
+    width = max(len(psu_labels), 1)
+    key = stratum_codes.astype(np.int64) * width + psu_codes
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    psu_starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else []
+    psu_strata = key[psu_starts] // width
+    stratum_starts = np.flatnonzero(
+        np.r_[True, psu_strata[1:] != psu_strata[:-1]] if len(psu_strata) else []
+    )
+    n_psu = np.diff(np.r_[stratum_starts, len(psu_starts)]).astype(np.intp)
+    return {
+        "weights": w,
+        "order": order,
+        "psu_starts": np.asarray(psu_starts, dtype=np.intp),
+        "stratum_starts": stratum_starts,
+        "n_psu": n_psu,
+        "psu_stratum": np.repeat(np.arange(len(n_psu)), n_psu),
+        "df": int(len(psu_starts) - len(n_psu)),
+    }
+
+
+def linearized_variance(design, scores):
+    """
+    Design variance of the estimators whose linearized scores are the
+    columns of ``scores`` (n x k, rows in the order of the design frame).
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.ndim == 1:
+        scores = scores[:, None]
+    if not len(design["psu_starts"]):
+        return np.zeros(scores.shape[1])
+
+    # PSU totals of every column in one grouped sum, then centred per stratum
+    totals = np.add.reduceat(scores[design["order"]], design["psu_starts"], axis=0)
+    n_psu = design["n_psu"]
+    means = np.add.reduceat(totals, design["stratum_starts"], axis=0) / n_psu[:, None]
+    centred = totals - means[design["psu_stratum"]]
+    factor = np.where(n_psu > 1, n_psu / np.maximum(n_psu - 1, 1), 0.0)
+    return (factor[design["psu_stratum"], None] * centred**2).sum(axis=0)
+
+
+def _groups(df, by):
+    if by is None:
+        return np.zeros(len(df), dtype=np.intp), [None]
+    codes, labels = pd.factorize(df[by], sort=True)
+    return codes, list(labels)
+
+
+def _values(df, name):
+    return df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _mean_cells(df, w, columns, groups, labels):
+    """Keys (group, variable), weighted means and their scores."""
+    if not columns:
+        return [], np.zeros(0), np.zeros((len(df), 0))
+    values = np.column_stack([_values(df, name) for name in columns])
+    keys, estimates, scores = [], [], []
+    for g, label in enumerate(labels):
+        valid = ~np.isnan(values) & (groups == g)[:, None]
+        weight = np.where(valid, w[:, None], 0.0)
+        total = weight.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (weight * np.where(valid, values, 0.0)).sum(axis=0) / total
+            score = weight * (values - mean) / total
+        keys += [(label, name) for name in columns]
+        estimates.append(mean)
+        scores.append(np.where(valid & (total > 0), score, 0.0))
+    return keys, np.concatenate(estimates), np.hstack(scores)
+
+
+def _proportion_cells(df, w, columns, groups, labels, sort):
+    """Keys (group, variable, category), category shares and their scores."""
+    coded = [(name, *category_codes(df[name], sort)) for name in columns]
+    keys, estimates, scores = [], [], []
+    for g, label in enumerate(labels):
+        domain = groups == g
+        total = w[domain].sum()
+        for name, codes, categories in coded:
+            indicator = codes[:, None] == np.arange(len(categories))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                share = (w[domain, None] * indicator[domain]).sum(axis=0) / total
+                score = w[:, None] * (indicator - share) / total
+            keys += [(label, name, category) for category in categories]
+            estimates.append(share)
+            scores.append(np.where(domain[:, None] & (total > 0), score, 0.0))
+    if not scores:
+        return keys, np.zeros(0), np.zeros((len(df), 0))
+    return keys, np.concatenate(estimates), np.hstack(scores)
+
+
+def _quantile_cells(df, w, columns, q, groups, labels):
+    """
+    Keys (group, variable, q), weighted quantiles, and the scores of the
+    weighted CDF at each quantile (for the Woodruff inversion).
+    """
+    if not columns:
+        return [], np.zeros(0), np.zeros((len(df), 0))
+    q = np.asarray(q, dtype=np.float64)
+    values = [_values(df, name) for name in columns]
+    estimates = np.stack(
+        [weighted_quantile_array(y, w, q, groups, len(labels)) for y in values],
+        axis=1,
+    )
+
+    keys, scores = [], []
+    for g, label in enumerate(labels):
+        for name, y, estimate in zip(columns, values, estimates[g]):
+            keys += [(label, name, p) for p in q]
+            valid = (groups == g) & ~np.isnan(y) & (w > 0)
+            total = w[valid].sum()
+            below = y[:, None] <= estimate[None, :]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                cdf = (w[valid, None] * below[valid]).sum(axis=0) / total
+                score = w[:, None] * (below - cdf) / total
+            scores.append(np.where(valid[:, None] & (total > 0), score, 0.0))
+    return keys, estimates.reshape(-1), np.hstack(scores)
+
+
+def _woodruff(df, w, columns, q, groups, labels, cdf_se, level):
+    """Quantile SEs from the SEs of the CDF at each quantile."""
+    q = np.asarray(q, dtype=np.float64)
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    cdf_se = cdf_se.reshape(len(labels), len(columns), len(q))
+    se = np.full(cdf_se.shape, np.nan)
+    for j, name in enumerate(columns):
+        # Bounds of every group in one call (one sort of the column)
+        lower = np.clip(q - z * cdf_se[:, j], 0, 1)
+        upper = np.clip(q + z * cdf_se[:, j], 0, 1)
+        bounds = np.nan_to_num(np.concatenate([lower, upper], axis=1).reshape(-1))
+        values = weighted_quantile_array(
+            _values(df, name), w, bounds, groups, len(labels)
+        )
+        values = values.reshape(len(labels), len(labels), 2, len(q))
+        for g in range(len(labels)):
+            se[g, j] = (values[g, g, 1] - values[g, g, 0]) / (2 * z)
+    se[np.isnan(cdf_se)] = np.nan
+    return se.reshape(-1)
+
+
+def _frame(keys, estimates, variance, by, levels, scale=1):
+    if by is None:
+        keys = [key[1:] for key in keys]
+        names = levels
+    else:
+        names = [by] + levels
+    if len(names) == 1:
+        index = pd.Index([key[0] for key in keys], name=names[0])
+    else:
+        index = pd.MultiIndex.from_tuples(keys, names=names)
+    return pd.DataFrame(
+        {"estimate": scale * estimates, "se": scale * np.sqrt(variance)},
+        index=index,
+    )
+
+
+def design_means(df, design, columns, by=None):
+    """
+    Weighted means of ``columns`` with linearized SEs, overall or per value
+    of ``by``; DataFrame (estimate, se) indexed by variable or (group,
+    variable).
+    """
+    groups, labels = _groups(df, by)
+    keys, estimates, scores = _mean_cells(
+        df, design["weights"], list(columns), groups, labels
+    )
+    variance = linearized_variance(design, scores)
+    return _frame(keys, estimates, variance, by, ["variable"])
+
+
+def design_proportions(df, design, columns, by=None, sort=False):
+    """
+    Weighted percents of every category of ``columns`` with linearized
+    SEs; DataFrame (estimate, se) indexed by (group,) variable, category.
+    """
+    groups, labels = _groups(df, by)
+    keys, estimates, scores = _proportion_cells(
+        df, design["weights"], list(columns), groups, labels, sort
+    )
+    variance = linearized_variance(design, scores)
+    return _frame(keys, estimates, variance, by, ["variable", "category"], 100)
+
+
+def design_quantiles(df, design, columns, q, by=None, level=0.95):
+    """
+    Weighted quantiles ``q`` of ``columns`` with Woodruff SEs (from a
+    ``level`` interval); DataFrame (estimate, se) indexed by (group,)
+    variable, quantile.
+    """
+    columns, q = list(columns), list(np.atleast_1d(q))
+    groups, labels = _groups(df, by)
+    w = design["weights"]
+    keys, estimates, scores = _quantile_cells(df, w, columns, q, groups, labels)
+    cdf_se = np.sqrt(linearized_variance(design, scores))
+    se = _woodruff(df, w, columns, q, groups, labels, cdf_se, level)
+    return _frame(keys, estimates, se**2, by, ["variable", "quantile"])
+
+
+def design_table(
+    df, design, continuous, categorical, q=(0.5,), by=None, sort=False, level=0.95
+):
+    """
+    Every cell of a descriptive table with its SE from one variance pass:
+    means and quantiles ``q`` of ``continuous``, percents of the categories
+    of ``categorical``, overall or per value of ``by``.
+
+    Returns a long DataFrame with the columns (by,) variable, statistic
+    ("mean", "quantile" or "percent"), level (quantile or category),
+    estimate and se.
+    """
+    continuous, categorical, q = list(continuous), list(categorical), list(q)
+    groups, labels = _groups(df, by)
+    w = design["weights"]
+    means = _mean_cells(df, w, continuous, groups, labels)
+    quantiles = _quantile_cells(df, w, continuous, q, groups, labels)
+    percents = _proportion_cells(df, w, categorical, groups, labels, sort)
+
+    # All scores in one matrix -> one grouped sum over the PSUs
+    scores = np.hstack([means[2], quantiles[2], percents[2]])
+    se = np.sqrt(linearized_variance(design, scores))
+    n_means, n_quantiles = len(means[0]), len(quantiles[0])
+    mean_se = se[:n_means]
+    quantile_se = _woodruff(
+        df, w, continuous, q, groups, labels, se[n_means : n_means + n_quantiles], level
+    )
+    percent_se = se[n_means + n_quantiles :]
+
+    rows = []
+    for (label, name), estimate, error in zip(means[0], means[1], mean_se):
+        rows.append((label, name, "mean", None, estimate, error))
+    for (label, name, p), estimate, error in zip(*quantiles[:2], quantile_se):
+        rows.append((label, name, "quantile", p, estimate, error))
+    for (label, name, category), estimate, error in zip(*percents[:2], percent_se):
+        rows.append((label, name, "percent", category, 100 * estimate, 100 * error))
+
+    # Group-major, in the order of the variables given
+    rank = {label: g for g, label in enumerate(labels)}
+    rows.sort(key=lambda row: rank[row[0]])
+    table = pd.DataFrame(
+        rows,
+        columns=[by or "group", "variable", "statistic", "level", "estimate", "se"],
+    )
+    return table.drop(columns="group") if by is None else table
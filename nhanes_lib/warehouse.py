@@ -0,0 +1,232 @@
+"""
+NHANES Shared Library: Local Warehouse (warehouse.py)
+
+Materializes every domain file of every cycle in the data directory into
+memory-mappable per-column .npy files with a sorted SEQN index, once. Study
+processes then map the same files instead of each parsing its own copy of
+the CSVs, so they share the OS page cache.
+
+Build (or refresh changed files) with:
+
+    python -m nhanes_lib.warehouse [--data-dir /data] [--root DIR]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .cache import (
+    CACHE_DIR,
+    load_manifest,
+    project_columns,
+    read_frame,
+    source_key,
+    write_frame,
+)
+from .catalog import DATA_DIR, get_catalog
+from .join import gather_into
+from .parallel import map_ordered
+from .xpt import read_xpt
+
+WAREHOUSE_DIR = Path(os.environ.get("NHANES_WAREHOUSE_DIR", CACHE_DIR / "warehouse"))
+INDEX_FILE = "index.json"
+
+
+# ==========================================
+# Build
+# ==========================================
+
+
+def _table_dir(root, domain, cycle):
+    return Path(root) / cycle.upper() / domain.upper()
+
+
+def load_index(root=None):
+    """Return the warehouse index ({"tables": {...}}), empty if not built."""
+    try:
+        with open(Path(root or WAREHOUSE_DIR) / INDEX_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"tables": {}}
+
+
+def _build_table(task):
+    """Process-pool entry point: materialize one source file."""
+    path, domain, cycle, root = task
+    if path.suffix.lower() == ".xpt":
+        df = read_xpt(path)
+    else:
+        df = pd.read_csv(path)
+        df.columns = df.columns.str.upper()
+
+    target = _table_dir(root, domain, cycle)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    scratch = Path(tempfile.mkdtemp(dir=target.parent, prefix=".tmp-"))
+
+    extra = {"source": str(path), "key": source_key(path)}
+    write_frame(scratch, df, extra=extra)
+    if "SEQN" in df.columns:
+        # Sorted SEQN index: positions that put the rows in SEQN order
+        order = np.argsort(df["SEQN"].to_numpy(), kind="stable")
+        np.save(scratch / "_seqn_order.npy", order)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(scratch, target)
+    print(f"  {domain}_{cycle}: {len(df):,} rows x {df.shape[1]} columns")
+    return {
+        "domain": domain,
+        "cycle": cycle,
+        "source": str(path),
+        "key": extra["key"],
+        "n_rows": len(df),
+        "columns": df.columns.tolist(),
+    }
+
+
+def build_warehouse(data_dir=None, root=None, workers=None, force=False):
+    """
+    Materialize every PREFIX_CYCLE.csv/.xpt in data_dir; unchanged files are
+    kept.
+
+    Returns the updated index.
+    """
+    data_dir = Path(data_dir or DATA_DIR)
+    root = Path(root or WAREHOUSE_DIR)
+    root.mkdir(parents=True, exist_ok=True)
+    index = load_index(root)
+
+    tasks = []
+    for entry in get_catalog(data_dir)["files"].values():
+        path = data_dir / entry["file"]
+        domain, cycle = entry["domain"], entry["cycle"]
+        current = index["tables"].get(f"{domain}_{cycle}")
+        if force or current is None or current["key"] != source_key(path):
+            tasks.append((path, domain, cycle, root))
+
+    print(f"Warehouse {root}: {len(tasks)} table(s) to (re)build")
+    for entry in map_ordered(_build_table, tasks, workers):
+        index["tables"][f"{entry['domain']}_{entry['cycle']}"] = entry
+
+    scratch = root / f".{INDEX_FILE}.{os.getpid()}"
+    with open(scratch, "w") as f:
+        json.dump(index, f)
+    os.replace(scratch, root / INDEX_FILE)
+    return index
+
+
+# ==========================================
+# Query
+# ==========================================
+
+
+def has_table(domain, cycle, path=None, root=None):
+    """
+    True if the warehouse holds domain/cycle (and, when the source ``path`` is
+    given, it was built from the current version of that file).
+    """
+    table_dir = _table_dir(root or WAREHOUSE_DIR, domain, cycle)
+    manifest = load_manifest(table_dir)
+    if manifest is None:
+        return False
+    return path is None or manifest.get("key") == source_key(path)
+
+
+def read_table(domain, cycle, columns=None, root=None, rows=None):
+    """
+    Memory-mapped read of one warehouse table (columns case-insensitive),
+    optionally only the row positions ``rows``.
+    """
+    table_dir = _table_dir(root or WAREHOUSE_DIR, domain, cycle)
+    manifest = load_manifest(table_dir)
+    names = [c["name"] for c in manifest["columns"]]
+    return read_frame(table_dir, project_columns(names, columns), True, rows)
+
+
+def lookup_rows(domain, cycle, seqn, root=None):
+    """Row positions of ``seqn`` values in a warehouse table (-1 if absent)."""
+    table_dir = _table_dir(root or WAREHOUSE_DIR, domain, cycle)
+    order = np.load(table_dir / "_seqn_order.npy")
+    keys = np.load(table_dir / "SEQN.npy", mmap_mode="r")[order]
+
+    if len(keys) > 1 and (keys[1:] == keys[:-1]).any():
+        raise ValueError(
+            f"{domain}_{cycle}: duplicate SEQN values; "
+            "a left join would duplicate participants"
+        )
+
+    seqn = np.asarray(seqn)
+    slot = np.searchsorted(keys, seqn).clip(max=len(keys) - 1)
+    found = keys[slot] == seqn if len(keys) else np.zeros(len(seqn), bool)
+    return np.where(found, order[slot], -1)
+
+
+def select(domains, columns=None, cycles=None, where=None, root=None):
+    """
+    Query the warehouse.
+
+    domains: domain prefixes; the first (usually DEMO) is the base table and
+        the others are left-joined onto it on SEQN.
+    columns: list applied to every domain, or dict domain -> list; None = all.
+    cycles: cycle letters (default: every cycle that has the base domain).
+    where: optional callable(base_frame) -> boolean mask applied to the base
+        rows before any other domain is touched.
+
+    Returns one frame stacked in cycle order with a ``cycle`` column.
+    """
+    root = root or WAREHOUSE_DIR
+    base_domain = domains[0].upper()
+    if cycles is None:
+        cycles = sorted(
+            t["cycle"]
+            for t in load_index(root)["tables"].values()
+            if t["domain"] == base_domain
+        )
+
+    def wanted(domain):
+        cols = columns.get(domain) if isinstance(columns, dict) else columns
+        return None if cols is None else ["SEQN"] + list(cols)
+
+    frames = []
+    for cycle in cycles:
+        if not has_table(base_domain, cycle, root=root):
+            continue
+        base = read_table(base_domain, cycle, wanted(base_domain), root)
+        if where is not None:
+            base = base[np.asarray(where(base), dtype=bool)].reset_index(drop=True)
+
+        result = {name: base[name] for name in base.columns}
+        for domain in domains[1:]:
+            domain = domain.upper()
+            if not has_table(domain, cycle, root=root):
+                continue
+            table = read_table(domain, cycle, wanted(domain), root)
+            take = lookup_rows(domain, cycle, base["SEQN"].to_numpy(), root)
+            result = gather_into(result, table, take)
+
+        frame = pd.DataFrame(result, index=pd.RangeIndex(len(base)))
+        frame["cycle"] = cycle
+        frames.append(frame)
+
+    if not frames:
+        raise ValueError(f"No {base_domain} tables in warehouse {root}")
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the NHANES warehouse")
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--root", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    build_warehouse(args.data_dir, args.root, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()